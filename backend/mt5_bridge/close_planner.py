@@ -0,0 +1,213 @@
+import os
+import time
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import registry
+
+STOPOUT_ENGINE_PATH = os.environ.get("STOPOUT_ENGINE_PATH", "MT5StopOutEngine.exe")
+# Parallel DealerSend calls per stop-out, all on the caller's leased manager session. This relies on
+# IMTManagerAPI being thread-safe (MetaQuotes documents the manager interface as safe to call from
+# several threads); set CLOSE_SEND_THREADS=1 to serialise the sends if a binding is not.
+CLOSE_SEND_THREADS = int(os.environ.get("CLOSE_SEND_THREADS", "8"))
+# After this, requests not sent yet are cancelled (fallback delete); sends already on the wire are
+# still joined, so nothing runs on the session once the caller releases its lease
+CLOSE_CONFIRM_TIMEOUT = float(os.environ.get("CLOSE_CONFIRM_TIMEOUT", "10"))
+
+# MT_RET_OK, MT_RET_REQUEST_DONE (used when the binding doesn't expose EnMTAPIRetcode)
+DEFAULT_OK_CODES = (0, 10009)
+
+def _val(obj, *names, default=None):
+    for name in names:
+        if hasattr(obj, name): return getattr(obj, name)
+    return default
+
+class ClosePlanner:
+    """
+    Closes every open position of a login with as few round trips as possible:
+
+    0. MT5StopOutEngine.exe (if present) runs once for the login, not once per position;
+       whatever it leaves open goes through the native path.
+    1. Plan: positions grouped by symbol, one price lookup per symbol.
+    2. Submit: all TA_STOPOUT_POSITION requests go out concurrently, then the confirmations are collected.
+    3. Positions without a successful confirmation fall back to the synthetic delete.
+    `manager` is the caller's (leased) manager session, `api` the MT5Manager module/constants.
+    """
+    def __init__(self, manager, api, engine_path=STOPOUT_ENGINE_PATH, timeout=CLOSE_CONFIRM_TIMEOUT):
+        self.manager = manager
+        self.api = api
+        self.engine_path = engine_path
+        self.timeout = timeout
+        self.left_open = 0 # Positions close_all couldn't close (failed fallback)
+
+    def close_all(self, login):
+        started = time.perf_counter()
+        self.left_open = 0
+        positions = self.manager.PositionRequest(login) or []
+        positions = [p for p in positions if _val(p, "Position", "Ticket", "Deal", default=0) > 0]
+        if not positions: return 0
+
+        total = len(positions)
+        positions = self._run_engine(login, positions)
+
+        failed = []
+        if positions:
+            try:
+                failed = self.submit(login, self.plan(positions))
+            except Exception as e:
+                print(f"   ℹ️ Native Attempt Error: {e}")
+                failed = positions # Nothing confirmed: everything goes to the fallback
+        lost = [pos for pos in failed if not self._synthetic_close(pos)]
+
+        self.left_open = len(lost)
+        closed = total - self.left_open
+        registry.observe("stopout_close_ms", (time.perf_counter() - started) * 1000.0)
+        print(f"   ✅ {login}: closed {closed}/{total} positions ({len(failed)} via fallback delete)")
+        return closed
+
+    def _run_engine(self, login, positions):
+        """External C++ tool: one run per login. Returns the positions still open afterwards."""
+        if not os.path.exists(self.engine_path):
+            return positions
+        try:
+            result = subprocess.run([self.engine_path, str(login)], capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"   ⚠️ External StopOut Failed: {result.stderr}")
+                return positions
+            print(f"   ✅ External StopOut Success: {login}")
+            remaining = self.manager.PositionRequest(login) or []
+            return [p for p in remaining if _val(p, "Position", "Ticket", "Deal", default=0) > 0]
+        except Exception as e:
+            print(f"   ⚠️ External Tool Error: {e}")
+            return positions
+
+    def plan(self, positions):
+        """symbol -> [(position, close price)], each symbol's price fetched once"""
+        by_symbol = defaultdict(list)
+        for pos in positions:
+            by_symbol[_val(pos, "Symbol", default="")].append(pos)
+
+        plan = {}
+        for symbol, group in by_symbol.items():
+            bid, ask = self._price(symbol)
+            # Type 0 = Buy (closes at Bid), Type 1 = Sell (closes at Ask)
+            plan[symbol] = [(pos, bid if _val(pos, "Type", default=0) == 0 else ask) for pos in group]
+        return plan
+
+    def _price(self, symbol):
+        try:
+            if hasattr(self.manager, "SymbolInfoGet"):
+                info = self.manager.SymbolInfoGet(symbol)
+                if info:
+                    return _val(info, "Bid", default=0.0), _val(info, "Ask", default=0.0)
+            if hasattr(self.manager, "TickLast"):
+                tick = self.manager.TickLast(symbol)
+                if tick:
+                    return _val(tick, "bid", "Bid", default=0.0), _val(tick, "ask", "Ask", default=0.0)
+        except Exception:
+            pass
+        return 0.0, 0.0
+
+    def _request(self, login, pos, price):
+        api = self.api
+        req = api.MTRequest()
+        if req is None:
+            return None # Known library bug
+        req.Action = api.MTRequest.EnTradeActions.TA_STOPOUT_POSITION if hasattr(api.MTRequest, "EnTradeActions") else api.EnTradeActions.TA_STOPOUT_POSITION
+        req.Login = login
+        req.Position = _val(pos, "Position", "Ticket", "Deal", default=0)
+        req.Symbol = pos.Symbol
+        req.Volume = int(_val(pos, "Volume", default=0))
+        req.Price = price
+        req.Comment = "STOP OUT"
+        try:
+            req.Type = api.MTRequest.EnOrderType.OP_SELL if pos.Type == 0 else api.MTRequest.EnOrderType.OP_BUY
+            req.TypeFilling = api.MTRequest.EnOrderFilling.ORDER_FILLING_FOK
+        except Exception:
+            pass
+        return req
+
+    def _send(self, req):
+        res = self.api.MTConfirm()
+        if not self.manager.DealerSend(req, res):
+            return None
+        return res.ResultRetcode
+
+    def _ok_codes(self):
+        codes = getattr(self.api, "EnMTAPIRetcode", None)
+        try:
+            return (codes.MT_RET_OK, codes.MT_RET_REQUEST_DONE)
+        except AttributeError:
+            return DEFAULT_OK_CODES
+
+    def submit(self, login, plan):
+        """
+        Sends every close concurrently and waits for the confirmations.
+        Returns the positions that were rejected or never sent. Every send has returned by then.
+        """
+        if not hasattr(self.api, "MTRequest"):
+            return [pos for group in plan.values() for pos, _ in group]
+
+        ok_codes = self._ok_codes()
+        requests = []
+        failed = []
+        for symbol, group in plan.items():
+            for pos, price in group:
+                try:
+                    req = self._request(login, pos, price)
+                except Exception as e:
+                    print(f"   ℹ️ Native Attempt Error: {e}")
+                    req = None
+                if req is None:
+                    failed.append(pos)
+                    continue
+                requests.append((req, pos))
+        if not requests:
+            return failed
+
+        pool = ThreadPoolExecutor(max_workers=max(1, min(CLOSE_SEND_THREADS, len(requests))), thread_name_prefix=f"dealer-send-{login}")
+        try:
+            pending = {pool.submit(self._send, req): pos for req, pos in requests}
+            done, not_done = wait(pending, timeout=self.timeout)
+        finally:
+            # Requests still queued are dropped (never sent); sends in flight are joined so they finish
+            # while the caller still holds the session
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        late = [f for f in not_done if not f.cancelled()]
+        for future in not_done:
+            if future.cancelled():
+                failed.append(pending[future]) # Never sent: safe to delete
+        if late:
+            print(f"   ⚠️ {len(late)} DealerSend calls for {login} outlived the {self.timeout:.0f}s confirmation timeout")
+
+        for future in list(done) + late:
+            pos = pending[future]
+            try:
+                code = future.result()
+            except Exception as e:
+                print(f"   ℹ️ Native Attempt Error: {e}")
+                code = None
+            if code in ok_codes:
+                continue
+            print(f"   ⚠️ DealerSend Rejected: {code} (#{_val(pos, 'Position', 'Ticket', default=0)})")
+            failed.append(pos)
+        registry.inc("stopout_close_requests_total", len(pending))
+        return failed
+
+    def _synthetic_close(self, pos):
+        """FALLBACK: SYNTHETIC CLOSE (Delete)"""
+        ticket = _val(pos, "Position", "Ticket", "Deal", default=0)
+        try:
+            if hasattr(self.manager, "PositionDeleteByTicket"):
+                self.manager.PositionDeleteByTicket(ticket)
+            elif hasattr(self.manager, "PositionDelete"):
+                self.manager.PositionDelete(pos)
+            else:
+                print("❌ CRITICAL: No Delete Method Found!")
+                return False
+            return True
+        except Exception as e:
+            print(f"❌ Close failed {pos}: {e}")
+            return False
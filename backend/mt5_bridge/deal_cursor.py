@@ -0,0 +1,116 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DEAL_CURSOR_DB = os.getenv("DEAL_CURSOR_DB", os.path.join(os.path.dirname(__file__), "deal_cursors.db"))
+
+class DealCursorStore:
+    """
+    Per-login high-water mark for incremental deal fetches.
+
+    cursor = { "time": int, "ticket": int }
+      time: Earliest timestamp the next incremental fetch must start from. This is the last deal time,
+            pulled back to the oldest still-open position so its IN deal is inside the next window.
+      ticket: Highest deal ticket seen so far.
+
+    Hot entries live in an LRU with TTL; every update is written through to SQLite
+    so cursors survive restarts and evicted logins reload from disk.
+    """
+    def __init__(self, path=DEAL_CURSOR_DB, max_entries=50000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache = OrderedDict() # login -> (expires_at, cursor)
+        self.lock = threading.Lock()
+
+        self.db = None
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS deal_cursor (login INTEGER PRIMARY KEY, time INTEGER NOT NULL, ticket INTEGER NOT NULL)")
+            self.db.commit()
+        except Exception as e:
+            print(f"⚠️ Deal cursor DB unavailable ({path}): {e}. Cursors are memory-only.")
+            self.db = None
+
+    def get(self, login):
+        login = int(login)
+        now = time.time()
+        with self.lock:
+            entry = self.cache.get(login)
+            if entry and entry[0] > now:
+                self.cache.move_to_end(login)
+                return entry[1]
+
+            cursor = None
+            if self.db:
+                try:
+                    row = self.db.execute("SELECT time, ticket FROM deal_cursor WHERE login = ?", (login,)).fetchone()
+                    if row: cursor = {"time": int(row[0]), "ticket": int(row[1])}
+                except Exception as e:
+                    print(f"⚠️ Deal cursor read failed for {login}: {e}")
+
+            if cursor:
+                self._put(login, cursor, now)
+            else:
+                self.cache.pop(login, None)
+            return cursor
+
+    def update(self, login, cursor_time, ticket):
+        login = int(login)
+        cursor = {"time": int(cursor_time), "ticket": int(ticket)}
+        with self.lock:
+            self._put(login, cursor, time.time())
+            if self.db:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO deal_cursor (login, time, ticket) VALUES (?, ?, ?)", (login, cursor["time"], cursor["ticket"]))
+                    self.db.commit()
+                except Exception as e:
+                    print(f"⚠️ Deal cursor write failed for {login}: {e}")
+        return cursor
+
+    def _put(self, login, cursor, now):
+        self.cache[login] = (now + self.ttl, cursor)
+        self.cache.move_to_end(login)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+class PollWatermarkStore:
+    """
+    Last processed deal time per poll key ("group:<name>" or "login:<n>") for DynamicTradePoller.
+    The next poll queries from the mark instead of a fixed look-back, so a stall or restart of any
+    length resumes exactly where it stopped. All marks are loaded at startup (one row per group or
+    login) and every advance is written through to SQLite.
+    """
+    def __init__(self, path=DEAL_CURSOR_DB):
+        self.marks = {}
+        self.lock = threading.Lock()
+
+        self.db = None
+        try:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS poll_watermark (key TEXT PRIMARY KEY, time INTEGER NOT NULL)")
+            self.db.commit()
+            self.marks = {k: int(t) for k, t in self.db.execute("SELECT key, time FROM poll_watermark")}
+        except Exception as e:
+            print(f"⚠️ Poll watermark DB unavailable ({path}): {e}. Marks are memory-only.")
+            self.db = None
+
+    def get(self, key):
+        return self.marks.get(key)
+
+    def advance(self, key, deal_time):
+        """Moves the mark forward (never back). Returns the current mark."""
+        deal_time = int(deal_time)
+        with self.lock:
+            current = self.marks.get(key)
+            if current is not None and deal_time <= current:
+                return current
+            self.marks[key] = deal_time
+            if self.db:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO poll_watermark (key, time) VALUES (?, ?)", (key, deal_time))
+                    self.db.commit()
+                except Exception as e:
+                    print(f"⚠️ Poll watermark write failed for {key}: {e}")
+        return deal_time
@@ -0,0 +1,91 @@
+import os
+import time
+import sqlite3
+import threading
+
+FAILED_ACCOUNTS_DB = os.getenv("FAILED_ACCOUNTS_DB", os.path.join(os.path.dirname(__file__), "failed_accounts.db"))
+
+class FailedAccountRegistry:
+    """
+    Durable set of breached / stopped-out logins.
+
+    All rows are loaded into a dict at startup, so membership checks on the hot path are O(1) from the
+    first tick after a restart; marks are written through to SQLite. Risk shard processes open the same
+    file and pick up each other's marks (and clears) via refresh().
+    """
+    def __init__(self, path=FAILED_ACCOUNTS_DB):
+        self.failed = {} # login -> marked_at
+        self.lock = threading.Lock()
+
+        self.db = None
+        try:
+            self.db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS failed_account (login INTEGER PRIMARY KEY, reason TEXT, marked_at REAL NOT NULL)")
+            self.db.commit()
+            self.refresh()
+            if self.failed:
+                print(f"📋 Failed-account registry: {len(self.failed)} breached logins loaded")
+        except Exception as e:
+            print(f"⚠️ Failed-account DB unavailable ({path}): {e}. Registry is memory-only.")
+            self.db = None
+
+    def __contains__(self, login):
+        return login in self.failed
+
+    def __len__(self):
+        return len(self.failed)
+
+    def is_failed(self, login):
+        return int(login) in self.failed
+
+    def marked_at(self, login):
+        return self.failed.get(int(login))
+
+    def mark(self, login, reason=""):
+        """Records a breach. Returns False if the login was already marked."""
+        login = int(login)
+        with self.lock:
+            if login in self.failed:
+                return False
+            now = time.time()
+            self.failed[login] = now
+            if self.db:
+                try:
+                    self.db.execute("INSERT OR IGNORE INTO failed_account (login, reason, marked_at) VALUES (?, ?, ?)", (login, reason, now))
+                    self.db.commit()
+                except Exception as e:
+                    print(f"⚠️ Failed-account write failed for {login}: {e}")
+        return True
+
+    def clear(self, login):
+        """Removes a login (account reset / reinstated). Returns True if it was marked."""
+        login = int(login)
+        with self.lock:
+            existed = self.failed.pop(login, None) is not None
+            if self.db:
+                try:
+                    self.db.execute("DELETE FROM failed_account WHERE login = ?", (login,))
+                    self.db.commit()
+                except Exception as e:
+                    print(f"⚠️ Failed-account delete failed for {login}: {e}")
+        return existed
+
+    def refresh(self):
+        """Reloads from SQLite (marks/clears made by other processes)"""
+        if not self.db: return
+        with self.lock:
+            try:
+                self.failed = {int(l): float(t) for l, t in self.db.execute("SELECT login, marked_at FROM failed_account")}
+            except Exception as e:
+                print(f"⚠️ Failed-account reload failed: {e}")
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_failed_registry():
+    """Returns the process-wide registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = FailedAccountRegistry()
+        return _registry
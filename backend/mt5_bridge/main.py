@@ -2,13 +2,23 @@ import random
 import string
 from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
+from collections import deque
 import traceback
-import subprocess
+import time
 import os
 import json
-import requests
+import asyncio
+import threading
+from webhook_dispatcher import get_dispatcher
+from metrics import registry, MetricsRollup
+from stopout_executor import StopOutExecutor
+from close_planner import ClosePlanner
+from user_cache import UserRecordCache, UserAuditor, update_succeeded
+from failed_registry import get_failed_registry
+from mt5_executor import mt5_executor, MT5Busy, PRIORITY_STOPOUT, PRIORITY_RISK, PRIORITY_ACCOUNT, PRIORITY_SYNC
 
 # Webhook Config for CRM
 CRM_WEBHOOK_URL = os.environ.get("CRM_WEBHOOK_URL", "https://api.sharkfunded.co/api/webhooks/mt5")
@@ -17,61 +27,132 @@ MT5_WEBHOOK_SECRET = os.environ.get("MT5_WEBHOOK_SECRET", "")
 app = FastAPI()
 
 # --- WEBSOCKET MANAGER (SCALABLE) ---
+WS_CLIENT_QUEUE = int(os.environ.get("WS_CLIENT_QUEUE", "256"))
+
+class ClientChannel:
+    """
+    One WebSocket + its bounded outbox, drained by a dedicated writer task.
+    A slow client only backs up its own queue: when full the oldest message is dropped, and
+    periodic account_update snapshots for the same login replace each other in place.
+    """
+    def __init__(self, manager, login: int, websocket: WebSocket, max_queue: int = WS_CLIENT_QUEUE):
+        self.manager = manager
+        self.login = login
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.queue = deque() # entries: [coalesce_key, text]
+        self.coalesce = {} # coalesce_key -> queued entry
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._writer())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def push(self, text: str, coalesce_key=None):
+        if coalesce_key is not None:
+            entry = self.coalesce.get(coalesce_key)
+            if entry is not None:
+                entry[1] = text # Newer snapshot replaces the queued one
+                return
+
+        if len(self.queue) >= self.max_queue:
+            oldest = self.queue.popleft()
+            if oldest[0] is not None and self.coalesce.get(oldest[0]) is oldest:
+                del self.coalesce[oldest[0]]
+            self.dropped += 1
+
+        entry = [coalesce_key, text]
+        self.queue.append(entry)
+        if coalesce_key is not None:
+            self.coalesce[coalesce_key] = entry
+        self.wakeup.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                key, text = self.queue.popleft()
+                if key is not None:
+                    self.coalesce.pop(key, None)
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Dead socket: prune so broadcasts stop targeting it
+            self.task = None
+            self.manager.disconnect(self.login, self.websocket, reason=f"send failed: {e}")
+
 class ConnectionManager:
     def __init__(self):
-        # login -> list or set of WebSockets
-        self.rooms: Dict[int, List[WebSocket]] = {}
+        # Topic (login, 0 = master stream) -> { WebSocket: ClientChannel }
+        self.rooms: Dict[int, Dict[WebSocket, ClientChannel]] = {}
         self.main_loop = None
 
     async def connect(self, login: int, websocket: WebSocket):
         await websocket.accept()
-        if login not in self.rooms:
-            self.rooms[login] = []
-        self.rooms[login].append(websocket)
+        channel = ClientChannel(self, login, websocket)
+        channel.start()
+        self.rooms.setdefault(login, {})[websocket] = channel
         print(f"📡 WS: Client connected to room {login}. Total in room: {len(self.rooms[login])}")
 
-    def disconnect(self, login: int, websocket: WebSocket):
-        if login in self.rooms:
-            if websocket in self.rooms[login]:
-                self.rooms[login].remove(websocket)
-            if not self.rooms[login]:
-                del self.rooms[login]
-        print(f"📡 WS: Client disconnected from room {login}")
-
-    async def broadcast(self, login: int, message: dict):
+    def disconnect(self, login: int, websocket: WebSocket, reason: str = None):
+        """Removes the client (idempotent: the writer's prune and the endpoint may both call it)"""
+        room = self.rooms.get(login)
+        if room is None: return
+        channel = room.pop(websocket, None)
+        if not room:
+            del self.rooms[login]
+        if channel is None: return
+        channel.stop()
+        print(f"📡 WS: Client disconnected from room {login}" + (f" ({reason})" if reason else ""))
+
+    def has_listeners(self, login: int) -> bool:
+        return bool(self.rooms.get(login)) or bool(self.rooms.get(0))
+
+    def listened_logins(self):
+        """(master stream connected, logins with a client) - read from other threads (shard coordinator)"""
+        rooms = dict(self.rooms)
+        return bool(rooms.get(0)), frozenset(login for login, room in rooms.items() if login != 0 and room)
+
+    def publish(self, login: int, message: dict):
         """
-        Sends to:
+        Queues to:
         1. Specific login room
         2. Master room (login 0)
+        Serializes once and never awaits a socket. Must run on the event loop thread.
         """
-        # Lazy Check: If no one is listening to this login or the master stream, skip.
-        has_login_clients = login in self.rooms and self.rooms[login]
-        has_master_clients = 0 in self.rooms and self.rooms[0]
+        login_room = self.rooms.get(login)
+        master_room = self.rooms.get(0) if login != 0 else None
 
-        if not has_login_clients and not has_master_clients:
+        # Lazy Check: If no one is listening to this login or the master stream, skip.
+        if not login_room and not master_room:
             return
 
-        targets = []
-        if has_login_clients:
-            targets.extend(self.rooms[login])
-        if has_master_clients:
-            targets.extend(self.rooms[0])
+        text = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        # Plain periodic snapshots coalesce per login; trade-close updates are always delivered
+        key = login if message.get("event") == "account_update" and not message.get("trades_closed") else None
 
-        # Remove duplicates if a client is in both (though unlikely in this design)
-        targets = list(set(targets))
+        for room in (login_room, master_room):
+            if not room: continue
+            for channel in list(room.values()):
+                channel.push(text, key)
 
-        for connection in targets:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                # Disconnect will handle cleanup
-                pass
+    async def broadcast(self, login: int, message: dict):
+        self.publish(login, message)
 
     def broadcast_threadsafe(self, login: int, message: dict):
         if getattr(self, 'main_loop', None):
-            import asyncio
             try:
-                asyncio.run_coroutine_threadsafe(self.broadcast(login, message), self.main_loop)
+                self.main_loop.call_soon_threadsafe(self.publish, login, message)
             except Exception:
                 pass
 
@@ -94,12 +175,17 @@ async def websocket_endpoint(websocket: WebSocket, login: int):
     except WebSocketDisconnect:
         ws_manager.disconnect(login, websocket)
     except Exception as e:
-        print(f"⚠️ WS: Error ({login}): {e}")
-        ws_manager.disconnect(login, websocket)
+        ws_manager.disconnect(login, websocket, reason=f"error: {e}")
 
 # In-memory cache to track last sync per account (for polling optimization)
 last_synced_tickets = {}
 
+# Per-login deal high-water mark: incremental syncs only pull the delta window from MT5
+from deal_cursor import DealCursorStore
+from trade_normalizer import normalize_trades
+deal_cursors = DealCursorStore()
+HISTORY_START = int(datetime(2020, 1, 1).timestamp())
+
 # --- HELPER: Random Password Generator ---
 def generate_password(length=10):
     chars = string.ascii_letters + string.digits + "!@#$"
@@ -156,15 +242,25 @@ def load_server_config():
 load_server_config()
 
 # --- WORKER SETUP ---
+# RISK_SHARDS > 1 runs the RiskEngine as that many processes (see risk_shards.py)
+RISK_SHARDS = int(os.environ.get("RISK_SHARDS", "1"))
+risk_engine = None
+
 try:
     from mt5_worker import MT5Worker, MT5Manager
     
     # DEBUG: Inspect MTRequest and DealerSend
     # print(f"🔎 MTRequest DIR: {[x for x in dir(MT5Manager.MTRequest) if not x.startswith('_')]}")
     
-    worker = MT5Worker() 
-    if not worker.connected:
-        worker.connect()
+    from mt5_pool import MT5Pool
+
+    # N manager sessions with heartbeats; each executor job leases the least-loaded one
+    worker = MT5Pool()
+    worker.start()
+
+    # All MT5 manager I/O (routes, poller, risk engine) goes through the prioritized executor
+    mt5_executor.use_pool(lambda: worker)
+    mt5_executor.start()
 
     if not worker.connected:
         print("❌ API Server: Failed to connect to MT5 Manager")
@@ -172,15 +268,20 @@ try:
         # Start Dynamic Trade Poller
         try:
             from trade_poller import start_dynamic_polling
-            start_dynamic_polling(worker, interval=10, reload_interval=300, ws_manager=ws_manager)
+            start_dynamic_polling(mt5_executor.bind(lambda: worker, PRIORITY_SYNC), interval=10, reload_interval=300, ws_manager=ws_manager)
         except Exception as e:
             print(f"⚠️ Failed to start Trade Poller: {e}")
 
         # Start Risk Engine
         try:
-            from risk_engine import RiskEngine
-            # Pass Supabase client to RiskEngine (if available)
-            risk_engine = RiskEngine(worker, supabase, ws_manager=ws_manager)
+            if RISK_SHARDS > 1:
+                # One process per login-hash partition, each with its own MT5 connection
+                from risk_shards import ShardedRiskEngine
+                risk_engine = ShardedRiskEngine(RISK_SHARDS, supabase_client=supabase, ws_manager=ws_manager)
+            else:
+                from risk_engine import RiskEngine
+                # Pass Supabase client to RiskEngine (if available)
+                risk_engine = RiskEngine(mt5_executor.bind(lambda: worker, PRIORITY_RISK), supabase, ws_manager=ws_manager)
             risk_engine.start()
         except Exception as e:
              print(f"⚠️ Failed to start Risk Engine: {e}")
@@ -216,43 +317,90 @@ except ImportError:
             # print(f"MockMT5Worker: get_positions called for {login}")
             return []
     worker = MockMT5Worker()
+    mt5_executor.start()
+
+# Periodic bridge_metrics / stopout_history rollup (worker looked up lazily: /reload-config replaces it)
+metrics_rollup = MetricsRollup(supabase, worker_getter=lambda: worker)
+metrics_rollup.start()
+
+# User records: write-through on UserUpdate, read-back verification deferred to the auditor thread
+user_cache = UserRecordCache()
+if hasattr(worker, "subscribe_updates"):
+    worker.subscribe_updates(user_cache.on_update)
 
+def _audit_fetch(login):
+    return mt5_executor.call(PRIORITY_ACCOUNT, lambda: worker.manager.UserRequest(login))
+
+def _audit_write(login, fields):
+    return mt5_executor.call(PRIORITY_STOPOUT, lambda: user_cache.update(worker.manager, login, **fields))
+
+user_auditor = UserAuditor(user_cache, _audit_fetch, write=_audit_write)
+user_auditor.start()
+
+async def mt5_call(priority, fn, *args, **kwargs):
+    """Runs a blocking MT5 call on the executor; a saturated queue becomes 503 so clients back off"""
+    try:
+        return await mt5_executor.run(priority, fn, *args, **kwargs)
+    except MT5Busy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def ensure_connected():
+    if not worker.connected:
+        worker.connect()
+
+@app.get("/risk-health")
+def risk_health():
+    """Risk monitor health (merged per-shard view when sharded)"""
+    if risk_engine is None:
+        return {"status": "stopped"}
+    if hasattr(risk_engine, "get_health"):
+        return risk_engine.get_health()
+    return {
+        "accounts_monitored": len(risk_engine.account_metadata),
+        "push_mode": risk_engine.push_mode,
+        "scheduler": risk_engine.scheduler.stats() if risk_engine.scheduler else None,
+        "mt5_executor": mt5_executor.stats(),
+        "mt5_pool": worker.stats() if hasattr(worker, "stats") else None,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint: sweep/MT5 call/webhook latency histograms, counters, gauges"""
+    return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.post("/reload-config")
 def reload_config():
-    """Reloads config from DB and reconnects Bridge"""
+    """
+    Reloads config from DB and reconnects Bridge without downtime:
+    a new pool is connected with the new credentials and swapped in, then the old one is drained
+    (in-flight MT5 calls finish on it) in the background.
+    """
+    global worker
     print("🔄 Reloading Configuration...")
     load_server_config()
-    
-    try:
-        if worker.connected:
-            if hasattr(worker, 'disconnect'):
-                worker.disconnect()
-            worker.connected = False
-        
-        # Re-initialize or Re-connect
-        # MT5Worker reads envs in __init__, so we might need new instance?
-        # Let's see mt5_worker.py code again... it reads in __init__.
-        # So we MUST re-create the worker.
-        global worker
-        # We need to re-import or just re-instantiate
-        # Assuming MT5Worker class is available
-        try:
-             # Re-instantiate to pick up new Envs
-             new_worker = MT5Worker()
-             new_worker.connect()
-             if new_worker.connected:
-                 worker = new_worker # Atomically swap
-                 print("✅ Bridge Reconnected with New Config")
-                 return {"status": "success", "message": "Bridge Reconnected"}
-             else:
-                 print("❌ Bridge Reconnection Failed")
-                 return {"status": "error", "message": "Failed to connect with new config"}
-        except Exception as re:
-             print(f"❌ Re-init failed: {re}")
-             return {"status": "error", "message": str(re)}
 
+    if not hasattr(worker, "drain"):
+        return {"status": "error", "message": "Bridge is running without an MT5 pool"}
+
+    try:
+        # MT5Worker reads envs in __init__, so new sessions pick up the new config
+        new_pool = MT5Pool()
+        if not new_pool.start():
+            new_pool.drain(timeout=0)
+            print("❌ Bridge Reconnection Failed")
+            return {"status": "error", "message": "Failed to connect with new config"}
+
+        old_pool = worker
+        for callback in old_pool.pump_callbacks():
+            new_pool.subscribe_updates(callback)
+        worker = new_pool # Atomically swap: new executor jobs lease from the new pool
+        threading.Thread(target=old_pool.drain, daemon=True).start()
+
+        print("✅ Bridge Reconnected with New Config")
+        return {"status": "success", "message": "Bridge Reconnected"}
     except Exception as e:
+        print(f"❌ Re-init failed: {e}")
         return {"status": "error", "message": str(e)}
 
 
@@ -264,7 +412,10 @@ class AccountRequest(BaseModel):
     balance: float = 10000
 
 @app.post("/create-account")
-def create_account(data: AccountRequest):
+async def create_account(data: AccountRequest):
+    return await mt5_call(PRIORITY_ACCOUNT, _create_account, data)
+
+def _create_account(data: AccountRequest):
     if not worker.connected: 
         worker.connect()
     
@@ -314,7 +465,10 @@ class DepositRequest(BaseModel):
     comment: str = "Manual Deposit"
 
 @app.post("/deposit")
-def deposit_funds(data: DepositRequest):
+async def deposit_funds(data: DepositRequest):
+    return await mt5_call(PRIORITY_ACCOUNT, _deposit_funds, data)
+
+def _deposit_funds(data: DepositRequest):
     if not worker.connected:
         worker.connect()
         
@@ -347,122 +501,48 @@ def get_val(obj, *names, default=None):
         if hasattr(obj, name): return getattr(obj, name)
     return default
 
+def deal_window_start(login: int, incremental: bool):
+    """Full history for normal syncs, only the delta since the stored cursor for incremental ones"""
+    if incremental:
+        cursor = deal_cursors.get(login)
+        if cursor:
+            return cursor["time"]
+    return HISTORY_START
+
+def advance_deal_cursor(login: int, batch, window_start: int):
+    """
+    Moves the cursor to the newest deal, but never past the oldest open position:
+    its IN deal must stay inside the next window so the OUT deal can be paired with it.
+    """
+    last_time = max(window_start, batch.last_deal_time)
+    if batch.min_open_time > 0:
+        last_time = min(last_time, batch.min_open_time)
+
+    last_ticket = batch.last_deal_ticket
+    previous = deal_cursors.get(login)
+    if previous:
+        last_ticket = max(last_ticket, previous["ticket"])
+    deal_cursors.update(login, max(last_time, HISTORY_START), last_ticket)
+
 @app.post("/fetch-trades")
-def fetch_trades(data: FetchRequest):
-    
-    results = []
-    current_tickets = set()
+async def fetch_trades(data: FetchRequest):
+    return await mt5_call(PRIORITY_SYNC, _fetch_trades, data)
 
+def _fetch_trades(data: FetchRequest):
+    
     # Fetch data
-    # Fetch deals from a reasonable start time (e.g., 2020) to now
-    from_time = int(datetime(2020, 1, 1).timestamp())
+    # Full sync: deals from a reasonable start time (2020) to now. Incremental: from the login's cursor.
+    from_time = deal_window_start(data.login, data.incremental)
     to_time = int(datetime.now().timestamp()) + 86400 # +1 day just in case
     
     deals = worker.get_deals(data.login, from_time, to_time)
     trades = worker.get_positions(data.login)
-    
-    # Process CLOSED trades (Deals)
-    # Group deals by PositionID to match IN (open) and OUT (close) deals
-    position_deals = {}
-    for d in deals:
-        try:
-            position_id = get_val(d, "PositionID", default=0)
-            if position_id == 0:
-                continue
-            
-            if position_id not in position_deals:
-                position_deals[position_id] = {"in": None, "out": None}
-            
-            entry = get_val(d, "Entry", default=0)
-            if entry == 0:  # IN deal (opening)
-                position_deals[position_id]["in"] = d
-            elif entry == 1:  # OUT deal (closing)
-                position_deals[position_id]["out"] = d
-        except Exception as e:
-            print(f"⚠️ Error grouping deal: {e}")
-            pass
-    
-    # Now process matched positions
-    for position_id, deals_pair in position_deals.items():
-        try:
-            in_deal = deals_pair["in"]
-            out_deal = deals_pair["out"]
-            
-            # Only process if we have the closing deal (OUT)
-            if not out_deal:
-                continue
-            
-            ticket = get_val(out_deal, "Deal", "Ticket", default=0)
-            if ticket == 0:
-                continue
-            
-            # Get open time from IN deal, or use OUT deal time if IN doesn't exist
-            open_time = int(get_val(in_deal, "Time", default=0)) if in_deal else int(get_val(out_deal, "Time", default=0))
-            close_time = int(get_val(out_deal, "Time", default=open_time))
-            
-            # Calculate duration in seconds
-            duration = close_time - open_time if close_time > open_time else 0
-            
-            t = {
-                "login": data.login,
-                "ticket": ticket,
-                "symbol": get_val(out_deal, "Symbol", "symbol", default=""),
-                "type": int(get_val(out_deal, "Action", "Type", "type", default=0)),
-                "entry": int(get_val(out_deal, "Entry", "entry", default=1)),
-                "volume": float(get_val(out_deal, "Volume", "volume", default=0)),
-                "price": float(get_val(in_deal, "Price", "price", default=0.0)) if in_deal else float(get_val(out_deal, "Price", "price", default=0.0)),
-                "close_price": float(get_val(out_deal, "Price", "price", default=0.0)),
-                "profit": float(get_val(out_deal, "Profit", "profit", default=0.0)),
-                "commission": float(get_val(out_deal, "Commission", "commission", default=0.0)),
-                "swap": float(get_val(out_deal, "Storage", "Swap", "swap", default=0.0)),
-                "time": open_time,  # Open time from IN deal
-                "close_time": close_time,  # Close time from OUT deal
-                "duration": duration,  # Duration in seconds
-                "is_closed": True
-            }
-            results.append(t)
-            current_tickets.add(ticket)
-        except Exception as e:
-            print(f"⚠️ Error processing position {position_id}: {e}")
-            pass
-    
-    # Process OPEN positions
-    # print(f"🔎 DEBUG: Processing {len(trades)} open positions...")
-    for d in trades:
-        try:
-            # For MTPosition, the ticket is often in 'Position' attribute
-            ticket = get_val(d, "Position", "Ticket", "Deal", default=0)
-            # print(f"   Processing Open Pos Ticket: {ticket}")
-            
-            if ticket == 0:
-                print("   ⚠️ Skipping because Ticket is 0")
-                continue
-                
-            open_time = int(get_val(d, "TimeCreate", "Time", default=0))
-            
-            t = {
-                "login": data.login,
-                "ticket": ticket,
-                "symbol": get_val(d, "Symbol", "symbol", default=""),
-                "type": int(get_val(d, "Action", "Type", "Cmd", "type", default=0)), # Open positions use Action
-                "entry": int(get_val(d, "Entry", "entry", default=0)),
-                "volume": float(get_val(d, "Volume", "volume", default=0)),
-                "price": float(get_val(d, "PriceOpen", "Price", "price_open", "price", default=0.0)),
-                "close_price": float(get_val(d, "PriceCurrent", "Price", "price_current", "price", default=0.0)), 
-                "profit": float(get_val(d, "Profit", "profit", default=0.0)),
-                "commission": float(get_val(d, "Commission", "commission", default=0.0)),
-                "swap": float(get_val(d, "Storage", "Swap", "swap", default=0.0)),
-                "time": open_time,  # Open time
-                "close_time": None,  # No close time for open trades
-                "duration": None,  # No duration for open trades yet
-                "is_closed": False
-            }
-            results.append(t)
-            current_tickets.add(ticket)
-            # print(f"   ✅ Added Open Trade {ticket}")
-        except Exception as e:
-            print(f"⚠️ Error processing position: {e}")
-            pass
+
+    # Closed (IN/OUT deals paired by PositionID) + Open positions in one pass
+    batch = normalize_trades(data.login, deals, trades)
+    advance_deal_cursor(data.login, batch, from_time)
+    results = batch.trades
+    current_tickets = batch.tickets
     
     # Polling optimization: only return NEW trades if incremental mode
     if data.incremental and data.login in last_synced_tickets:
@@ -473,138 +553,182 @@ def fetch_trades(data: FetchRequest):
     else:
         print(f"⚡ Full sync: sending {len(results)} trades for {data.login}")
 
+    # Update cache
+    last_synced_tickets[data.login] = current_tickets
+    registry.inc("deals_synced_total", len(results))
+
     return {"trades": results}
 
+# Bulk fetch runs on the MT5 executor (sync priority, so stop-outs still go first). Its threads
+# (MT5_EXECUTOR_THREADS) are the real parallelism, so at most that many logins are in flight at once.
+BULK_FETCH_TIMEOUT = float(os.environ.get("BULK_FETCH_TIMEOUT", "30"))
+# Per-login timeouts run from when the executor starts the job; this caps the time a login may sit in the queue
+BULK_FETCH_QUEUE_TIMEOUT = float(os.environ.get("BULK_FETCH_QUEUE_TIMEOUT", "120"))
+
 class FetchBulkRequest(BaseModel):
     logins: List[int]
     incremental: bool = False
+    workers: Optional[int] = None  # Max logins fetched at once (default and cap: the MT5 executor's threads, 1 = serial)
+    timeout: Optional[float] = None  # Per-login timeout in seconds from when its fetch starts (default BULK_FETCH_TIMEOUT)
+    stream: bool = False  # NDJSON: one line per login as soon as it's normalized
 
-@app.post("/fetch-trades-bulk")
-def fetch_trades_bulk(data: FetchBulkRequest):
-    if not worker.connected:
-        worker.connect()
-    
-    all_results = []
-    print(f"🔄 Bulk Fetching trades for {len(data.logins)} accounts...")
+def fetch_login_trades(login: int, incremental: bool, to_time: int):
+    """
+    Fetches + normalizes one login. Returns (results, commit).
+    commit() advances the deal cursor / ticket cache and must only run once the results are
+    actually returned to the caller, so a timed-out login is fully re-sent next time.
+    """
+    from_time = deal_window_start(login, incremental)
+    deals = worker.get_deals(login, from_time, to_time)
+    open_pos = worker.get_positions(login)
 
-    # Reuse the logic of fetch_trades but in a loop to save HTTP overhead
-    # In future, if C++ API supports GroupRequest, use that.
-    
-    # Pre-calc times once
-    from_time = int(datetime(2020, 1, 1).timestamp())
-    to_time = int(datetime.now().timestamp()) + 86400 
+    batch = normalize_trades(login, deals, open_pos, include_lots=True)
+    results = batch.trades
+    current_tickets = batch.tickets
+
+    # Optimization: Incremental Check
+    if incremental and login in last_synced_tickets:
+        prev = last_synced_tickets[login]
+        new_t = current_tickets - prev
+        # Filter results
+        results = [r for r in results if r["ticket"] in new_t]
+
+    def commit():
+        advance_deal_cursor(login, batch, from_time)
+        last_synced_tickets[login] = current_tickets
+        registry.inc("deals_synced_total", len(results))
 
+    return results, commit
+
+async def iter_bulk_trades(data: FetchBulkRequest):
+    """
+    Yields (login, trades, error, commit) in request order with up to `workers` logins on the MT5 executor.
+    Only a sliding window of `workers` futures is in flight, so memory stays bounded; timed-out fetches
+    still running on an executor thread count against the window.
+    The consumer calls commit() once the trades have been handed to the client.
+    """
+    to_time = int(datetime.now().timestamp()) + 86400
+    workers = max(1, min(data.workers or mt5_executor.threads, mt5_executor.threads))
+    timeout = data.timeout or BULK_FETCH_TIMEOUT
+
+    pending = deque()
     for login in data.logins:
         try:
-            results = []
-            
-            # Fetch
-            deals = worker.get_deals(login, from_time, to_time)
-            open_pos = worker.get_positions(login)
-            
-            # --- PROCESS DEALS ---
-            # Debug: Print first deal to understand structure
-            if len(deals) > 0 and login == data.logins[0]:
-                 d0 = deals[0]
-                 print(f"🔎 DEBUG: Raw Deal Object Sample: {d0}")
-                 print(f"   Has 'Commission': {hasattr(d0, 'Commission')}, 'commission': {hasattr(d0, 'commission')}")
-                 print(f"   Has 'Profit': {hasattr(d0, 'Profit')}, 'profit': {hasattr(d0, 'profit')}")
-                 print(f"   Has 'Price': {hasattr(d0, 'Price')}, 'price': {hasattr(d0, 'price')}")
-                 if hasattr(d0, '_asdict'): print(f"   As Dict: {d0._asdict()}")
-
-            position_deals = {}
-            for d in deals:
-                try:
-                    pid = get_val(d, "PositionID", default=0)
-                    if pid == 0: continue
-                    if pid not in position_deals: position_deals[pid] = {"in":None, "out":None}
-                    entry = get_val(d, "Entry", default=0)
-                    if entry == 0: position_deals[pid]["in"] = d
-                    elif entry == 1: position_deals[pid]["out"] = d
-                except: pass
-
-            for pid, pair in position_deals.items():
-                if not pair["out"]: continue
-                out_d = pair["out"]
-                in_d = pair["in"]
-                tick = get_val(out_d, "Deal", "Ticket", default=0)
-                if tick == 0: continue
-                
-                ot = int(get_val(in_d, "Time", default=0)) if in_d else int(get_val(out_d, "Time", default=0))
-                ct = int(get_val(out_d, "Time", default=ot))
-                
-                t = {
-                    "login": login,
-                    "ticket": tick,
-                    "symbol": get_val(out_d, "Symbol", "symbol", default=""),
-                    "type": int(get_val(out_d, "Action", "Type", "type", default=0)),
-                    "lots": float(get_val(out_d, "Volume", "volume", default=0)) / 10000.0 if float(get_val(out_d, "Volume", "volume", default=0)) > 100 else float(get_val(out_d, "Volume", "volume", default=0)), 
-                    "volume": float(get_val(out_d, "Volume", "volume", default=0)),
-                    "price": float(get_val(in_d, "Price", "price", default=0.0)) if in_d else float(get_val(out_d, "Price", "price", default=0.0)),
-                    "close_price": float(get_val(out_d, "Price", "price", default=0.0)),
-                    "profit": float(get_val(out_d, "Profit", "profit", default=0.0)),
-                    "commission": float(get_val(out_d, "Commission", "commission", default=0.0)),
-                    "swap": float(get_val(out_d, "Storage", "Swap", "swap", default=0.0)),
-                    "time": ot,
-                    "close_time": ct,
-                    "is_closed": True
-                }
-                results.append(t)
-                current_tickets.add(tick)
-
-            # --- PROCESS OPEN ---
-            for d in open_pos:
-                try:
-                    tick = get_val(d, "Position", "Ticket", "Deal", default=0)
-                    if tick == 0: continue
-                    t = {
-                        "login": login,
-                        "ticket": tick,
-                        "ticket": tick,
-                        "symbol": get_val(d, "Symbol", "symbol", default=""),
-                        "type": int(get_val(d, "Action", "Type", "Cmd", "type", default=0)),
-                        "volume": float(get_val(d, "Volume", "volume", default=0)),
-                        "price": float(get_val(d, "PriceOpen", "Price", "price_open", "price", default=0.0)),
-                        "close_price": float(get_val(d, "PriceCurrent", "Price", "price_current", "price", default=0.0)),
-                        "profit": float(get_val(d, "Profit", "profit", default=0.0)),
-                        "commission": float(get_val(d, "Commission", "commission", default=0.0)),
-                        "swap": float(get_val(d, "Storage", "Swap", "swap", default=0.0)),
-                        "time": int(get_val(d, "TimeCreate", "Time", "time_setup", "time", default=0)),
-                        "close_time": None,
-                        "is_closed": False
-                    }
-                    results.append(t)
-                    current_tickets.add(tick)
-                except: pass
-
-            # Optimization: Incremental Check
-            if data.incremental and login in last_synced_tickets:
-                prev = last_synced_tickets[login]
-                new_t = current_tickets - prev
-                # Filter results
-                results = [r for r in results if r["ticket"] in new_t]
-            
-            # Update cache
-            last_synced_tickets[login] = current_tickets
-            
-            all_results.extend(results)
+            started = [None] # Set by the executor thread when the job begins
+            future = mt5_executor.submit(PRIORITY_SYNC, _run_started, started, fetch_login_trades, login, data.incremental, to_time)
+        except MT5Busy as e:
+            future = e
+        pending.append((login, time.time(), started, future))
+        if len(pending) + len(bulk_overruns) < workers: continue
 
-        except Exception as e:
-            print(f"⚠️ Error bulk syncing {login}: {e}")
+        yield await _collect_bulk(pending.popleft(), timeout)
+
+    while pending:
+        yield await _collect_bulk(pending.popleft(), timeout)
+
+bulk_overruns = set() # Timed-out bulk fetches still holding an executor thread
+
+def _track_overrun(login, future):
+    """A started fetch can't be interrupted: keep it counted until its thread is free again"""
+    bulk_overruns.add(future)
+    registry.set_gauge("bulk_fetch_overruns", len(bulk_overruns))
+
+    def done(f):
+        bulk_overruns.discard(f)
+        registry.set_gauge("bulk_fetch_overruns", len(bulk_overruns))
+        print(f"ℹ️ Bulk fetch of {login} finished after its timeout (result discarded, cursor not advanced)")
+    future.add_done_callback(done)
+
+def _run_started(started, fn, *args):
+    started[0] = time.time()
+    return fn(*args)
+
+async def _collect_bulk(item, timeout):
+    login, queued_at, started, future = item
+    try:
+        if isinstance(future, Exception): raise future
+        waiter = asyncio.wrap_future(future)
+        while not future.done():
+            if started[0] is None:
+                # Still queued behind other executor work: that wait doesn't count against the login
+                if time.time() - queued_at > BULK_FETCH_QUEUE_TIMEOUT:
+                    future.cancel() # Never starts if the executor hasn't picked it up yet
+                    return login, [], f"still queued after {BULK_FETCH_QUEUE_TIMEOUT}s", None
+                await asyncio.wait({waiter}, timeout=0.1)
+                continue
+            remaining = started[0] + timeout - time.time()
+            if remaining <= 0:
+                _track_overrun(login, future)
+                return login, [], f"timeout after {timeout}s", None
+            await asyncio.wait({waiter}, timeout=remaining)
+        results, commit = future.result()
+        return login, results, None, commit
+    except Exception as e:
+        return login, [], str(e), None
+
+async def stream_bulk_trades(data: FetchBulkRequest):
+    """
+    NDJSON body: {"login", "trades"} or {"login", "error"} per login in request order,
+    then a {"done": true, ...} summary line so clients can detect truncated streams.
+    """
+    trade_count = 0
+    error_count = 0
+    async for login, results, error, commit in iter_bulk_trades(data):
+        if error:
+            error_count += 1
+            yield json.dumps({"login": login, "error": error}) + "\n"
             continue
+        trade_count += len(results)
+        yield json.dumps({"login": login, "trades": results}) + "\n"
+        # Resumed only after the line was sent: a client that disconnected earlier gets these trades again
+        commit()
 
-    print(f"⚡ Bulk Sync Complete: Returned {len(all_results)} trades total.")
-    return {"trades": all_results}
+    print(f"⚡ Bulk Stream Complete: {trade_count} trades, {error_count} failed logins.")
+    yield json.dumps({"done": True, "logins": len(data.logins), "trades": trade_count, "errors": error_count}) + "\n"
+
+@app.post("/fetch-trades-bulk")
+async def fetch_trades_bulk(data: FetchBulkRequest):
+    await mt5_call(PRIORITY_SYNC, ensure_connected)
+    
+    print(f"🔄 Bulk Fetching trades for {len(data.logins)} accounts...")
+
+    if data.stream:
+        return StreamingResponse(stream_bulk_trades(data), media_type="application/x-ndjson")
+
+    all_results = []
+    errors = []
+    commits = []
+
+    # Reuse the logic of fetch_trades across the MT5 executor to save HTTP overhead
+    async for login, results, error, commit in iter_bulk_trades(data):
+        if error:
+            print(f"⚠️ Error bulk syncing {login}: {error}")
+            errors.append({"login": login, "error": error})
+            continue
+        all_results.extend(results)
+        commits.append(commit)
+
+    # Whole response built: advance cursors for every login in it
+    for commit in commits:
+        commit()
+
+    print(f"⚡ Bulk Sync Complete: Returned {len(all_results)} trades total, {len(errors)} failed logins.")
+    return {"trades": all_results, "errors": errors}
 
 # --- RISK MONITOR: STOP OUT LOGIC ---
 
-failed_accounts = set()
+# Durable across restarts and shared with the RiskEngine / trade poller.
+# Only stop-outs that took effect are persisted; logins still being stopped out are tracked in memory
+# (so overlapping check-bulk batches skip them) and an incomplete stop-out is re-run (STOPOUT_RETRIES), then left to the next check.
+failed_accounts = get_failed_registry()
+stopouts_in_flight = set()
+stopouts_lock = threading.Lock()
 
 def is_failed(login):
     return login in failed_accounts
 
-def mark_failed(login):
-    failed_accounts.add(login)
+def mark_failed(login, reason="stop_out"):
+    return failed_accounts.mark(login, reason)
 
 class StopOutRequest(BaseModel):
     login: int
@@ -625,18 +749,16 @@ def disable_account(user):
         user.Rights = 0 # USER_RIGHT_NONE
 
     try:
-        # Attempt update
-        result = worker.manager.UserUpdate(user)
+        # Attempt update: only these fields, onto a fresh record (write-through: the cache now holds the disabled record)
+        expected = {k: 0 for k in ("Enable", "Rights") if hasattr(user, k)}
+        result = user_cache.update(worker.manager, user.Login, **expected)
         
-        if result == 0 or result is True:
+        if update_succeeded(result):
              print(f"SUCCESS: UserUpdate call returned success for {user.Login}.")
              
-             # VERIFICATION: Re-fetch user to see if it stuck
-             updated_user = worker.manager.UserRequest(user.Login)
-             if updated_user:
-                 print(f"VERIFY: Post-Update Enable: {getattr(updated_user, 'Enable', 'N/A')}")
-                 print(f"VERIFY: Post-Update Rights: {getattr(updated_user, 'Rights', 'N/A')}")
-                 print(f"VERIFY: Post-Update Comment: {getattr(updated_user, 'Comment', 'N/A')}")
+             # VERIFICATION: Deferred - the auditor re-fetches the user later and re-applies on mismatch
+             if expected:
+                 user_auditor.expect(user.Login, **expected)
                  
              return True
         
@@ -652,132 +774,17 @@ def disable_account(user):
         return False
 
 def force_close_positions(login: int):
-    closed = 0
+    """Closes all open positions: one price lookup per symbol, closes sent concurrently (see ClosePlanner)"""
+    return close_positions(login)[0]
+
+def close_positions(login: int):
+    """Returns (positions closed, positions possibly still open; None if unknown)"""
+    planner = ClosePlanner(worker.manager, MT5Manager)
     try:
-        positions = worker.manager.PositionRequest(login) or []
-        for pos in positions:
-            try:
-                # Use Position attributes for ticket and volume
-                ticket = get_val(pos, "Position", "Ticket", "Deal", default=0)
-                volume = int(get_val(pos, "Volume", default=0))
-                
-                # PnL Calculation for Synthetic Close
-                profit = float(get_val(pos, "Profit", default=0.0))
-                storage = float(get_val(pos, "Storage", default=0.0))
-                commission = float(get_val(pos, "Commission", default=0.0))
-                total_pnl = profit + storage + commission
-                
-                if ticket > 0:
-                    closed_successfully = False
-                    
-                    # ---------------------------------------------------------
-                    # STRATEGY 0: EXTERNAL C++ TOOL (MT5StopOutEngine.exe)
-                    # ---------------------------------------------------------
-                    # If the user has compiled the C++ tool, use it for "Perfect Close"
-                    if not closed_successfully and os.path.exists("MT5StopOutEngine.exe"):
-                         try:
-                             # print(f"DEBUG: Running MT5StopOutEngine.exe for {login}")
-                             result = subprocess.run(["MT5StopOutEngine.exe", str(login)], capture_output=True, text=True)
-                             if result.returncode == 0:
-                                  print(f"   ✅ External StopOut Success: {ticket}")
-                                  closed_successfully = True
-                             else:
-                                  print(f"   ⚠️ External StopOut Failed: {result.stderr}")
-                         except Exception as e:
-                             print(f"   ⚠️ External Tool Error: {e}")
-
-                    # ---------------------------------------------------------
-                    # STRATEGY 1: NATIVE STOP OUT (The "Golden Rule")
-                    # ---------------------------------------------------------
-                    if not closed_successfully and hasattr(MT5Manager, "MTRequest"):
-                        try:
-                            # Attempt to create the formal request
-                            if hasattr(worker.manager, "PositionClose"):
-                                print("   ℹ️ Found PositionClose! This might be the method.")
-                            
-                            if hasattr(worker.manager, "OrderSend"):
-                                print("   ℹ️ Found OrderSend! This might be the Client API method.")
-                            
-                            req = MT5Manager.MTRequest()
-                            
-                            if req is None:
-                                # This is the known library bug, but we check anyway per instruction
-                                print("   ℹ️ Native StopOut Skipped: Library returned None for MTRequest()")
-                            else:
-                                # Fetch Symbol Info for Price
-                                price = 0.0
-                                try:
-                                    # Try to get current price (Bid for Buy pos, Ask for Sell pos)
-                                    # Note: We don't know exact method for SymbolInfo, trying SymbolInfoGet
-                                    if hasattr(worker.manager, "SymbolInfoGet"):
-                                        sym_info = worker.manager.SymbolInfoGet(pos.Symbol)
-                                        if sym_info:
-                                            # Assuming Type 0 = Buy (Close at Bid), Type 1 = Sell (Close at Ask)
-                                            price = sym_info.Bid if pos.Type == 0 else sym_info.Ask
-                                except:
-                                    pass
-
-                                res = MT5Manager.MTConfirm()
-                                req.Action = MT5Manager.MTRequest.EnTradeActions.TA_STOPOUT_POSITION
-                                req.Login = login
-                                req.Position = ticket
-                                req.Symbol = pos.Symbol # User says this is mandatory
-                                req.Volume = int(volume) # User says use INT
-                                req.Price = price # User says use Price, not PriceOrder
-                                req.Comment = "STOP OUT"
-                                
-                                # Add Type and Filling (Standard Requirements)
-                                # Type 0 = Buy, Type 1 = Sell. We need opposite.
-                                try:
-                                    req.Type = MT5Manager.MTRequest.EnOrderType.OP_SELL if pos.Type == 0 else MT5Manager.MTRequest.EnOrderType.OP_BUY
-                                    req.TypeFilling = MT5Manager.MTRequest.EnOrderFilling.ORDER_FILLING_FOK
-                                except:
-                                    pass
-                                
-                                if worker.manager.DealerSend(req, res):
-                                    if res.ResultRetcode in [MT5Manager.EnMTAPIRetcode.MT_RET_OK, MT5Manager.EnMTAPIRetcode.MT_RET_REQUEST_DONE]:
-                                         print(f"   ✅ Native StopOut Success: {ticket}")
-                                         closed_successfully = True
-                                    else:
-                                         print(f"   ⚠️ DealerSend Rejected: {res.ResultRetcode}")
-                                else:
-                                     print(f"   ⚠️ DealerSend Failed to Send")
-                        except Exception as e:
-                            print(f"   ℹ️ Native Attempt Error: {e}")
-                            pass
-
-                    # ---------------------------------------------------------
-                    # FALLBACK: SYNTHETIC CLOSE (Delete + Balance Correct)
-                    # ---------------------------------------------------------
-                    if not closed_successfully:
-                         # A) Delete the Position (Vanish)
-                         if hasattr(worker.manager, "PositionDeleteByTicket"):
-                             worker.manager.PositionDeleteByTicket(ticket)
-                             closed_successfully = True
-                         elif hasattr(worker.manager, "PositionDelete"):
-                              worker.manager.PositionDelete(pos)
-                              closed_successfully = True
-                         else:
-                             print("❌ CRITICAL: No Delete Method Found!")
-                             continue
-                        
-                         # B) Apply PnL (If Delete succeeded)
-                         # if closed_successfully and abs(total_pnl) > 0.01:
-                         #     print(f"   💸 Applying Synthetic PnL: {total_pnl:.2f}")
-                         #     try:
-                         #          comment = f"StopOut #{ticket}"
-                         #          if hasattr(worker.manager, "DealerBalance"):
-                         #               try:
-                         #                   worker.manager.DealerBalance(login, total_pnl, 1, comment)
-                         #               except TypeError:
-                         #                   worker.manager.DealerBalance(login, total_pnl, comment)
-                         #     except Exception as e:
-                         #          print(f"   ❌ Failed to apply PnL: {e}")
-            except Exception as e:
-                print(f"❌ Close failed {pos}: {e}")
+        return planner.close_all(login), planner.left_open
     except Exception as e:
         print(f"❌ PositionRequest failed: {e}")
-    return closed
+        return 0, None
 
 def force_close_orders(login: int):
     """
@@ -833,14 +840,24 @@ def force_close_orders(login: int):
 class SingleAccountRequest(BaseModel):
     login: int
 
+@app.delete("/failed-accounts/{login}")
+def clear_failed_account(login: int):
+    """Re-arms monitoring for a reset / reinstated account (also cleared automatically once its challenge is active again)"""
+    if not failed_accounts.clear(login):
+        raise HTTPException(status_code=404, detail="Account is not marked as failed")
+    return {"status": "success", "message": f"Account {login} removed from the failed registry"}
+
 # ---------------- SINGLE ACCOUNT ACTIONS (ADMIN) ----------------
 @app.post("/disable-account")
-def disable_account_endpoint(req: SingleAccountRequest):
+async def disable_account_endpoint(req: SingleAccountRequest):
+    return await mt5_call(PRIORITY_STOPOUT, _disable_account_endpoint, req)
+
+def _disable_account_endpoint(req: SingleAccountRequest):
     if not worker.connected:
         worker.connect()
     
     try:
-        user = worker.manager.UserRequest(req.login)
+        user = user_cache.request(worker.manager, req.login)
         if not user:
              raise HTTPException(status_code=404, detail="Account not found")
         
@@ -854,7 +871,10 @@ def disable_account_endpoint(req: SingleAccountRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/stop-out-account")
-def stop_out_account_endpoint(req: SingleAccountRequest):
+async def stop_out_account_endpoint(req: SingleAccountRequest):
+    return await mt5_call(PRIORITY_STOPOUT, _stop_out_account, req)
+
+def _stop_out_account(req: SingleAccountRequest):
     if not worker.connected:
         worker.connect()
     
@@ -865,7 +885,7 @@ def stop_out_account_endpoint(req: SingleAccountRequest):
     closed_orders = force_close_orders(req.login)
     
     # 3. Disable User
-    user = worker.manager.UserRequest(req.login)
+    user = user_cache.request(worker.manager, req.login)
     disabled = False
     if user:
          disabled = disable_account(user)
@@ -880,15 +900,28 @@ def stop_out_account_endpoint(req: SingleAccountRequest):
 
 # ---------------- BULK STOP OUT ----------------
 @app.post("/check-bulk")
-def check_bulk(requests: List[StopOutRequest]):
+async def check_bulk(requests: List[StopOutRequest]):
+    # 1. Evaluate the whole batch first (cheap cache reads), 2. then stop out every breach in parallel
+    results, breaches = await mt5_call(PRIORITY_STOPOUT, _evaluate_bulk, requests)
+    if breaches:
+        print(f"⚠️ {len(breaches)} breaches in batch, running stop-out pipeline...")
+        try:
+            await stopout_executor.execute(breaches, on_done=_on_stopout_done)
+        finally:
+            with stopouts_lock:
+                stopouts_in_flight.difference_update(b["login"] for b in breaches)
+    return results
+
+def _evaluate_bulk(requests: List[StopOutRequest]):
     if not worker.connected:
         worker.connect()
 
     results = []
+    breaches = []
     print(f"🔄 Batch Processing {len(requests)} accounts...")
 
     for req in requests:
-        if is_failed(req.login):
+        if is_failed(req.login) or req.login in stopouts_in_flight:
             continue
 
         try:
@@ -909,6 +942,7 @@ def check_bulk(requests: List[StopOutRequest]):
             if not account_data_found:
                  # print(f"⚠️ Cache miss for {req.login}, fetching from Server...")
                  user = worker.manager.UserRequest(req.login)
+                 user_cache.put(user)
                  if user:
                      equity = getattr(user, "Equity", 0.0)
                      balance = getattr(user, "Balance", 0.0)
@@ -926,52 +960,31 @@ def check_bulk(requests: List[StopOutRequest]):
 
             if equity <= req.min_equity_limit:
                 print(f"⚠️ STOP OUT: {req.login} Eq:{equity} <= {req.min_equity_limit}")
+                # Claimed now so an overlapping batch doesn't stop the same account out twice
+                with stopouts_lock:
+                    if req.login in stopouts_in_flight:
+                        continue
+                    stopouts_in_flight.add(req.login)
 
-                actions = []
-
-                if req.close_positions:
-                    closed = force_close_positions(req.login)
-                    closed_orders = force_close_orders(req.login)
-                    actions.append(f"closed_{closed}_positions")
-
-                if req.disable_account:
-                    if not user:
-                        user = worker.manager.UserRequest(req.login)
-                    
-                    if user:
-                         if disable_account(user):
-                             actions.append("account_disabled")
-                    else:
-                         print(f"❌ Could not fetch user {req.login} for disabling")
-
-                mark_failed(req.login)
-
-                results.append({
+                result = {
                     "login": req.login,
                     "status": "FAILED",
                     "equity": equity,
                     "balance": balance,
-                    "actions": actions
+                    "actions": []
+                }
+                results.append(result)
+                breaches.append({
+                    "login": req.login,
+                    "equity": equity,
+                    "balance": balance,
+                    "limit": req.min_equity_limit,
+                    "disable": req.disable_account,
+                    "close": req.close_positions,
+                    "user": user,
+                    "detected_at": time.time(),
+                    "result": result
                 })
-
-                # 3. Webhook to CRM (Notify Breach)
-                try:
-                    webhook_payload = {
-                        "event": "account_breached",
-                        "login": req.login,
-                        "reason": f"System Enforcement Breach: Eq {equity} <= Limit {req.min_equity_limit}",
-                        "equity": equity,
-                        "balance": balance,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    headers = {}
-                    if MT5_WEBHOOK_SECRET:
-                        headers['x-mt5-secret'] = MT5_WEBHOOK_SECRET
-                        
-                    requests.post(CRM_WEBHOOK_URL, json=webhook_payload, headers=headers, timeout=5)
-                    print(f"📧 Webhook sent for {req.login}")
-                except Exception as we:
-                    print(f"❌ Webhook Failed for {req.login}: {we}")
             else:
                 results.append({
                     "login": req.login,
@@ -984,4 +997,79 @@ def check_bulk(requests: List[StopOutRequest]):
             print(f"❌ Error for {req.login}: {e}")
             traceback.print_exc()
 
-    return results
+    return results, breaches
+
+def _stopout_disable(breach):
+    user = breach["user"] or user_cache.request(worker.manager, breach["login"])
+    if not user:
+        print(f"❌ Could not fetch user {breach['login']} for disabling")
+        return False
+    return disable_account(user)
+
+def _stopout_close(breach):
+    closed, breach["positions_left_open"] = close_positions(breach["login"])
+    return closed, force_close_orders(breach["login"])
+
+stopout_executor = StopOutExecutor(mt5_executor, _stopout_disable, _stopout_close)
+
+# Incomplete stop-outs (disable failed or positions left open) are re-run this often, this many times;
+# after that the login is left to the next check-bulk that still sees it breached
+STOPOUT_RETRY_DELAY = float(os.environ.get("STOPOUT_RETRY_DELAY", "5"))
+STOPOUT_RETRIES = int(os.environ.get("STOPOUT_RETRIES", "3"))
+
+def _schedule_stopout_retry(breach):
+    attempt = breach.get("attempt", 0) + 1
+    if attempt > STOPOUT_RETRIES:
+        print(f"❌ Stop-out of {breach['login']} still incomplete after {STOPOUT_RETRIES} retries, left for the next check")
+        return False
+    breach["attempt"] = attempt
+    loop = asyncio.get_running_loop()
+    loop.call_later(STOPOUT_RETRY_DELAY, lambda: loop.create_task(_retry_stopout(breach)))
+    return True
+
+async def _retry_stopout(breach):
+    login = breach["login"]
+    with stopouts_lock:
+        if is_failed(login) or login in stopouts_in_flight:
+            return # Done meanwhile, or a check-bulk batch already has it
+        stopouts_in_flight.add(login)
+    try:
+        for field in ("disabled", "positions_closed", "orders_closed", "positions_left_open", "success"):
+            breach.pop(field, None)
+        print(f"🔄 Retrying stop-out of {login} (attempt {breach['attempt']}/{STOPOUT_RETRIES})")
+        await stopout_executor.execute([breach], on_done=_on_stopout_done)
+    finally:
+        with stopouts_lock:
+            stopouts_in_flight.discard(login)
+
+def _on_stopout_done(breach):
+    login = breach["login"]
+    actions = breach["result"]["actions"]
+    if breach["close"]:
+        actions.append(f"closed_{breach['positions_closed']}_positions")
+    if breach["disabled"]:
+        actions.append("account_disabled")
+
+    if not breach["success"]:
+        # No breach webhook yet: the CRM is only told once the account is actually stopped out
+        print(f"⚠️ Stop-out of {login} incomplete (disabled={breach['disabled']}, positions left={breach.get('positions_left_open')})")
+        _schedule_stopout_retry(breach)
+        return
+    mark_failed(login, "check_bulk")
+
+    # Webhook to CRM (Notify Breach) - queued, never blocks the batch
+    webhook_payload = {
+        "event": "account_breached",
+        "login": login,
+        "reason": f"System Enforcement Breach: Eq {breach['equity']} <= Limit {breach['limit']}",
+        "equity": breach["equity"],
+        "balance": breach["balance"],
+        "timestamp": datetime.now().isoformat()
+    }
+    headers = {}
+    if MT5_WEBHOOK_SECRET:
+        headers['x-mt5-secret'] = MT5_WEBHOOK_SECRET
+
+    key = f"account_breached:{login}:bulk:{datetime.now().date().isoformat()}"
+    if get_dispatcher(supabase).submit(CRM_WEBHOOK_URL, webhook_payload, headers, idempotency_key=key, detected_at=breach["detected_at"]):
+        print(f"📧 Webhook queued for {login}")
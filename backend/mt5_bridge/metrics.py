@@ -0,0 +1,249 @@
+import os
+import math
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+BRIDGE_ID = int(os.getenv("BRIDGE_ID", "1"))
+ROLLUP_INTERVAL = int(os.getenv("METRICS_ROLLUP_INTERVAL", "60"))
+
+# Prometheus bucket bounds (ms) rendered from the HDR buckets
+EXPORT_BOUNDS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram: each power-of-two range is split into SUB_BUCKETS linear
+    buckets (~3% relative error), so recording is O(1) and memory is fixed regardless of count.
+    Values are milliseconds; resolution starts at UNIT_MS.
+    """
+    SUB_BUCKETS = 32
+    UNIT_MS = 0.01
+    MAX_EXPONENT = 32
+
+    def __init__(self):
+        self.counts = [0] * (self.SUB_BUCKETS * (self.MAX_EXPONENT + 1))
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def _index(self, value_ms):
+        units = max(1.0, value_ms / self.UNIT_MS)
+        exponent = min(self.MAX_EXPONENT, int(math.log2(units)))
+        base = 2 ** exponent
+        sub = min(self.SUB_BUCKETS - 1, int((units - base) / base * self.SUB_BUCKETS))
+        return exponent * self.SUB_BUCKETS + sub
+
+    def _upper_ms(self, index):
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        base = 2 ** exponent
+        return (base + base * (sub + 1) / self.SUB_BUCKETS) * self.UNIT_MS
+
+    def record(self, value_ms):
+        if value_ms < 0: value_ms = 0.0
+        i = self._index(value_ms)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value_ms
+            if self.min is None or value_ms < self.min: self.min = value_ms
+            if value_ms > self.max: self.max = value_ms
+
+    def percentile(self, q):
+        with self.lock:
+            if not self.count: return 0.0
+            target = max(1, math.ceil(self.count * q / 100.0))
+            seen = 0
+            for i, c in enumerate(self.counts):
+                seen += c
+                if seen >= target:
+                    return min(self._upper_ms(i), self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """Counts of values <= each bound (approximated at bucket resolution)"""
+        with self.lock:
+            out = []
+            for bound in bounds:
+                limit = self._index(bound)
+                out.append(sum(self.counts[:limit + 1]))
+            return out, self.count, self.sum
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {} # (name, labels) -> LatencyHistogram
+        self.counters = {} # (name, labels) -> float
+        self.gauges = {} # (name, labels) -> float
+        self.help = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())) if labels else ())
+
+    def histogram(self, name, help_text="", **labels):
+        key = self._key(name, labels)
+        h = self.histograms.get(key)
+        if h is None:
+            with self.lock:
+                h = self.histograms.setdefault(key, LatencyHistogram())
+                if help_text: self.help.setdefault(name, help_text)
+        return h
+
+    def observe(self, name, value_ms, **labels):
+        self.histogram(name, **labels).record(value_ms)
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def counter_value(self, name, **labels):
+        return self.counters.get(self._key(name, labels), 0)
+
+    def gauge_value(self, name, default=None, **labels):
+        return self.gauges.get(self._key(name, labels), default)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000.0, **labels)
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+
+        def fmt_labels(labels, extra=None):
+            items = list(labels) + (extra or [])
+            if not items: return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        typed = set()
+        def header(name, kind):
+            if name in typed: return
+            typed.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{fmt_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{fmt_labels(labels)} {float(value)}")
+
+        for (name, labels), h in histograms:
+            header(name, "histogram")
+            cumulative, count, total = h.cumulative(EXPORT_BOUNDS_MS)
+            for bound, c in zip(EXPORT_BOUNDS_MS, cumulative):
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', bound)])} {c}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {round(total, 3)}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+def timed(name, **labels):
+    """Decorator: records the wrapped call's wall time (ms) into histogram `name`"""
+    def decorator(fn):
+        hist = registry.histogram(name, **labels)
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.record((time.perf_counter() - start) * 1000.0)
+        return wrapper
+    return decorator
+
+# --- STOP-OUT RECORDS (flushed to stopout_history by the rollup) ---
+_stopouts = []
+_stopouts_lock = threading.Lock()
+
+def record_stopout(login, equity, latency_ms, success, positions_closed=0, account_disabled=False):
+    registry.observe("stopout_latency_ms", latency_ms)
+    registry.inc("stopouts_executed_total")
+    with _stopouts_lock:
+        _stopouts.append({
+            "bridge_id": BRIDGE_ID,
+            "login": int(login),
+            "equity": float(equity),
+            "latency_ms": round(float(latency_ms), 3),
+            "success": bool(success),
+            "positions_closed": int(positions_closed),
+            "account_disabled": bool(account_disabled),
+            "created_at": datetime.utcnow().isoformat()
+        })
+
+class MetricsRollup:
+    """Every ROLLUP_INTERVAL: one bridge_metrics row (deltas since the last rollup) + buffered stopout_history rows"""
+    def __init__(self, supabase_client, worker_getter=None, interval=ROLLUP_INTERVAL):
+        self.supabase = supabase_client
+        self.worker_getter = worker_getter # Callable: the worker may be swapped on /reload-config
+        self.interval = interval
+        self.running = False
+        self.last = {}
+
+    def start(self):
+        if self.running or not self.supabase: return
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+        print(f"📊 Metrics rollup every {self.interval}s")
+
+    def _delta(self, key, value):
+        prev = self.last.get(key, 0)
+        self.last[key] = value
+        return max(0, value - prev)
+
+    def _loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Metrics rollup failed: {e}")
+
+    def flush(self):
+        with _stopouts_lock:
+            stopouts = _stopouts[:]
+            del _stopouts[:]
+        if stopouts:
+            self.supabase.table("stopout_history").insert(stopouts).execute()
+
+        worker = self.worker_getter() if self.worker_getter else None
+        sent = self._delta("sent", registry.counter_value("webhook_sent_total"))
+        failed = self._delta("failed", registry.counter_value("webhook_failed_total"))
+        pump_total = registry.gauge_value("pump_updates_total", default=getattr(worker, "pump_updates_count", 0))
+
+        row = {
+            "bridge_id": BRIDGE_ID,
+            "timestamp": datetime.utcnow().isoformat(),
+            "accounts_monitored": int(registry.gauge_value("accounts_monitored", default=0)),
+            "stopouts_executed": self._delta("stopouts", registry.counter_value("stopouts_executed_total")),
+            "deals_synced": self._delta("deals", registry.counter_value("deals_synced_total")),
+            "webhook_success_rate": round(sent / (sent + failed) * 100.0, 2) if (sent + failed) else None,
+            "avg_stopout_latency_ms": round(sum(s["latency_ms"] for s in stopouts) / len(stopouts), 3) if stopouts else None,
+            "pump_updates_count": self._delta("pump", pump_total or 0),
+            "mt5_connected": bool(worker and worker.connected)
+        }
+        self.supabase.table("bridge_metrics").insert(row).execute()
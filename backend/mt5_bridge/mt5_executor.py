@@ -0,0 +1,132 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+from metrics import registry
+
+# Lower runs first
+PRIORITY_STOPOUT = 0 # Stop-outs, disables
+PRIORITY_RISK = 1 # RiskEngine snapshots
+PRIORITY_ACCOUNT = 2 # Account creation, deposits
+PRIORITY_SYNC = 3 # Trade fetches, poller
+
+PRIORITY_NAMES = {PRIORITY_STOPOUT: "stopout", PRIORITY_RISK: "risk", PRIORITY_ACCOUNT: "account", PRIORITY_SYNC: "sync"}
+
+MT5_EXECUTOR_THREADS = int(os.environ.get("MT5_EXECUTOR_THREADS", "2"))
+MT5_EXECUTOR_QUEUE = int(os.environ.get("MT5_EXECUTOR_QUEUE", "1000"))
+
+class MT5Busy(Exception):
+    """Executor queue is full (backpressure), the caller should retry later"""
+    pass
+
+class MT5Executor:
+    """
+    Single entry point for blocking MT5 manager calls.
+
+    Calls are queued by priority (stop-outs first, trade syncs last) and run on a small fixed set
+    of dedicated threads, so the manager connection sees predictable concurrency and a burst of
+    trade syncs can't starve stop-outs. Non-stop-out submissions beyond `max_queue` are rejected
+    with MT5Busy instead of piling up. FastAPI routes await run(); worker threads use bind() proxies.
+    """
+    def __init__(self, threads=MT5_EXECUTOR_THREADS, max_queue=MT5_EXECUTOR_QUEUE):
+        self.threads = max(1, threads)
+        self.max_queue = max_queue
+        self.queue = queue.PriorityQueue()
+        self.seq = 0
+        self.seq_lock = threading.Lock()
+        self.running = False
+        self._threads = []
+        self.lease = nullcontext # Called per job; MT5Pool.lease pins the job to one session
+
+    def use_pool(self, pool_getter):
+        """Lease a pool session for each job (pool_getter so a reloaded pool is picked up)"""
+        def lease():
+            pool = pool_getter()
+            return pool.lease() if hasattr(pool, "lease") else nullcontext()
+        self.lease = lease
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        for i in range(self.threads):
+            t = threading.Thread(target=self._loop, name=f"mt5-exec-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"🚀 MT5 Executor: {self.threads} threads, queue {self.max_queue}")
+
+    def submit(self, priority, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs). Returns a concurrent Future; raises MT5Busy when saturated."""
+        if priority != PRIORITY_STOPOUT and self.queue.qsize() >= self.max_queue:
+            registry.inc("mt5_executor_rejected_total", priority=PRIORITY_NAMES.get(priority, str(priority)))
+            raise MT5Busy(f"MT5 executor queue full ({self.max_queue})")
+
+        future = Future()
+        with self.seq_lock:
+            self.seq += 1
+            seq = self.seq
+        self.queue.put((priority, seq, time.perf_counter(), fn, args, kwargs, future))
+        return future
+
+    async def run(self, priority, fn, *args, **kwargs):
+        """Awaitable submit for async routes"""
+        return await asyncio.wrap_future(self.submit(priority, fn, *args, **kwargs))
+
+    def call(self, priority, fn, *args, **kwargs):
+        """Blocking submit for background threads (never raises MT5Busy, waits instead)"""
+        while True:
+            try:
+                return self.submit(priority, fn, *args, **kwargs).result()
+            except MT5Busy:
+                time.sleep(0.05)
+
+    def bind(self, worker_getter, priority, direct=("get_login_group",)):
+        """Worker proxy whose method calls run on the executor at `priority`"""
+        return ExecutorBoundWorker(self, worker_getter, priority, direct)
+
+    def _loop(self):
+        while self.running:
+            try:
+                priority, _, queued_at, fn, args, kwargs, future = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue # Caller gave up (timeout/disconnect) before it started
+
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            registry.observe("mt5_executor_wait_ms", (time.perf_counter() - queued_at) * 1000.0, priority=name)
+            try:
+                with self.lease():
+                    future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def stats(self):
+        return {"threads": self.threads, "queued": self.queue.qsize(), "max_queue": self.max_queue}
+
+class ExecutorBoundWorker:
+    """
+    Stands in for MT5Worker in RiskEngine / DynamicTradePoller: attributes are read straight from the
+    current worker, methods are executed on the MT5 executor. Names in `direct` (pure in-memory
+    lookups) skip the queue.
+    """
+    def __init__(self, executor, worker_getter, priority, direct=()):
+        self._executor = executor
+        self._worker_getter = worker_getter
+        self._priority = priority
+        self._direct = set(direct)
+
+    def __getattr__(self, name):
+        attr = getattr(self._worker_getter(), name)
+        if not callable(attr) or name in self._direct:
+            return attr
+
+        def call(*args, **kwargs):
+            # Resolved inside the job so a pooled worker dispatches to the session leased for it
+            return self._executor.call(self._priority, lambda: getattr(self._worker_getter(), name)(*args, **kwargs))
+        return call
+
+mt5_executor = MT5Executor()
@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from metrics import registry
+
+MT5_POOL_SIZE = int(os.environ.get("MT5_POOL_SIZE", "2"))
+MT5_HEARTBEAT_INTERVAL = float(os.environ.get("MT5_HEARTBEAT_INTERVAL", "5"))
+
+class PoolMember:
+    __slots__ = ("index", "worker", "healthy", "inflight", "reconnecting", "last_ok", "subscriptions")
+
+    def __init__(self, index, worker):
+        self.index = index
+        self.worker = worker
+        self.healthy = False
+        self.inflight = 0
+        self.reconnecting = False
+        self.last_ok = 0
+        self.subscriptions = [] # Pump callbacks this session carries (re-subscribed on reconnect)
+
+class MT5Pool:
+    """
+    N MT5 manager sessions behind the MT5Worker interface.
+
+    - Each MT5 executor job leases the least-loaded healthy session for its whole duration
+      (thread-local), so routes keep calling worker.manager.X / worker.get_deals(...) unchanged.
+    - A heartbeat thread pings every session; a failed one is marked unhealthy (no new leases) and
+      a replacement is connected in the background, then swapped in with its pump subscriptions.
+    - drain() waits for in-flight leases before disconnecting, which makes /reload-config
+      zero-downtime: the new pool is connected and swapped in first, the old one drains after.
+    The Client API (terminal) is one process-wide session, so the pool collapses to size 1 there.
+    """
+    def __init__(self, size=MT5_POOL_SIZE, heartbeat_interval=MT5_HEARTBEAT_INTERVAL, worker_factory=None):
+        if worker_factory is None:
+            from mt5_worker import MT5Worker
+            worker_factory = MT5Worker
+        self.size = max(1, size)
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_factory = worker_factory
+        self.members = []
+        self.lock = threading.Lock()
+        self.login_groups = {} # Shared login -> group cache across sessions
+        self.running = False
+        self._local = threading.local()
+
+    # --- Lifecycle ---
+    def start(self):
+        """Connects all sessions. Returns True if at least one is healthy."""
+        for i in range(self.size):
+            member = PoolMember(i, self._new_worker())
+            self._connect(member)
+            self.members.append(member)
+            if i == 0 and getattr(member.worker, "_use_client_api", False):
+                break # Terminal connection is a singleton
+
+        self.running = True
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+        healthy = sum(1 for m in self.members if m.healthy)
+        print(f"🚀 MT5 Pool: {healthy}/{len(self.members)} sessions connected")
+        return healthy > 0
+
+    def drain(self, timeout=30):
+        """Stops heartbeats, waits for in-flight leases, then disconnects every session"""
+        self.running = False
+        deadline = time.time() + timeout
+        while time.time() < deadline and any(m.inflight for m in self.members):
+            time.sleep(0.1)
+        for m in self.members:
+            m.healthy = False
+            try:
+                if hasattr(m.worker, "disconnect"):
+                    m.worker.disconnect()
+            except Exception as e:
+                print(f"⚠️ MT5 Pool: disconnect of session {m.index} failed: {e}")
+        print(f"🔌 MT5 Pool drained ({len(self.members)} sessions)")
+
+    def _new_worker(self):
+        worker = self.worker_factory()
+        worker._login_groups = self.login_groups
+        return worker
+
+    def _connect(self, member):
+        try:
+            member.worker.connect()
+        except Exception as e:
+            print(f"⚠️ MT5 Pool: session {member.index} connect failed: {e}")
+        member.healthy = self._ping(member.worker)
+        if member.healthy:
+            member.last_ok = time.time()
+        return member.healthy
+
+    @staticmethod
+    def _ping(worker):
+        if not worker.connected: return False
+        ping = getattr(worker, "ping", None)
+        return ping() if ping else True
+
+    # --- Leasing ---
+    def _pick(self):
+        with self.lock:
+            candidates = [m for m in self.members if m.healthy] or self.members
+            member = min(candidates, key=lambda m: m.inflight)
+            member.inflight += 1
+            return member
+
+    @contextmanager
+    def lease(self):
+        """Pins the calling thread to the least-loaded healthy session"""
+        member = self._pick()
+        previous = getattr(self._local, "member", None)
+        self._local.member = member
+        try:
+            yield member.worker
+        finally:
+            self._local.member = previous
+            with self.lock:
+                member.inflight -= 1
+
+    def _current(self):
+        member = getattr(self._local, "member", None)
+        if member is not None:
+            return member.worker
+        if not self.members:
+            raise AttributeError("MT5 pool has no sessions")
+        with self.lock:
+            candidates = [m for m in self.members if m.healthy] or self.members
+            return min(candidates, key=lambda m: m.inflight).worker
+
+    def __getattr__(self, name):
+        # Everything else (manager, get_deals, _use_client_api, ...) comes from the leased session
+        if name.startswith("__") or "members" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self._current(), name)
+
+    # --- MT5Worker interface (pool-wide) ---
+    @property
+    def connected(self):
+        return any(m.healthy for m in self.members)
+
+    def connect(self):
+        """Synchronous reconnect of unhealthy sessions (normally the heartbeat does this in the background)"""
+        for m in self.members:
+            if not m.healthy and not m.reconnecting:
+                self._reconnect(m)
+        return self.connected
+
+    def disconnect(self):
+        self.drain(timeout=0)
+
+    def get_login_group(self, login):
+        return self.login_groups.get(int(login))
+
+    @property
+    def pump_updates_count(self):
+        return sum(getattr(m.worker, "pump_updates_count", 0) for m in self.members)
+
+    def subscribe_updates(self, on_update):
+        """Pump subscription on one healthy session; moved to the replacement if that session reconnects"""
+        for m in self.members:
+            if m.healthy and hasattr(m.worker, "subscribe_updates") and m.worker.subscribe_updates(on_update):
+                m.subscriptions.append(on_update)
+                return True
+        return False
+
+    def pump_callbacks(self):
+        return [cb for m in self.members for cb in m.subscriptions]
+
+    # --- Health ---
+    def _heartbeat_loop(self):
+        while self.running:
+            time.sleep(self.heartbeat_interval)
+            for m in list(self.members):
+                if m.reconnecting or not self.running: continue
+                started = time.perf_counter()
+                try:
+                    ok = self._ping(m.worker)
+                except Exception:
+                    ok = False
+                registry.observe("mt5_heartbeat_ms", (time.perf_counter() - started) * 1000.0, session=str(m.index))
+                if ok:
+                    m.healthy = True
+                    m.last_ok = time.time()
+                    continue
+                if m.healthy:
+                    print(f"⚠️ MT5 Pool: session {m.index} failed heartbeat, reconnecting in background")
+                m.healthy = False
+                m.reconnecting = True
+                threading.Thread(target=self._reconnect, args=(m,), daemon=True).start()
+            registry.set_gauge("mt5_pool_healthy_sessions", sum(1 for m in self.members if m.healthy))
+
+    def _reconnect(self, member):
+        """Warm reconnect: a fresh session is connected first and only then replaces the failed one"""
+        member.reconnecting = True
+        try:
+            replacement = self._new_worker()
+            try:
+                replacement.connect()
+            except Exception as e:
+                print(f"⚠️ MT5 Pool: session {member.index} reconnect failed: {e}")
+                return
+            if not self._ping(replacement):
+                return
+
+            for cb in member.subscriptions:
+                if hasattr(replacement, "subscribe_updates"):
+                    replacement.subscribe_updates(cb)
+            old = member.worker
+            member.worker = replacement
+            member.healthy = True
+            member.last_ok = time.time()
+            registry.inc("mt5_reconnects_total")
+            print(f"✅ MT5 Pool: session {member.index} reconnected")
+            try:
+                if hasattr(old, "disconnect"):
+                    old.disconnect()
+            except Exception:
+                pass
+        finally:
+            member.reconnecting = False
+
+    def stats(self):
+        now = time.time()
+        return {
+            "sessions": [{
+                "index": m.index,
+                "healthy": m.healthy,
+                "inflight": m.inflight,
+                "reconnecting": m.reconnecting,
+                "last_ok_age": round(now - m.last_ok, 1) if m.last_ok else None
+            } for m in self.members]
+        }
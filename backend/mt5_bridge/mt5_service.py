@@ -3,6 +3,8 @@ import traceback
 import requests
 from datetime import datetime
 from mt5_worker import MT5Worker, MT5Manager
+from user_cache import UserRecordCache, UserAuditor, update_succeeded
+from failed_registry import get_failed_registry
 
 # Load .env file if present
 try:
@@ -136,15 +138,35 @@ def init_worker():
 # Initialize on import
 init_worker()
 
+# User records: write-through on UserUpdate, read-back verification deferred to the auditor thread
+user_cache = UserRecordCache()
+if hasattr(worker, "subscribe_updates"):
+    worker.subscribe_updates(user_cache.on_update)
+
+def _audit_alert(login, expected, actual):
+    log_system_event("ERROR", f"Account {login} update did not stick", {"expected": expected, "actual": actual})
+
+user_auditor = UserAuditor(
+    user_cache,
+    fetch=lambda login: worker.manager.UserRequest(login),
+    write=lambda login, fields: user_cache.update(worker.manager, login, **fields),
+    alert=_audit_alert
+)
+user_auditor.start()
+
 # --- RISK MONITOR: STOP OUT LOGIC ---
 
-failed_accounts = set()
+# Durable across restarts and shared with the RiskEngine / trade poller
+failed_accounts = get_failed_registry()
 
 def is_failed(login):
     return login in failed_accounts
 
-def mark_failed(login):
-    failed_accounts.add(login)
+def mark_failed(login, reason="stop_out"):
+    return failed_accounts.mark(login, reason)
+
+def clear_failed(login):
+    return failed_accounts.clear(login)
 
 
 # ---------------- CORE STOP-OUT ACTIONS ----------------
@@ -161,19 +183,17 @@ def disable_account(user):
         user.Rights = 0 # USER_RIGHT_NONE
 
     try:
-        # Attempt update
-        result = worker.manager.UserUpdate(user)
+        # Attempt update: only these fields, onto a fresh record (write-through: the cache now holds the disabled record)
+        expected = {k: 0 for k in ("Enable", "Rights") if hasattr(user, k)}
+        result = user_cache.update(worker.manager, user.Login, **expected)
         
-        if result == 0 or result is True:
+        if update_succeeded(result):
              print(f"SUCCESS: UserUpdate call returned success for {user.Login}.")
              log_system_event("INFO", f"Account {user.Login} DISABLED Successfully")
              
-             # VERIFICATION: Re-fetch user to see if it stuck
-             updated_user = worker.manager.UserRequest(user.Login)
-             if updated_user:
-                 print(f"VERIFY: Post-Update Enable: {getattr(updated_user, 'Enable', 'N/A')}")
-                 print(f"VERIFY: Post-Update Rights: {getattr(updated_user, 'Rights', 'N/A')}")
-                 # print(f"VERIFY: Post-Update Comment: {getattr(updated_user, 'Comment', 'N/A')}")
+             # VERIFICATION: Deferred - the auditor re-fetches the user later, re-applies and alerts on mismatch
+             if expected:
+                 user_auditor.expect(user.Login, **expected)
                  
              return True
         
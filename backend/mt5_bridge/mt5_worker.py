@@ -1,9 +1,12 @@
 import os
 import time
 import logging
+import threading
 from typing import List, Optional
 from datetime import datetime
 
+from metrics import timed
+
 # --- MT5 API Wrappers ---
 MT5_LIB = None
 
@@ -46,6 +49,46 @@ class MT5Manager:
             print("⚠️ Initializing Mock MTConfirm")
             self.ResultRetcode = 0
 
+# Simulated pump period for the mock ManagerAPI (seconds)
+MOCK_PUMP_INTERVAL = float(os.getenv("MOCK_PUMP_INTERVAL", "1.0"))
+
+class PumpSink:
+    """
+    Manager pump sink (IMTUserSink / IMTPositionSink / IMTDealSink).
+    Every notification is reduced to (login, kind) and handed to the callback on the pump thread,
+    so the callback must be cheap (e.g. mark the login dirty).
+    """
+    def __init__(self, worker, on_update):
+        self.worker = worker
+        self.on_update = on_update
+
+    def _fire(self, obj, kind):
+        login = getattr(obj, 'Login', None)
+        if login is None: return
+        self.worker.pump_updates_count += 1
+        try:
+            self.on_update(int(login), kind)
+        except Exception as e:
+            print(f"⚠️ Pump callback error ({kind}, {login}): {e}")
+
+    def OnUserUpdate(self, user): self._fire(user, "user")
+    def OnPositionAdd(self, position): self._fire(position, "position")
+    def OnPositionUpdate(self, position): self._fire(position, "position")
+    def OnPositionDelete(self, position): self._fire(position, "position")
+    def OnDealAdd(self, deal): self._fire(deal, "deal")
+    def OnDealUpdate(self, deal): self._fire(deal, "deal")
+
+def floating_pl(account, equity, balance):
+    """
+    Floating P/L of the open positions: the account record's own figure (IMTAccount.Floating / Profit,
+    Client API profit); otherwise equity less balance and credit (prop accounts often carry credit).
+    """
+    for name in ("Floating", "Profit", "profit"):
+        value = getattr(account, name, None)
+        if value is not None: return float(value)
+    credit = getattr(account, "Credit", getattr(account, "credit", 0.0))
+    return equity - balance - float(credit or 0.0)
+
 class MT5Worker:
     def __init__(self):
         # Credentials are injected into os.environ by mt5_service.py (from Supabase)
@@ -57,6 +100,9 @@ class MT5Worker:
         
         self.connected = False
         self._manager = None # For Manager API
+        self._login_groups = {} # login -> group, filled by UserLogins / UserRequest
+        self._sinks = [] # Keep pump sinks referenced while subscribed
+        self.pump_updates_count = 0
         self._use_client_api = False # For Client API (MetaTrader5)
         
         logging.info(f"MT5Worker initialized. Target: {self._server} (Login: {self._login})")
@@ -113,7 +159,35 @@ class MT5Worker:
     def _create_manager_mock(self):
         """Returns an object that mimics the MT5 Manager API"""
         class ManagerAPI:
+            def __init__(self):
+                self._sinks = []
+                self._seen = set() # Logins touched so far, the simulated pump re-publishes these
+                self._pump = None
+
+            # --- Simulated Pump ---
+            def UserSubscribe(self, sink): return self._subscribe(sink)
+            def PositionSubscribe(self, sink): return self._subscribe(sink)
+            def DealSubscribe(self, sink): return self._subscribe(sink)
+            def _subscribe(self, sink):
+                if sink not in self._sinks:
+                    self._sinks.append(sink)
+                if not self._pump:
+                    self._pump = threading.Thread(target=self._pump_loop, daemon=True)
+                    self._pump.start()
+                return True
+            def _pump_loop(self):
+                class Update:
+                    def __init__(self, login): self.Login = login
+                while True:
+                    time.sleep(MOCK_PUMP_INTERVAL)
+                    for login in list(self._seen):
+                        for sink in list(self._sinks):
+                            # Floating P/L moves: position updates (user updates mean the record was edited)
+                            try: sink.OnPositionUpdate(Update(login))
+                            except Exception: pass
+
             def UserRequest(self, login):
+                self._seen.add(login)
                 class User:
                     def __init__(self, login):
                         self.Login = login
@@ -125,9 +199,19 @@ class MT5Worker:
                         self.Rights = 1
                         self.Comment = ""
                 return User(login)
+            def UserAccountGet(self, login):
+                self._seen.add(login)
+                class Account:
+                    def __init__(self, login):
+                        self.Login = login
+                        self.Equity = 100000.0
+                        self.Balance = 100000.0
+                return Account(login)
             def UserUpdate(self, user): return True
             def PositionRequest(self, login): return []
             def DealRequest(self, login, from_tm, to_tm): return []
+            def DealRequestByGroup(self, group, from_tm, to_tm): return []
+            def TimeServer(self): return int(time.time())
             def OrderRequest(self, login): return []
             def DealerSend(self, req, res): 
                 res.ResultRetcode = 0
@@ -152,6 +236,58 @@ class MT5Worker:
     def manager(self):
         return self._manager
 
+    def ping(self):
+        """Cheap liveness check for pool heartbeats"""
+        if not self.connected: return False
+        try:
+            if self._use_client_api:
+                return mt5.terminal_info() is not None
+            if self._manager:
+                if hasattr(self._manager, "TimeServer"):
+                    return bool(self._manager.TimeServer())
+                return True
+        except Exception as e:
+            print(f"⚠️ MT5 ping failed: {e}")
+        return False
+
+    def disconnect(self):
+        try:
+            if self._use_client_api:
+                mt5.shutdown()
+            elif self._manager and hasattr(self._manager, "Disconnect"):
+                self._manager.Disconnect()
+        except Exception as e:
+            print(f"⚠️ MT5 disconnect failed: {e}")
+        self.connected = False
+        self._sinks = []
+
+    def subscribe_updates(self, on_update):
+        """
+        Subscribe to manager user/position/deal notifications.
+        on_update(login, kind) is called from the pump thread, kind is 'user', 'position' or 'deal'.
+        Returns True if at least one subscription is active (Client API has no pump).
+        """
+        if not self.connected or not self._manager: return False
+
+        sink = PumpSink(self, on_update)
+        subscribed = False
+        for method in ("UserSubscribe", "PositionSubscribe", "DealSubscribe"):
+            if not hasattr(self._manager, method): continue
+            try:
+                res = getattr(self._manager, method)(sink)
+                if res is True or res == 0:
+                    subscribed = True
+                else:
+                    print(f"⚠️ {method} failed: {res}")
+            except Exception as e:
+                print(f"⚠️ {method} failed: {e}")
+
+        if subscribed:
+            self._sinks.append(sink)
+            print("📡 Subscribed to MT5 pump (user/position/deal)")
+        return subscribed
+
+    @timed("mt5_call_latency_ms", call="get_positions")
     def get_positions(self, login):
         """Fetch open positions"""
         if not self.connected: 
@@ -179,11 +315,13 @@ class MT5Worker:
             return []
         return []
 
-    def get_deals(self, login, from_time, to_time):
-        """Fetch history deals"""
+    @timed("mt5_call_latency_ms", call="get_deals")
+    def get_deals(self, login, from_time, to_time, strict=False):
+        """Fetch history deals. strict=True returns None (instead of []) when the fetch failed."""
+        failed = None if strict else []
         if not self.connected: 
             print("⚠️ get_deals: Not connected")
-            return []
+            return failed
         
         try:
             # Client API Logic
@@ -191,7 +329,7 @@ class MT5Worker:
                 deals = mt5.history_deals_get(login=login, date_from=datetime.fromtimestamp(from_time), date_to=datetime.fromtimestamp(to_time))
                 if deals is None:
                     print(f"   ⚠️ mt5.history_deals_get failed: {mt5.last_error()}")
-                    return []
+                    return failed
                 return deals
 
             # Manager API Logic
@@ -200,8 +338,43 @@ class MT5Worker:
                 
         except Exception as e:
             print(f"Error getting deals: {e}")
-            return []
-        return []
+            return failed
+        return failed
+
+    @timed("mt5_call_latency_ms", call="get_deals_by_group")
+    def get_deals_by_group(self, group, from_time, to_time, strict=False):
+        """
+        Fetch history deals of every login in a group with one request.
+        Manager API: DealRequestByGroup, falling back to DealRequestByLogins over UserLogins(group).
+        Client API: only the logged-in account's deals exist.
+        strict=True returns None (instead of []) when the fetch failed.
+        """
+        failed = None if strict else []
+        if not self.connected:
+            print("⚠️ get_deals_by_group: Not connected")
+            return failed
+
+        try:
+            if self._use_client_api:
+                deals = mt5.history_deals_get(datetime.fromtimestamp(from_time), datetime.fromtimestamp(to_time))
+                return deals or []
+
+            if self._manager:
+                if hasattr(self._manager, "DealRequestByGroup"):
+                    return self._manager.DealRequestByGroup(group, from_time, to_time) or []
+                logins = self._manager.UserLogins(group) or []
+                if logins and hasattr(self._manager, "DealRequestByLogins"):
+                    return self._manager.DealRequestByLogins(logins, from_time, to_time) or []
+                # Old manager builds: per-login scan
+                deals = []
+                for login in logins:
+                    deals.extend(self._manager.DealRequest(login, from_time, to_time) or [])
+                return deals
+
+        except Exception as e:
+            print(f"Error getting deals for group {group}: {e}")
+            return failed
+        return failed
 
     def close_position(self, ticket):
         print(f"Worker: Closing ticket {ticket}")
@@ -221,13 +394,107 @@ class MT5Worker:
         if self._manager:
             try:
                 logins = self._manager.UserLogins(group) or []
-                for login in logins:
-                    u = self.get_user_info(login)
-                    if u: users.append(u)
+                snap = self.get_users_snapshot(logins, groups=[group])
+                for i in range(len(snap["login"])):
+                    users.append({
+                        "login": snap["login"][i],
+                        "group": snap["group"][i],
+                        "equity": snap["equity"][i],
+                        "balance": snap["balance"][i]
+                    })
             except Exception as e:
                 print(f"Error fetching group users {group}: {e}")
         return users
 
+    @timed("mt5_call_latency_ms", call="get_users_snapshot")
+    def get_users_snapshot(self, logins, groups=None):
+        """
+        Fetch equity/balance for many logins in one pass.
+        Returns a columnar dict: { login: [...], group: [...], equity: [...], balance: [...], floating: [...] }
+        Logins the server doesn't know are omitted.
+
+        groups: Optional list of groups to resolve login -> group with one UserLogins call per group.
+        Equity/Balance come from UserAccountGet (pump cache, no server hit); UserRequest is only
+        used for logins whose account or group is still unknown.
+        """
+        snap = {"login": [], "group": [], "equity": [], "balance": [], "floating": []}
+        if not self.connected or not logins: return snap
+
+        try:
+            if self._manager:
+                # 1. Group membership: O(groups) calls
+                if groups and hasattr(self._manager, "UserLogins"):
+                    for group in groups:
+                        try:
+                            for login in self._manager.UserLogins(group) or []:
+                                self._login_groups[int(login)] = group
+                        except Exception as e:
+                            print(f"Error fetching logins for group {group}: {e}")
+
+                has_account_get = hasattr(self._manager, "UserAccountGet")
+                for login in logins:
+                    login = int(login)
+                    account = None
+                    if has_account_get:
+                        try:
+                            account = self._manager.UserAccountGet(login)
+                        except Exception:
+                            account = None
+
+                    group = self._login_groups.get(login)
+                    try:
+                        if account is None or group is None:
+                            # SLOW PATH: Server hit, also gives us the group
+                            user_data = self._manager.UserRequest(login)
+                            if not user_data: continue
+                            group = user_data.Group
+                            self._login_groups[login] = group
+                            if account is None: account = user_data
+                        equity, balance = float(account.Equity), float(account.Balance)
+                        floating = floating_pl(account, equity, balance)
+                    except Exception as e:
+                        # One bad login must not cut the snapshot short for every login after it
+                        print(f"Error fetching user {login} for snapshot: {e}")
+                        continue
+
+                    snap["login"].append(login)
+                    snap["group"].append(group)
+                    snap["equity"].append(equity)
+                    snap["balance"].append(balance)
+                    snap["floating"].append(floating)
+
+            elif self._use_client_api:
+                # Client API only sees the logged-in account
+                acc_info = mt5.account_info()
+                if acc_info and acc_info.login in set(int(l) for l in logins):
+                    snap["login"].append(int(acc_info.login))
+                    snap["group"].append(acc_info.group)
+                    snap["equity"].append(float(acc_info.equity))
+                    snap["balance"].append(float(acc_info.balance))
+                    snap["floating"].append(floating_pl(acc_info, float(acc_info.equity), float(acc_info.balance)))
+        except Exception as e:
+            print(f"Error fetching users snapshot: {e}")
+
+        return snap
+
+    @timed("mt5_call_latency_ms", call="get_group_logins")
+    def get_group_logins(self, group):
+        """Logins in a group (one UserLogins call; also fills the login -> group map). None on failure."""
+        if not self.connected or not self._manager or not hasattr(self._manager, "UserLogins"): return None
+        try:
+            logins = [int(l) for l in self._manager.UserLogins(group) or []]
+        except Exception as e:
+            print(f"Error fetching logins for group {group}: {e}")
+            return None
+        for login in logins:
+            self._login_groups[login] = group
+        return logins
+
+    def get_login_group(self, login: int):
+        """Group of a login as last seen by get_users_snapshot (None if unknown)"""
+        return self._login_groups.get(int(login))
+
+    @timed("mt5_call_latency_ms", call="get_user_info")
     def get_user_info(self, login: int):
         """Fetch real-time equity/balance for a single login"""
         if not self.connected: return None
@@ -1,36 +1,88 @@
 
 import time
-import json
 import threading
-import requests
 import os
 from datetime import datetime, timezone
 
-# Load Rules
-RULES_FILE = os.path.join(os.path.dirname(__file__), "risk_rules.json")
-rules_cache = {}
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def load_rules():
-    global rules_cache
-    try:
-        with open(RULES_FILE, 'r') as f:
-            rules_cache = json.load(f)
-        print(f"✅ [RiskEngine] Loaded rules for {len(rules_cache)} groups.")
-    except Exception as e:
-        print(f"❌ [RiskEngine] Failed to load rules: {e}")
+from webhook_dispatcher import get_dispatcher
+from metrics import registry
+from risk_scheduler import BreachScheduler
+from failed_registry import get_failed_registry
+from rule_table import RuleTable, type_id
 
 # Webhook Config
 CRM_WEBHOOK_URL = os.environ.get("CRM_WEBHOOK_URL", "https://api.sharkfunded.co/api/webhooks/mt5")
 MT5_WEBHOOK_SECRET = os.environ.get("MT5_WEBHOOK_SECRET", "")
 
+# Vectorized sweep (numpy). Set RISK_VECTORIZED=0 to fall back to per-account check_user.
+RISK_VECTORIZED = os.environ.get("RISK_VECTORIZED", "1") == "1"
+
+# Push mode: evaluate only logins the MT5 pump reported as changed. Set RISK_PUSH_MODE=0 to poll every 0.5s.
+RISK_PUSH_MODE = os.environ.get("RISK_PUSH_MODE", "1") == "1"
+
+# account_update stream: publish only when equity moves more than the epsilon, at most once per
+# WS_MIN_INTERVAL per login, and at least every WS_HEARTBEAT_INTERVAL
+WS_EQUITY_EPSILON = float(os.environ.get("WS_EQUITY_EPSILON", "0.01"))
+WS_MIN_INTERVAL = float(os.environ.get("WS_MIN_INTERVAL", "1.0"))
+WS_HEARTBEAT_INTERVAL = float(os.environ.get("WS_HEARTBEAT_INTERVAL", "30"))
+# Polling mode: check accounts on a breach-proximity schedule instead of the whole book every tick.
+# Set RISK_SCHEDULER=0 to sweep everything every 0.5s.
+RISK_SCHEDULER = os.environ.get("RISK_SCHEDULER", "1") == "1"
+
+# Shards suppress repeats of an event key for this long (the coordinator's dispatcher dedups too,
+# but re-sending every sweep would keep the events queue full)
+RISK_EVENT_DEDUP_TTL = float(os.environ.get("RISK_EVENT_DEDUP_TTL", "3600"))
+
+def start_equity_of(meta):
+    """
+    Priority 1: CRM provide SOD Equity
+    Priority 2: CRM provided Current Equity (Fallback for new accounts)
+    Priority 3: Initial Balance (Last resort)
+    """
+    crm_sod = meta.get('start_of_day_equity')
+    crm_current = meta.get('current_equity')
+    return float(crm_sod if crm_sod is not None else (crm_current if crm_current is not None else meta.get('initial_balance', 0)))
+
+def limit_bounds(limits, meta):
+    """(floor, ceiling) equity for scheduling: the nearer of the two drawdown limits and the profit target (0 = none)"""
+    max_dd_percent, daily_dd_percent, profit_target_percent = limits
+    ib = meta.get('initial_balance', 0)
+    floor = max(ib * (1 - (max_dd_percent / 100.0)), start_equity_of(meta) * (1 - (daily_dd_percent / 100.0)))
+    ceiling = ib * (1 + (profit_target_percent / 100.0)) if profit_target_percent > 0 else 0.0
+    return floor, ceiling
+
+METADATA_COLUMNS = 'login, initial_balance, challenge_type, status, start_of_day_equity, current_equity, created_at, updated_at'
+
+def _epoch(ts):
+    """Supabase timestamp (ISO 8601) -> epoch seconds, None if missing or unparseable"""
+    if not ts: return None
+    try:
+        return datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()
+    except (TypeError, ValueError):
+        return None
+
 class RiskEngine:
-    def __init__(self, mt5_worker, supabase_client=None, ws_manager=None):
+    def __init__(self, mt5_worker, supabase_client=None, ws_manager=None, shard_index=0, shard_count=1, event_sink=None):
         self.worker = mt5_worker
         self.supabase = supabase_client
         self.ws_manager = ws_manager
         self.running = False
         self.thread = None
         self.lock = threading.Lock()
+
+        # Sharding (risk_shards.py): this engine only owns logins with login % shard_count == shard_index
+        # and hands breach/pass webhooks to event_sink (the coordinator) instead of sending them itself.
+        self.shard_index = shard_index
+        self.shard_count = max(1, shard_count)
+        self.event_sink = event_sink
+        self.dispatcher = None if event_sink else get_dispatcher(supabase_client)
+        self.sent_keys = {} # idempotency key -> time handed to event_sink
+        self.shard_rpc = self.shard_count > 1 # risk_shard_challenges (schema.sql) until it turns out to be missing
         
         # In-Memory State for Daily Equity
         # Key: login (int), Value: { "date": "YYYY-MM-DD", "equity": float }
@@ -41,14 +93,61 @@ class RiskEngine:
         self.account_metadata = {}
         self.last_cache_refresh = 0
         self.CACHE_REFRESH_INTERVAL = 60 # Refresh every 60 seconds
+        self.FULL_RECONCILE_INTERVAL = 600 # Full re-select (catches hard deletes), deltas in between
+        self.metadata_cursor = None # Max challenges.updated_at seen
+        self.last_full_reconcile = 0
+
+        # Vectorized State (rebuilt only in refresh_account_metadata)
+        # Row i of every array belongs to self._vec_logins[i] (sorted for searchsorted)
+        self.vectorized = RISK_VECTORIZED and np is not None
+        self._vec_logins = None
+        self._vec_initial = None
+        self._vec_start_equity = None
+        self._vec_max_dd_limit = None
+        self._vec_daily_limit = None
+        self._vec_target = None
+        self._vec_unresolved = set() # Logins whose MT5 group was unknown at build time
+
+        # Push Mode State (fed by the MT5 pump thread)
+        self.push_mode = False
+        self.dirty_cond = threading.Condition()
+        self.dirty_logins = {} # login -> time of first pump event since last check
+        self.last_equity = {} # login -> (equity, balance) at last dirty check
+        self.last_full_sweep = 0
+        self.FULL_SWEEP_INTERVAL = 30 # Safety net for missed pump events
+
+        # account_update Stream State
+        self.last_published = {} # login -> (equity, ts) of last WS publish
+
+        # Breach-Proximity Schedule (polling mode; full sweeps every FULL_SWEEP_INTERVAL still cover everyone)
+        self.scheduler = BreachScheduler() if RISK_SCHEDULER else None
+
+        # Stopped-out logins (persisted by check-bulk): never evaluated, even right after a restart
+        self.failed_accounts = get_failed_registry()
+        self.inactive_since_mark = set() # Failed logins whose challenge row was seen leaving 'active'
+
+        # Instrumentation
+        self.snapshot_at = 0 # When the equity being evaluated was read (breach-to-webhook latency origin)
+        self.last_sweep_started = 0
+
+        # Compiled per-(group, challenge type) limits, hot-reloaded from risk_rules.json / account_groups
+        self.rules = RuleTable(supabase_client)
+        self.rules.load()
+        self.rules_version = self.rules.version
+        self.login_group_ids = {} # login -> interned group id (filled once the login's MT5 group is known)
 
-        load_rules()
         self.refresh_account_metadata()
 
     def start(self):
         if self.running:
             return
         self.running = True
+        if RISK_PUSH_MODE and hasattr(self.worker, 'subscribe_updates'):
+            self.push_mode = self.worker.subscribe_updates(self.mark_dirty)
+        if self.push_mode:
+            self.scheduler = None # Pump events already target the accounts that moved
+        print(f"🚀 [RiskEngine] Mode: {'push (MT5 pump)' if self.push_mode else 'polling'}")
+        self.rules.start_watcher()
         self.thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self.thread.start()
         print("🚀 [RiskEngine] Started Autonomous Risk Monitor Thread")
@@ -64,56 +163,406 @@ class RiskEngine:
                 # Periodic Cache Refresh
                 if time.time() - self.last_cache_refresh > self.CACHE_REFRESH_INTERVAL:
                     self.refresh_account_metadata()
+                if self.rules.version != self.rules_version:
+                    self._apply_rules()
+
+                if self.push_mode and time.time() - self.last_full_sweep < self.FULL_SWEEP_INTERVAL:
+                    self.check_dirty_accounts(timeout=0.5)
+                    continue
+
+                if self.scheduler and self.last_full_sweep and time.time() - self.last_full_sweep < self.FULL_SWEEP_INTERVAL:
+                    self.check_scheduled_accounts()
+                    time.sleep(self.scheduler.min_interval)
+                    continue
 
                 self.check_all_accounts()
+                self.last_full_sweep = time.time()
             except Exception as e:
                 print(f"⚠️ [RiskEngine] Error in loop: {e}")
             
-            time.sleep(0.5) 
+            if not self.push_mode:
+                time.sleep(0.5) 
+
+    def mark_dirty(self, login, kind=None):
+        """Pump callback (runs on the MT5 pump thread): queue login for evaluation"""
+        with self.dirty_cond:
+            self.dirty_logins.setdefault(login, time.time())
+            self.dirty_cond.notify()
+
+    def _requeue(self, logins):
+        """Metadata or limits changed: re-evaluate these logins on the next dirty check, equity moved or not"""
+        for login in logins:
+            self.last_equity.pop(login, None)
+        if self.push_mode:
+            for login in logins:
+                self.mark_dirty(login)
+
+    def check_dirty_accounts(self, timeout=0.5):
+        """Waits up to `timeout` for pump events, then evaluates only logins whose equity or balance moved"""
+        with self.dirty_cond:
+            if not self.dirty_logins:
+                self.dirty_cond.wait(timeout)
+            dirty = self.dirty_logins
+            self.dirty_logins = {}
+
+        metadata = self.account_metadata
+        logins = [l for l in dirty if l in metadata]
+        if not logins: return
+
+        started = time.perf_counter()
+        self.snapshot_at = time.time()
+        snap = self.worker.get_users_snapshot(logins)
+        # Equity staleness in push mode: pump event -> evaluation
+        registry.observe("risk_equity_age_ms", (self.snapshot_at - min(dirty[l] for l in logins)) * 1000.0, mode="push")
+        last_equity = self.last_equity
+        moved = {key: [] for key in snap}
+        for i, login in enumerate(snap["login"]):
+            state = (snap["equity"][i], snap["balance"][i])
+            if last_equity.get(login) == state: continue
+            last_equity[login] = state
+            for key in moved:
+                moved[key].append(snap[key][i])
+
+        if moved["login"]:
+            self._check_snapshot(moved)
+        registry.observe("risk_sweep_duration_ms", (time.perf_counter() - started) * 1000.0, mode="dirty")
+
+    def check_scheduled_accounts(self):
+        """Evaluates only the logins whose breach-proximity schedule is due"""
+        metadata = self.account_metadata
+        logins = [l for l in self.scheduler.pop_due() if l in metadata]
+        if not logins: return
+
+        started = time.perf_counter()
+        self.snapshot_at = time.time()
+        snap = self.worker.get_users_snapshot(logins)
+        self._check_snapshot(snap)
+        seen = set(snap["login"])
+        for login in logins:
+            if login not in seen:
+                self.scheduler.defer(login)
+        registry.inc("risk_scheduled_checks_total", len(logins))
+        registry.observe("risk_sweep_duration_ms", (time.perf_counter() - started) * 1000.0, mode="scheduled")
+
+    def owns(self, login):
+        return self.shard_count == 1 or login % self.shard_count == self.shard_index
+
+    @staticmethod
+    def _meta_from_row(row):
+        return {
+            "initial_balance": float(row.get('initial_balance', 0)),
+            "type": row.get('challenge_type', ''),
+            "type_id": type_id(row.get('challenge_type', '')),
+            "status": row.get('status', 'active'),
+            "start_of_day_equity": row.get('start_of_day_equity'),
+            "current_equity": row.get('current_equity')
+        }
 
     def refresh_account_metadata(self):
-        """Fetches active accounts and their rules from Supabase"""
+        """
+        Fetches active accounts and their rules from Supabase.
+        Full reconcile every FULL_RECONCILE_INTERVAL, otherwise only rows with updated_at >= cursor
+        are patched into account_metadata (and the vector rows) in place.
+        """
         if not self.supabase: return
-        
+
+        self.failed_accounts.refresh() # Picks up marks made by other processes
+        if self.metadata_cursor is None or time.time() - self.last_full_reconcile > self.FULL_RECONCILE_INTERVAL:
+            self._full_metadata_refresh()
+        else:
+            self._delta_metadata_refresh()
+            self._drop_failed()
+        self.last_cache_refresh = time.time()
+        registry.set_gauge("accounts_monitored", len(self.account_metadata))
+        if self.scheduler:
+            self.scheduler.sync(self.account_metadata.keys())
+
+    def _select_challenges(self, since=None):
+        """
+        Active challenges (since=None) or every row updated since `since`.
+        Shards fetch only their own partition through the risk_shard_challenges RPC; without it they
+        fall back to the plain select and the owns() filter.
+        """
+        if self.shard_rpc:
+            try:
+                return self.supabase.rpc('risk_shard_challenges', {
+                    'p_shard_index': self.shard_index,
+                    'p_shard_count': self.shard_count,
+                    'p_since': since
+                }).execute()
+            except Exception as e:
+                print(f"⚠️ [RiskEngine] risk_shard_challenges unavailable, filtering locally: {e}")
+                self.shard_rpc = False
+
+        query = self.supabase.table('challenges').select(METADATA_COLUMNS)
+        query = query.gte('updated_at', since) if since else query.eq('status', 'active')
+        return query.execute()
+
+    def _full_metadata_refresh(self):
         try:
-            response = self.supabase.table('challenges') \
-                .select('login, initial_balance, challenge_type, status, start_of_day_equity, current_equity') \
-                .eq('status', 'active') \
-                .execute()
+            response = self._select_challenges()
                 
             if response.data:
                 new_metadata = {}
+                cursor = None
                 for row in response.data:
                     login = row.get('login')
-                    if login:
-                        new_metadata[int(login)] = {
-                            "initial_balance": float(row.get('initial_balance', 0)),
-                            "type": row.get('challenge_type', ''),
-                            "status": row.get('status', 'active'),
-                            "start_of_day_equity": row.get('start_of_day_equity'),
-                            "current_equity": row.get('current_equity')
-                        }
-                self.account_metadata = new_metadata
+                    if login and int(login) in self.failed_accounts and self.owns(int(login)):
+                        self._check_reinstated(int(login), row)
+                    if login and self.owns(int(login)) and int(login) not in self.failed_accounts:
+                        new_metadata[int(login)] = self._meta_from_row(row)
+                    updated_at = row.get('updated_at')
+                    if updated_at and (cursor is None or updated_at > cursor):
+                        cursor = updated_at
+                old_metadata, self.account_metadata = self.account_metadata, new_metadata
+                self._requeue([l for l, meta in new_metadata.items() if old_metadata.get(l) != meta])
+                self.metadata_cursor = cursor or datetime.now(timezone.utc).isoformat()
+                if self.vectorized:
+                    self._build_vectors()
                 # print(f"✅ [RiskEngine] Refreshed Metadata: {len(self.account_metadata)} accounts")
             
-            self.last_cache_refresh = time.time()
+            self.last_full_reconcile = time.time()
+            self.login_group_ids = {} # Re-resolved lazily (catches MT5 group moves)
             
         except Exception as e:
             print(f"⚠️ [RiskEngine] Metadata refresh failed: {e}")
 
+    def _delta_metadata_refresh(self):
+        try:
+            # No status filter: rows leaving 'active' must be removed
+            response = self._select_challenges(since=self.metadata_cursor)
+
+            metadata = self.account_metadata
+            changed, added, removed = [], [], []
+            cursor = self.metadata_cursor
+            for row in response.data or []:
+                updated_at = row.get('updated_at')
+                if updated_at and updated_at > cursor:
+                    cursor = updated_at
+                login = row.get('login')
+                if not login or not self.owns(int(login)): continue
+                login = int(login)
+                if login in self.failed_accounts:
+                    self._check_reinstated(login, row)
+
+                if row.get('status') != 'active':
+                    if metadata.pop(login, None) is not None:
+                        removed.append(login)
+                    continue
+
+                meta = self._meta_from_row(row)
+                if login not in metadata:
+                    added.append(login)
+                elif metadata[login] != meta:
+                    changed.append(login)
+                else:
+                    continue
+                metadata[login] = meta
+
+            self.metadata_cursor = cursor
+            self._requeue(changed + added)
+            if self.vectorized and self._vec_logins is not None and (changed or added or removed):
+                if added or removed:
+                    self._build_vectors() # Row set changed: re-sort
+                else:
+                    self._patch_vectors(changed)
+        except Exception as e:
+            print(f"⚠️ [RiskEngine] Metadata delta refresh failed: {e}")
+
+    def _check_reinstated(self, login, row):
+        """
+        Re-arms a stopped-out login once its challenge is back: a row created after the mark (reset /
+        new challenge on the same login), or the row returning to 'active' after it was seen inactive.
+        """
+        if row.get('status') != 'active':
+            self.inactive_since_mark.add(login)
+            return
+        created = _epoch(row.get('created_at'))
+        marked = self.failed_accounts.marked_at(login)
+        if login in self.inactive_since_mark or (created and marked and created > marked):
+            self.inactive_since_mark.discard(login)
+            if self.failed_accounts.clear(login):
+                print(f"🔄 [RiskEngine] {login} is active again, removed from the failed registry")
+
+    def _limits(self, login, group, meta):
+        """Compiled (max_dd, daily_dd, target) percentages; the group name is only looked up the first time"""
+        gid = self.login_group_ids.get(login)
+        if gid is None:
+            gid = self.rules.group_id(group)
+            if group is not None:
+                self.login_group_ids[login] = gid
+        return self.rules.limits(gid, meta['type_id'])
+
+    def _apply_rules(self):
+        """Rule table recompiled by the watcher: re-derive the precomputed limits"""
+        self.rules_version = self.rules.version
+        if self.vectorized and self._vec_logins is not None:
+            self._build_vectors()
+        self._requeue(list(self.account_metadata))
+        print(f"🔄 [RiskEngine] Applied risk rules v{self.rules_version} to {len(self.account_metadata)} accounts")
+
+    def _fill_vector_row(self, arrays, i, login, meta):
+        """Computes row i of (initial, start_equity, max_dd_limit, daily_limit, target). Returns False if the login's group is still unknown."""
+        group = self.worker.get_login_group(login) if hasattr(self.worker, 'get_login_group') else None
+        max_dd_percent, daily_dd_percent, profit_target_percent = self._limits(login, group, meta)
+
+        initial, start_equity, max_dd_limit, daily_limit, target = arrays
+        ib = meta.get('initial_balance', 0)
+        sod = start_equity_of(meta)
+        initial[i] = ib
+        start_equity[i] = sod
+        max_dd_limit[i] = ib * (1 - (max_dd_percent / 100.0))
+        daily_limit[i] = sod * (1 - (daily_dd_percent / 100.0))
+        target[i] = ib * (1 + (profit_target_percent / 100.0)) if profit_target_percent > 0 else 0.0
+        return group is not None
+
+    def _build_vectors(self):
+        """Flattens account_metadata + group rules into aligned numpy arrays"""
+        metadata = self.account_metadata
+        logins = sorted(metadata.keys())
+        n = len(logins)
+        arrays = tuple(np.zeros(n) for _ in range(5))
+
+        unresolved = set()
+        for i, login in enumerate(logins):
+            if not self._fill_vector_row(arrays, i, login, metadata[login]):
+                unresolved.add(login)
+
+        # Built off to the side and published together, so readers never see a half-built set
+        initial, start_equity, max_dd_limit, daily_limit, target = arrays
+        self._vec_logins = np.array(logins, dtype=np.int64)
+        self._vec_initial = initial
+        self._vec_start_equity = start_equity
+        self._vec_max_dd_limit = max_dd_limit
+        self._vec_daily_limit = daily_limit
+        self._vec_target = target
+        self._vec_unresolved = unresolved
+
+    def _patch_vectors(self, logins):
+        """Recomputes only the rows of the given (already present) logins"""
+        metadata = self.account_metadata
+        arrays = (self._vec_initial, self._vec_start_equity, self._vec_max_dd_limit, self._vec_daily_limit, self._vec_target)
+        rows = np.searchsorted(self._vec_logins, np.array(logins, dtype=np.int64))
+        for login, i in zip(logins, rows):
+            if self._fill_vector_row(arrays, int(i), login, metadata[login]):
+                self._vec_unresolved.discard(login)
+            else:
+                self._vec_unresolved.add(login)
+
+    def evaluate_vectorized(self, logins, equity):
+        """
+        One array comparison over the whole book.
+        logins/equity: aligned arrays from the MT5 snapshot.
+        Returns (rows, max_breach, daily_breach, passed) where rows maps each snapshot entry
+        to its metadata row (-1 if unknown) and the rest are index arrays into the snapshot.
+        """
+        vec_logins = self._vec_logins
+        if not len(vec_logins) or not len(logins):
+            empty = np.zeros(0, dtype=np.int64)
+            return np.full(len(logins), -1, dtype=np.int64), empty, empty, empty
+
+        rows = np.searchsorted(vec_logins, logins)
+        rows[rows >= len(vec_logins)] = 0
+        known = vec_logins[rows] == logins
+        rows = np.where(known, rows, -1)
+
+        # Skip accounts without initial balance and the zero equity glitch
+        valid = known & (self._vec_initial[rows] > 0) & (equity > 0.1)
+
+        max_breach = valid & (equity <= self._vec_max_dd_limit[rows])
+        daily_breach = valid & ~max_breach & (equity <= self._vec_daily_limit[rows])
+        target = self._vec_target[rows]
+        passed = valid & ~max_breach & ~daily_breach & (target > 0) & (equity >= target)
+
+        return rows, np.nonzero(max_breach)[0], np.nonzero(daily_breach)[0], np.nonzero(passed)[0]
+
+    def _drop_failed(self):
+        """Removes logins stopped out since the last refresh"""
+        dead = [login for login in self.account_metadata if login in self.failed_accounts]
+        if not dead: return
+        for login in dead:
+            self.account_metadata.pop(login, None)
+        if self.vectorized and self._vec_logins is not None:
+            self._build_vectors()
+
     def check_all_accounts(self):
         # We now primarily iterate the account_metadata we have from CRM
         # This ensures we only check accounts that exist in the CRM database
-        for login, meta in self.account_metadata.items():
-            # Get real-time data from MT5 Worker for this specific login
-            # Optimization: Worker could batch this, but for now we follow the existing pattern
-            user_info = self.worker.get_user_info(login)
-            if user_info:
-                self.check_user(user_info, meta)
+        metadata = self.account_metadata
+        if not metadata: return
+
+        started = time.perf_counter()
+        self.snapshot_at = time.time()
+        # Equity staleness in full sweeps: worst case an account waits one whole sweep cycle
+        if self.last_sweep_started:
+            registry.observe("risk_equity_age_ms", (self.snapshot_at - self.last_sweep_started) * 1000.0, mode="sweep")
+        self.last_sweep_started = self.snapshot_at
+
+        # One batched snapshot per sweep: UserLogins per rule group + cached UserAccountGet
+        snap = self.worker.get_users_snapshot(list(metadata.keys()), groups=self.rules.groups())
+        self._check_snapshot(snap)
+        registry.observe("risk_sweep_duration_ms", (time.perf_counter() - started) * 1000.0, mode="full")
+
+    def _check_snapshot(self, snap):
+        """Evaluates a columnar snapshot (all accounts or just the dirty ones)"""
+        if self.vectorized and self._vec_logins is not None:
+            self._check_all_vectorized(snap)
+            return
+
+        metadata = self.account_metadata
+        logins, groups, equities, balances = snap["login"], snap["group"], snap["equity"], snap["balance"]
+        floatings = snap["floating"]
+        for i in range(len(logins)):
+            meta = metadata.get(logins[i])
+            if not meta: continue
+            user_info = {
+                "login": logins[i],
+                "group": groups[i],
+                "equity": equities[i],
+                "balance": balances[i],
+                "floating_pl": floatings[i]
+            }
+            self.check_user(user_info, meta)
+            if self.scheduler:
+                floor, ceiling = limit_bounds(self._limits(logins[i], groups[i], meta), meta)
+                self.scheduler.observe(logins[i], equities[i], balances[i], floor, ceiling, self.snapshot_at)
+
+    def _check_all_vectorized(self, snap):
+        # Groups learned by this snapshot -> percentages change, rebuild once
+        if self._vec_unresolved and any(self.worker.get_login_group(l) is not None for l in self._vec_unresolved):
+            self._build_vectors()
+
+        logins = np.asarray(snap["login"], dtype=np.int64)
+        equity = np.asarray(snap["equity"], dtype=np.float64)
+        balances, floatings = snap["balance"], snap["floating"]
+        rows, max_breach, daily_breach, passed = self.evaluate_vectorized(logins, equity)
+
+        if self.ws_manager:
+            for i in np.nonzero(rows >= 0)[0]:
+                if equity[i] > 0.1:
+                    self._broadcast_account_update(int(logins[i]), float(equity[i]), float(floatings[i]))
+
+        for i in max_breach:
+            r = rows[i]
+            self.trigger_breach(int(logins[i]), "Overall Drawdown", float(equity[i]), balances[i], float(self._vec_max_dd_limit[r]), float(self._vec_initial[r]))
+        for i in daily_breach:
+            r = rows[i]
+            self.trigger_breach(int(logins[i]), "Daily Drawdown", float(equity[i]), balances[i], float(self._vec_daily_limit[r]), float(self._vec_start_equity[r]))
+        for i in passed:
+            self.trigger_pass(int(logins[i]), float(equity[i]), balances[i], float(self._vec_target[rows[i]]))
+
+        if self.scheduler:
+            known = np.nonzero(rows >= 0)[0]
+            r = rows[known]
+            floors = np.maximum(self._vec_max_dd_limit[r], self._vec_daily_limit[r])
+            ceilings = self._vec_target[r]
+            observe, now = self.scheduler.observe, self.snapshot_at
+            for j, i in enumerate(known):
+                observe(int(logins[i]), float(equity[i]), float(balances[i]), float(floors[j]), float(ceilings[j]), now)
 
     def check_user(self, user_info, meta):
         """
-        user_info: Dict { login, group, equity, balance }
+        user_info: Dict { login, group, equity, balance, floating_pl }
         meta: Dict { initial_balance, type, status }
         """
         login = user_info.get('login')
@@ -124,28 +573,8 @@ class RiskEngine:
         
         if initial_balance <= 0: return # Skip if no initial balance data
 
-        # 1. Get Rules for the group
-        rule = rules_cache.get(group)
-        if not rule:
-            max_dd_percent = 10.0
-            daily_dd_percent = 5.0
-            profit_target_percent = 0.0
-        else:
-            # Rule Override for Funded Accounts
-            if 'funded' in meta.get('type', '').lower():
-                max_dd_percent = 10.0
-                daily_dd_percent = 5.0
-                profit_target_percent = 0.0
-            else:
-                max_dd_percent = rule.get("max_drawdown_percent", 10.0)
-                daily_dd_percent = rule.get("daily_drawdown_percent", 5.0)
-                profit_target_percent = rule.get("profit_target_percent", 0.0)
-                if profit_target_percent <= 0.0:
-                    ctype = meta.get('type', '').lower()
-                    if 'phase_2' in ctype or 'phase 2' in ctype:
-                        profit_target_percent = rule.get("profit_target_phase2_percent", 0.0)
-                    else:
-                        profit_target_percent = rule.get("profit_target_phase1_percent", 0.0)
+        # 1. Get Rules for the group (compiled table, no string work)
+        max_dd_percent, daily_dd_percent, profit_target_percent = self._limits(login, group, meta)
 
         # --- ZERO EQUITY GLITCH PROTECTION ---
         # Sometimes MT5 Bridge returns 0 equity for a split second during sync or creation.
@@ -161,32 +590,7 @@ class RiskEngine:
 
         # 1.5 WebSocket Broadcast (Unified Account Update)
         if self.ws_manager:
-            import asyncio
-            floating_pl = 0.0
-            try:
-                positions = self.worker.get_positions(login) or []
-                for pos in positions:
-                    floating_pl += float(getattr(pos, 'Profit', getattr(pos, 'profit', 0.0)))
-            except: pass
-
-            payload = {
-                "event": "account_update",
-                "login": login,
-                "equity": equity,
-                "floating_pl": round(floating_pl, 2),
-                "trades_closed": False,
-                "closed_count": 0,
-                "timestamp": datetime.now().isoformat()
-            }
-            try:
-                if getattr(self.ws_manager, 'main_loop', None):
-                    import asyncio
-                    asyncio.run_coroutine_threadsafe(
-                        self.ws_manager.broadcast(login, payload), 
-                        self.ws_manager.main_loop
-                    )
-            except Exception as e: 
-                print(f"WS Broadcast error: {e}")
+            self._broadcast_account_update(login, equity, user_info.get('floating_pl', 0.0))
 
         # 2. OVERALL DRAWDOWN CHECK (Static Model vs Initial Balance)
         max_dd_limit = initial_balance * (1 - (max_dd_percent / 100.0))
@@ -195,13 +599,7 @@ class RiskEngine:
             return
 
         # 3. DAILY DRAWDOWN CHECK
-        # Priority 1: CRM provide SOD Equity
-        # Priority 2: CRM provided Current Equity (Fallback for new accounts)
-        # Priority 3: Initial Balance (Last resort)
-        crm_sod = meta.get('start_of_day_equity')
-        crm_current = meta.get('current_equity')
-        
-        start_equity = float(crm_sod if crm_sod is not None else (crm_current if crm_current is not None else initial_balance))
+        start_equity = start_equity_of(meta)
 
         # Formula: Limit Equity = SOD Equity * (1 - Daily_Drawdown_Percent / 100)
         daily_limit = start_equity * (1 - (daily_dd_percent / 100.0))
@@ -216,7 +614,49 @@ class RiskEngine:
             if equity >= target_equity:
                 self.trigger_pass(login, equity, balance, target_equity)
 
+    def _broadcast_account_update(self, login, equity, floating_pl):
+        # Nobody subscribed to this login or the master stream: skip before any MT5 call
+        has_listeners = getattr(self.ws_manager, 'has_listeners', None)
+        if has_listeners and not has_listeners(login):
+            return
+
+        # Change detection + per-login rate limit (heartbeat keeps idle accounts fresh)
+        now = time.time()
+        last = self.last_published.get(login)
+        if last:
+            last_equity, last_ts = last
+            elapsed = now - last_ts
+            if elapsed < WS_MIN_INTERVAL:
+                return
+            if abs(equity - last_equity) <= WS_EQUITY_EPSILON and elapsed < WS_HEARTBEAT_INTERVAL:
+                return
+        self.last_published[login] = (equity, now)
+
+        payload = {
+            "event": "account_update",
+            "login": login,
+            "equity": equity,
+            # From the same account record as equity (no position requests, credit excluded)
+            "floating_pl": round(floating_pl, 2),
+            "trades_closed": False,
+            "closed_count": 0,
+            "timestamp": datetime.now().isoformat()
+        }
+        try:
+            if hasattr(self.ws_manager, 'broadcast_threadsafe'):
+                self.ws_manager.broadcast_threadsafe(login, payload)
+            elif getattr(self.ws_manager, 'main_loop', None):
+                import asyncio
+                asyncio.run_coroutine_threadsafe(
+                    self.ws_manager.broadcast(login, payload), 
+                    self.ws_manager.main_loop
+                )
+        except Exception as e: 
+            print(f"WS Broadcast error: {e}")
+
     def trigger_breach(self, login, risk_type, current_equity, current_balance, limit, reference_value):
+        if login in self.failed_accounts:
+            return # Already stopped out (until the next refresh drops it from the book)
         print(f"🛑 [RiskEngine] BREACH: {login} - {risk_type}. Eq: {current_equity} <= {limit}")
         
         # 3. Webhook to CRM
@@ -229,12 +669,9 @@ class RiskEngine:
             "timestamp": datetime.now().isoformat()
         }
         
-        headers = {"x-mt5-secret": MT5_WEBHOOK_SECRET} if MT5_WEBHOOK_SECRET else {}
-        try:
-            requests.post(CRM_WEBHOOK_URL, json=payload, headers=headers, timeout=5)
-            print(f"📧 Breach Webhook sent for {login}")
-        except Exception as e:
-            print(f"❌ Webhook Failed for {login}: {e}")
+        key = f"account_breached:{login}:{risk_type}:{datetime.now().date().isoformat()}"
+        if self._send_webhook(payload, key):
+            print(f"📧 Breach Webhook queued for {login}")
 
     def trigger_pass(self, login, current_equity, current_balance, target):
         print(f"✅ [RiskEngine] PROFIT TARGET MET: {login}. Eq: {current_equity} >= {target}")
@@ -247,9 +684,21 @@ class RiskEngine:
             "timestamp": datetime.now().isoformat()
         }
         
+        key = f"account_passed:{login}:{datetime.now().date().isoformat()}"
+        if self._send_webhook(payload, key):
+            print(f"📧 Pass Webhook queued for {login}")
+
+    def _send_webhook(self, payload, key):
+        if self.event_sink:
+            now = time.time()
+            sent = self.sent_keys.get(key)
+            if sent and now - sent < RISK_EVENT_DEDUP_TTL:
+                return False # Already handed to the coordinator
+            if not self.event_sink({"type": "webhook", "payload": payload, "key": key, "detected_at": self.snapshot_at}):
+                return False # Not recorded, so the next sweep retries it
+            if len(self.sent_keys) > 10000:
+                self.sent_keys = {k: t for k, t in self.sent_keys.items() if now - t < RISK_EVENT_DEDUP_TTL}
+            self.sent_keys[key] = now
+            return True
         headers = {"x-mt5-secret": MT5_WEBHOOK_SECRET} if MT5_WEBHOOK_SECRET else {}
-        try:
-            requests.post(CRM_WEBHOOK_URL, json=payload, headers=headers, timeout=5)
-            print(f"📧 Pass Webhook sent for {login}")
-        except Exception as e:
-            print(f"❌ Webhook Failed for {login}: {e}")
+        return self.dispatcher.submit(CRM_WEBHOOK_URL, payload, headers, idempotency_key=key, detected_at=self.snapshot_at)
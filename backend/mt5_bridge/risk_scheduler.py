@@ -0,0 +1,112 @@
+import os
+import heapq
+import time
+
+# Check cadence bounds (seconds). Accounts near a limit are checked every tick,
+# far-away or flat accounts back off towards RISK_MAX_INTERVAL.
+RISK_MIN_INTERVAL = float(os.environ.get("RISK_MIN_INTERVAL", "0.5"))
+RISK_MAX_INTERVAL = float(os.environ.get("RISK_MAX_INTERVAL", "5.0"))
+# Within this % of equity from a limit (or the profit target) -> every tick
+RISK_NEAR_PERCENT = float(os.environ.get("RISK_NEAR_PERCENT", "1.0"))
+# Re-check after this fraction of the estimated time-to-breach
+RISK_SAFETY_FACTOR = float(os.environ.get("RISK_SAFETY_FACTOR", "0.25"))
+
+class BreachScheduler:
+    """
+    Priority queue of logins keyed by next check time.
+
+    After each check an account's next interval is its estimated time-to-limit
+    (distance to the nearest limit / recent equity velocity) scaled by RISK_SAFETY_FACTOR
+    and clamped to [RISK_MIN_INTERVAL, RISK_MAX_INTERVAL].
+    Velocity is an EWMA of |d equity| / dt, floored by a fraction of the floating P/L so an
+    account with open exposure but no recent movement is not treated as static.
+    Flat accounts (equity == balance, no open exposure) go straight to RISK_MAX_INTERVAL.
+    """
+    EWMA_ALPHA = 0.3
+    EXPOSURE_RATE = 0.05 # Assumed fraction of floating P/L that can move per second
+
+    def __init__(self, min_interval=RISK_MIN_INTERVAL, max_interval=RISK_MAX_INTERVAL,
+                 near_percent=RISK_NEAR_PERCENT, safety_factor=RISK_SAFETY_FACTOR):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near_fraction = near_percent / 100.0
+        self.safety_factor = safety_factor
+        self.heap = [] # (due, login), stale entries skipped on pop
+        self.due = {} # login -> current due time
+        self.motion = {} # login -> (last_equity, last_ts, velocity)
+
+    def sync(self, logins, now=None):
+        """Aligns the schedule with the monitored set: new logins are due now, removed ones dropped"""
+        now = now or time.time()
+        logins = set(logins)
+        for login in list(self.due):
+            if login not in logins:
+                del self.due[login]
+                self.motion.pop(login, None)
+        for login in logins:
+            if login not in self.due:
+                self._push(login, now)
+
+    def pop_due(self, now=None):
+        """All logins whose check is due"""
+        now = now or time.time()
+        heap = self.heap
+        due = []
+        while heap and heap[0][0] <= now:
+            when, login = heapq.heappop(heap)
+            if self.due.get(login) == when:
+                due.append(login)
+        return due
+
+    def observe(self, login, equity, balance, floor, ceiling=0.0, now=None):
+        """
+        Records a fresh equity reading and schedules the next check.
+        floor: Highest breach limit (equity <= floor is a breach).
+        ceiling: Profit target (0 = none).
+        """
+        if login not in self.due: return
+        now = now or time.time()
+
+        prev = self.motion.get(login)
+        velocity = 0.0
+        if prev:
+            last_equity, last_ts, velocity = prev
+            dt = now - last_ts
+            if dt > 0:
+                velocity = self.EWMA_ALPHA * (abs(equity - last_equity) / dt) + (1 - self.EWMA_ALPHA) * velocity
+        self.motion[login] = (equity, now, velocity)
+
+        self._push(login, now + self.interval_for(equity, balance, floor, ceiling, velocity))
+
+    def defer(self, login, now=None):
+        """No reading this time (login missing from the snapshot): retry at the slowest cadence"""
+        if login in self.due:
+            self._push(login, (now or time.time()) + self.max_interval)
+
+    def interval_for(self, equity, balance, floor, ceiling, velocity):
+        distance = equity - floor
+        if ceiling > 0:
+            distance = min(distance, ceiling - equity)
+
+        if distance <= max(equity, 0.0) * self.near_fraction:
+            return self.min_interval
+
+        floating = abs(equity - balance)
+        if floating < 0.01 and velocity < 0.01:
+            return self.max_interval # Flat: equity can't move until a position opens
+
+        rate = max(velocity, floating * self.EXPOSURE_RATE, 1e-9)
+        return min(self.max_interval, max(self.min_interval, distance / rate * self.safety_factor))
+
+    def _push(self, login, when):
+        self.due[login] = when
+        heapq.heappush(self.heap, (when, login))
+        # Lazy deletion leaves stale entries behind, compact when they dominate
+        if len(self.heap) > 4 * len(self.due) + 1024:
+            self.heap = [(w, l) for l, w in self.due.items()]
+            heapq.heapify(self.heap)
+
+    def stats(self, now=None):
+        now = now or time.time()
+        near = sum(1 for when in self.due.values() if when - now <= self.min_interval)
+        return {"scheduled": len(self.due), "due_within_tick": near}
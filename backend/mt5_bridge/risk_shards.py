@@ -0,0 +1,250 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing as mp
+from datetime import datetime
+
+HEALTH_INTERVAL = 5 # Seconds between shard health reports
+RESTART_BACKOFF = 10 # Seconds before a dead shard is respawned
+# Subscribed logins shared with the shards; with more rooms than slots, every login counts as listened
+WS_LISTENER_SLOTS = int(os.getenv("WS_LISTENER_SLOTS", "4096"))
+LISTENER_REFRESH = 0.25 # Seconds between coordinator listener-state updates
+
+LISTENERS_NONE = 0
+LISTENERS_SOME = 1 # Only the logins in the slots
+LISTENERS_ALL = 2 # Master stream connected (or slots overflowed)
+
+class ListenerFlags:
+    """
+    WebSocket subscription state in shared memory, written by the coordinator and read by the shards,
+    so a shard drops account updates nobody is connected for before they cross the events queue.
+    `version` bumps on every change; readers re-read the login slots only then.
+    """
+    def __init__(self, ctx, slots=WS_LISTENER_SLOTS):
+        self.lock = ctx.Lock()
+        self.mode = ctx.Value('i', LISTENERS_NONE, lock=False)
+        self.version = ctx.Value('q', 0, lock=False)
+        self.count = ctx.Value('i', 0, lock=False)
+        self.logins = ctx.Array('q', max(1, slots), lock=False)
+        self.last = None # Coordinator side: last published (master, logins)
+
+    def publish(self, master, logins):
+        if (master, logins) == self.last: return
+        self.last = (master, logins)
+        with self.lock:
+            if master or len(logins) > len(self.logins):
+                self.mode.value = LISTENERS_ALL
+                self.count.value = 0
+            else:
+                for i, login in enumerate(logins):
+                    self.logins[i] = login
+                self.count.value = len(logins)
+                self.mode.value = LISTENERS_SOME if logins else LISTENERS_NONE
+            self.version.value += 1
+
+    def read(self):
+        """(mode, version, logins) as one consistent snapshot"""
+        with self.lock:
+            return self.mode.value, self.version.value, frozenset(self.logins[:self.count.value])
+
+class QueueWSProxy:
+    """Stands in for ConnectionManager inside a shard process: account updates go to the coordinator"""
+    def __init__(self, events, listeners=None):
+        self.events = events
+        self.listeners = listeners
+        self.version = -1
+        self.mode = LISTENERS_ALL
+        self.logins = frozenset()
+
+    def has_listeners(self, login):
+        if self.listeners is None: return True
+        if self.listeners.version.value != self.version:
+            self.mode, self.version, self.logins = self.listeners.read()
+        return self.mode == LISTENERS_ALL or (self.mode == LISTENERS_SOME and login in self.logins)
+
+    def broadcast_threadsafe(self, login, message):
+        try:
+            self.events.put_nowait({"type": "ws", "login": login, "payload": message})
+        except queue.Full:
+            pass # Snapshots are best-effort, the next one supersedes it
+
+def _shard_main(shard_index, shard_count, events, stop_event, listeners=None):
+    """Shard process: own MT5 manager connection + RiskEngine over its login-hash partition"""
+    from mt5_worker import MT5Worker
+    from risk_engine import RiskEngine
+    from metrics import registry
+
+    supabase = None
+    url = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+    if url and key:
+        try:
+            from supabase import create_client
+            supabase = create_client(url, key)
+        except Exception as e:
+            print(f"⚠️ [Shard {shard_index}] Supabase init failed: {e}")
+
+    worker = MT5Worker()
+    worker.connect()
+
+    def sink(event):
+        """Never blocks the sweep on a slow coordinator: False = queue full, the engine re-emits next sweep"""
+        event["shard"] = shard_index
+        try:
+            events.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    engine = RiskEngine(worker, supabase, ws_manager=QueueWSProxy(events, listeners),
+                        shard_index=shard_index, shard_count=shard_count, event_sink=sink)
+    engine.start()
+    print(f"🚀 [Shard {shard_index}/{shard_count}] Monitoring {len(engine.account_metadata)} accounts")
+
+    while not stop_event.is_set():
+        try:
+            events.put_nowait({
+                "type": "health",
+                "shard": shard_index,
+                "pid": os.getpid(),
+                "accounts": len(engine.account_metadata),
+                "mt5_connected": bool(worker.connected),
+                "push_mode": engine.push_mode,
+                "pump_updates_count": getattr(worker, 'pump_updates_count', 0),
+                "sweep_p50_ms": registry.histogram("risk_sweep_duration_ms", mode="full").percentile(50),
+                "sweep_p99_ms": registry.histogram("risk_sweep_duration_ms", mode="full").percentile(99),
+                "timestamp": time.time()
+            })
+        except queue.Full:
+            pass
+        stop_event.wait(HEALTH_INTERVAL)
+
+    engine.stop()
+
+class ShardedRiskEngine:
+    """
+    Coordinator for N RiskEngine processes, each owning logins with login % N == shard index.
+    Shards evaluate in parallel on separate cores; the coordinator is the single place that
+    sends breach/pass webhooks (shared dispatcher, idempotency dedup) and WS broadcasts,
+    tracks per-shard health and respawns shards that die.
+    """
+    def __init__(self, shard_count, supabase_client=None, ws_manager=None):
+        self.shard_count = shard_count
+        self.ws_manager = ws_manager
+        self.supabase = supabase_client
+        self.ctx = mp.get_context("spawn")
+        self.events = self.ctx.Queue(maxsize=100000)
+        self.stop_event = self.ctx.Event()
+        self.listeners = ListenerFlags(self.ctx)
+        self.processes = {} # shard -> Process
+        self.started_at = {} # shard -> start time
+        self.health = {} # shard -> last health report
+        self.running = False
+        self.thread = None
+        self.dispatcher = None
+
+    def start(self):
+        if self.running: return
+        from webhook_dispatcher import get_dispatcher
+        self.dispatcher = get_dispatcher(self.supabase)
+        self.running = True
+        for shard in range(self.shard_count):
+            self._spawn(shard)
+        self.thread = threading.Thread(target=self._coordinator_loop, daemon=True)
+        self.thread.start()
+        print(f"🚀 [RiskEngine] Started {self.shard_count} shard processes")
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        for p in self.processes.values():
+            p.join(timeout=5)
+            if p.is_alive(): p.terminate()
+        if self.thread:
+            self.thread.join()
+
+    def _spawn(self, shard):
+        p = self.ctx.Process(target=_shard_main, args=(shard, self.shard_count, self.events, self.stop_event, self.listeners),
+                             name=f"risk-shard-{shard}", daemon=True)
+        p.start()
+        self.processes[shard] = p
+        self.started_at[shard] = time.time()
+
+    def _coordinator_loop(self):
+        from risk_engine import CRM_WEBHOOK_URL, MT5_WEBHOOK_SECRET
+        from metrics import registry
+        headers = {"x-mt5-secret": MT5_WEBHOOK_SECRET} if MT5_WEBHOOK_SECRET else {}
+        last_liveness = 0
+        last_listeners = 0
+
+        while self.running:
+            if time.time() - last_listeners > LISTENER_REFRESH:
+                last_listeners = time.time()
+                self._publish_listeners()
+
+            try:
+                event = self.events.get(timeout=0.5)
+                kind = event.get("type")
+                if kind == "webhook":
+                    self.dispatcher.submit(CRM_WEBHOOK_URL, event["payload"], headers, idempotency_key=event.get("key"),
+                                           detected_at=event.get("detected_at"))
+                elif kind == "ws":
+                    if self.ws_manager:
+                        self.ws_manager.broadcast_threadsafe(event["login"], event["payload"])
+                elif kind == "health":
+                    self.health[event["shard"]] = event
+                    # Shard histograms live in the shard process; export their summaries here
+                    shard = str(event["shard"])
+                    registry.set_gauge("risk_shard_sweep_p50_ms", event.get("sweep_p50_ms", 0), shard=shard)
+                    registry.set_gauge("risk_shard_sweep_p99_ms", event.get("sweep_p99_ms", 0), shard=shard)
+                    registry.set_gauge("accounts_monitored", sum(h.get("accounts", 0) for h in self.health.values()))
+                    registry.set_gauge("pump_updates_total", sum(h.get("pump_updates_count", 0) for h in self.health.values()))
+            except queue.Empty:
+                pass
+            except Exception as e:
+                print(f"⚠️ [RiskEngine] Coordinator error: {e}")
+
+            if time.time() - last_liveness > 1:
+                last_liveness = time.time()
+                self._check_liveness()
+
+    def _publish_listeners(self):
+        """Mirrors the ConnectionManager rooms into the shards' shared listener state"""
+        try:
+            if self.ws_manager is None:
+                self.listeners.publish(False, frozenset())
+            elif hasattr(self.ws_manager, "listened_logins"):
+                self.listeners.publish(*self.ws_manager.listened_logins())
+            else:
+                self.listeners.publish(True, frozenset()) # Can't tell: let every update through
+        except Exception as e:
+            print(f"⚠️ [RiskEngine] Listener state update failed: {e}")
+
+    def _check_liveness(self):
+        for shard, p in list(self.processes.items()):
+            if p.is_alive() or not self.running: continue
+            if time.time() - self.started_at.get(shard, 0) < RESTART_BACKOFF: continue
+            print(f"⚠️ [RiskEngine] Shard {shard} died (exit {p.exitcode}), respawning")
+            self._spawn(shard)
+
+    def get_health(self):
+        """Merged view for health endpoints"""
+        now = time.time()
+        shards = []
+        for shard in range(self.shard_count):
+            h = self.health.get(shard, {})
+            p = self.processes.get(shard)
+            shards.append({
+                "shard": shard,
+                "alive": bool(p and p.is_alive()),
+                "accounts": h.get("accounts", 0),
+                "mt5_connected": h.get("mt5_connected", False),
+                "pump_updates_count": h.get("pump_updates_count", 0),
+                "last_report_age": round(now - h["timestamp"], 1) if h else None
+            })
+        return {
+            "shards": shards,
+            "accounts_monitored": sum(s["accounts"] for s in shards),
+            "timestamp": datetime.now().isoformat()
+        }
@@ -5,16 +5,11 @@ import traceback
 import random
 import string
 from datetime import datetime, timedelta
-from mt5_service import worker, force_close_positions, force_close_orders, disable_account, is_failed, mark_failed, last_synced_tickets
+from trade_normalizer import normalize_trades
+from mt5_service import worker, user_cache, force_close_positions, force_close_orders, disable_account, is_failed, mark_failed, clear_failed, last_synced_tickets
 
 router = APIRouter()
 
-# --- HELPER: Safely get value ---
-def get_val(obj, *names, default=None):
-    for name in names:
-        if hasattr(obj, name): return getattr(obj, name)
-    return default
-
 # --- MODELS ---
 class AccountRequest(BaseModel):
     name: str
@@ -137,111 +132,19 @@ def fetch_trades(data: FetchRequest):
 
     try:
         login = data.login
-        results = []
-        current_tickets = set()
         
         # 1. Fetch Deals (History)
         from_time = int((datetime.now() - timedelta(days=30)).timestamp()) # Custom fetch range
         to_time = int(datetime.now().timestamp())
         deals = worker.get_deals(login, from_time, to_time) if hasattr(worker, 'get_deals') else []
         
-        # Group deals by PositionID to match IN (open) and OUT (close) deals
-        position_deals = {}
-        for d in deals:
-            try:
-                position_id = get_val(d, "PositionID", default=0)
-                if position_id == 0:
-                    continue
-                
-                if position_id not in position_deals:
-                    position_deals[position_id] = {"in": None, "out": None}
-                
-                entry = get_val(d, "Entry", default=0)
-                if entry == 0:  # IN deal (opening)
-                    position_deals[position_id]["in"] = d
-                elif entry == 1:  # OUT deal (closing)
-                    position_deals[position_id]["out"] = d
-            except Exception as e:
-                # print(f"⚠️ Error grouping deal: {e}")
-                pass
-        
-        # Now process matched closed positions
-        for position_id, deals_pair in position_deals.items():
-            try:
-                in_deal = deals_pair["in"]
-                out_deal = deals_pair["out"]
-                
-                # Only process if we have the closing deal (OUT)
-                if not out_deal:
-                    continue
-                
-                ticket = get_val(out_deal, "Deal", "Ticket", default=0)
-                if ticket == 0:
-                    continue
-                
-                # Get open time from IN deal, or use OUT deal time if IN doesn't exist
-                open_time = int(get_val(in_deal, "Time", default=0)) if in_deal else int(get_val(out_deal, "Time", default=0))
-                close_time = int(get_val(out_deal, "Time", default=open_time))
-                
-                # Calculate duration in seconds
-                duration = close_time - open_time if close_time > open_time else 0
-                
-                t = {
-                    "login": login,
-                    "ticket": position_id, # Use PositionID as ticket to match Open Position (upsert logic)
-                    "symbol": get_val(out_deal, "Symbol", default=""),
-                    "type": int(get_val(out_deal, "Action", "Type", default=0)),
-                    "entry": int(get_val(out_deal, "Entry", default=1)),
-                    "volume": float(get_val(out_deal, "Volume", default=0)),
-                    "price": float(get_val(in_deal, "Price", default=0.0)) if in_deal else float(get_val(out_deal, "Price", default=0.0)),
-                    "close_price": float(get_val(out_deal, "Price", default=0.0)),
-                    "profit": float(get_val(out_deal, "Profit", default=0.0)),
-                    "commission": float(get_val(out_deal, "Commission", default=0.0)),
-                    "swap": float(get_val(out_deal, "Storage", default=0.0)),
-                    "time": open_time,
-                    "close_time": close_time,
-                    "duration": duration,
-                    "is_closed": True
-                }
-                results.append(t)
-                current_tickets.add(position_id)
-            except Exception as e:
-                print(f"⚠️ Error processing matched position {position_id}: {e}")
-                pass
-        
         # 2. Fetch Open Positions
         positions = worker.get_positions(login) if hasattr(worker, 'get_positions') else []
-        for d in positions:
-            try:
-                ticket = get_val(d, "Position", "Ticket", "Deal", default=0)
-                
-                if ticket == 0:
-                    continue
-                    
-                open_time = int(get_val(d, "TimeCreate", "Time", default=0))
-                
-                t = {
-                    "login": login,
-                    "ticket": ticket,
-                    "symbol": get_val(d, "Symbol", default=""),
-                    "type": int(get_val(d, "Action", "Type", "Cmd", default=0)), 
-                    "entry": int(get_val(d, "Entry", default=0)),
-                    "volume": float(get_val(d, "Volume", default=0)),
-                    "price": float(get_val(d, "PriceOpen", "Price", default=0.0)),
-                    "close_price": float(get_val(d, "PriceCurrent", "Price", default=0.0)), 
-                    "profit": float(get_val(d, "Profit", default=0.0)),
-                    "commission": float(get_val(d, "Commission", default=0.0)),
-                    "swap": float(get_val(d, "Storage", "Swap", default=0.0)),
-                    "time": open_time,
-                    "close_time": None,
-                    "duration": None,
-                    "is_closed": False
-                }
-                results.append(t)
-                current_tickets.add(ticket)
-            except Exception as e:
-                print(f"⚠️ Error processing open position: {e}")
-                pass
+
+        # Closed trades use PositionID as ticket to match Open Position (upsert logic)
+        batch = normalize_trades(login, deals, positions, closed_ticket="position")
+        results = batch.trades
+        current_tickets = batch.tickets
         
         # Polling optimization: only return NEW trades if incremental mode
         if data.incremental and login in last_synced_tickets:
@@ -270,13 +173,20 @@ def fetch_trades_full(data: FetchRequest):
     # Actually, logic belongs in Service.
     return {"trades": []}
 
+@router.delete("/failed-accounts/{login}")
+def clear_failed_account(login: int):
+    """Re-arms monitoring for a reset / reinstated account (also cleared automatically once its challenge is active again)"""
+    if not clear_failed(login):
+        raise HTTPException(status_code=404, detail="Account is not marked as failed")
+    return {"status": "success", "message": f"Account {login} removed from the failed registry"}
+
 @router.post("/disable-account")
 def disable_account_endpoint(req: SingleAccountRequest):
     if not worker.connected:
         worker.connect()
     
     try:
-        user = worker.manager.UserRequest(req.login)
+        user = user_cache.request(worker.manager, req.login)
         if not user:
              raise HTTPException(status_code=404, detail="Account not found")
         
@@ -303,7 +213,7 @@ def stop_out_account_endpoint(req: SingleAccountRequest):
     closed_orders = 0
     
     # 3. Disable User
-    user = worker.manager.UserRequest(req.login)
+    user = user_cache.request(worker.manager, req.login)
     disabled = False
     if user:
          disabled = disable_account(user)
@@ -371,7 +281,7 @@ def check_bulk(requests: List[StopOutRequest]):
 
                 if req.disable_account:
                     if not user:
-                        user = worker.manager.UserRequest(req.login)
+                        user = user_cache.request(worker.manager, req.login)
                     
                     if user:
                          if disable_account(user):
@@ -380,7 +290,9 @@ def check_bulk(requests: List[StopOutRequest]):
                     else:
                          print(f"❌ Could not fetch user {req.login} for disabling")
 
-                mark_failed(req.login)
+                # Persisted only once the stop-out took effect; otherwise the next check retries it
+                if "account_disabled" in actions or not req.disable_account:
+                    mark_failed(req.login)
 
                 results.append({
                     "login": req.login,
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import threading
+
+RULES_FILE = os.path.join(os.path.dirname(__file__), "risk_rules.json")
+# risk_rules.json mtime is checked every RULES_WATCH_INTERVAL, account_groups polled every RULES_DB_INTERVAL
+RULES_WATCH_INTERVAL = float(os.environ.get("RULES_WATCH_INTERVAL", "10"))
+RULES_DB_INTERVAL = float(os.environ.get("RULES_DB_INTERVAL", "60"))
+
+DEFAULT_LIMITS = (10.0, 5.0, 0.0) # (max_dd %, daily_dd %, profit_target %)
+
+# Challenge type classes (the only distinctions the rules make)
+TYPE_PHASE1 = 0
+TYPE_PHASE2 = 1
+TYPE_FUNDED = 2
+
+UNKNOWN_GROUP = 0
+
+_type_ids = {}
+
+def type_id(ctype):
+    """Challenge type string -> type class (memoized, so each distinct string is parsed once)"""
+    tid = _type_ids.get(ctype)
+    if tid is None:
+        lowered = (ctype or '').lower()
+        if 'funded' in lowered:
+            tid = TYPE_FUNDED
+        elif 'phase_2' in lowered or 'phase 2' in lowered:
+            tid = TYPE_PHASE2
+        else:
+            tid = TYPE_PHASE1
+        _type_ids[ctype] = tid
+    return tid
+
+def compile_rule(rule):
+    """One group's rule -> limits per type class"""
+    if not rule:
+        return (DEFAULT_LIMITS,) * 3
+
+    max_dd = rule.get("max_drawdown_percent", 10.0)
+    daily_dd = rule.get("daily_drawdown_percent", 5.0)
+    target = rule.get("profit_target_percent", 0.0)
+    phase1 = phase2 = target
+    if target <= 0.0:
+        phase1 = rule.get("profit_target_phase1_percent", 0.0)
+        phase2 = rule.get("profit_target_phase2_percent", 0.0)
+    # Rule Override for Funded Accounts
+    return ((max_dd, daily_dd, phase1), (max_dd, daily_dd, phase2), DEFAULT_LIMITS)
+
+class RuleTable:
+    """
+    Per-group risk rules compiled into integer-indexed limits.
+
+    Group names are interned to small integer IDs (stable for the life of the process) and challenge
+    types to TYPE_* classes, so evaluation is limits(group_id, type_id): two list indexes, no string work.
+    Sources: risk_rules.json, plus enabled account_groups rows (max_drawdown_percent, editable from the
+    admin panel) for groups the file has no rule for - the file always wins, so seeded defaults can't
+    loosen a configured limit. A watcher thread recompiles when either changes and bumps `version`;
+    readers compare versions and rebuild whatever they derived from the old table.
+    """
+    def __init__(self, supabase_client=None, rules_file=RULES_FILE):
+        self.supabase = supabase_client
+        self.rules_file = rules_file
+        self.lock = threading.Lock()
+        self.group_ids = {} # group name -> id (UNKNOWN_GROUP = no group / no rule yet)
+        self.file_rules = {}
+        self.db_rules = {} # group name -> max_drawdown_percent from account_groups (groups missing from the file)
+        self.rules = {} # Merged source rules
+        self.table = [(DEFAULT_LIMITS,) * 3] # id -> limits per type class
+        self.version = 0
+        self.file_mtime = None
+        self.last_db_poll = 0
+        self.running = False
+
+    # --- Hot path ---
+    def limits(self, gid, tid):
+        return self.table[gid][tid]
+
+    def group_id(self, group):
+        """Interns a group name (unknown groups get an id too, so rules added later apply to them)"""
+        if group is None: return UNKNOWN_GROUP
+        gid = self.group_ids.get(group)
+        if gid is not None: return gid
+        with self.lock:
+            gid = self.group_ids.get(group)
+            if gid is None:
+                gid = len(self.table)
+                self.table = self.table + [compile_rule(self.rules.get(group))] # Row before id, as in _compile
+                self.group_ids[group] = gid
+        return gid
+
+    def resolve(self, group, ctype):
+        """Returns (max_dd_percent, daily_dd_percent, profit_target_percent) for a group + challenge type"""
+        return self.limits(self.group_id(group), type_id(ctype))
+
+    def groups(self):
+        """Groups configured in risk_rules.json (the monitored set for snapshots)"""
+        return list(self.file_rules.keys())
+
+    # --- Loading ---
+    def load(self):
+        self._load_file()
+        self._load_db()
+        self._compile()
+
+    def _load_file(self):
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+            with open(self.rules_file, 'r') as f:
+                self.file_rules = json.load(f)
+            self.file_mtime = mtime
+            print(f"✅ [RiskEngine] Loaded rules for {len(self.file_rules)} groups.")
+            return True
+        except Exception as e:
+            print(f"❌ [RiskEngine] Failed to load rules: {e}") # Keeps the previous rules
+            return False
+
+    def _load_db(self):
+        """account_groups limits. Returns True if they changed."""
+        self.last_db_poll = time.time()
+        if not self.supabase: return False
+        try:
+            response = self.supabase.table('account_groups').select('group_name, max_drawdown_percent, enabled').execute()
+            rules = {row['group_name']: float(row['max_drawdown_percent'])
+                     for row in response.data or []
+                     if row.get('enabled', True) and row.get('group_name') and row.get('max_drawdown_percent') is not None}
+        except Exception as e:
+            print(f"⚠️ [RiskEngine] account_groups load failed: {e}")
+            return False
+        if rules == self.db_rules: return False
+        self.db_rules = rules
+        return True
+
+    def _compile(self):
+        rules = {group: dict(rule) for group, rule in self.file_rules.items()}
+        for group, max_dd in self.db_rules.items():
+            if group in rules:
+                file_dd = rules[group].get("max_drawdown_percent", DEFAULT_LIMITS[0])
+                if file_dd != max_dd:
+                    print(f"⚠️ [RiskEngine] account_groups {group}: max_drawdown {max_dd}% ignored, risk_rules.json has {file_dd}%")
+                continue
+            print(f"ℹ️ [RiskEngine] {group}: max_drawdown {max_dd}% from account_groups (not in risk_rules.json)")
+            rules[group] = {"max_drawdown_percent": max_dd}
+
+        with self.lock:
+            group_ids = dict(self.group_ids)
+            for group in rules:
+                if group not in group_ids:
+                    group_ids[group] = len(group_ids) + 1
+            table = [(DEFAULT_LIMITS,) * 3] * (len(group_ids) + 1)
+            for group, gid in group_ids.items():
+                table[gid] = compile_rule(rules.get(group))
+            changed = table != self.table
+            self.rules = rules
+            # Table first: a reader holding any published id always finds its row (lock-free group_id path)
+            self.table = table # Swapped whole: readers see the old or the new table, never a mix
+            self.group_ids = group_ids
+            if changed:
+                self.version += 1
+        return changed
+
+    # --- Watcher ---
+    def start_watcher(self, interval=RULES_WATCH_INTERVAL, db_interval=RULES_DB_INTERVAL):
+        if self.running: return
+        self.running = True
+
+        def loop():
+            while self.running:
+                time.sleep(interval)
+                try:
+                    self.check(db_interval)
+                except Exception as e:
+                    print(f"⚠️ [RiskEngine] Rule watcher error: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def check(self, db_interval=RULES_DB_INTERVAL):
+        """Recompiles if risk_rules.json or account_groups changed. Returns True if any limit changed."""
+        dirty = False
+        try:
+            if os.path.getmtime(self.rules_file) != self.file_mtime:
+                dirty = self._load_file()
+        except OSError:
+            pass
+        if time.time() - self.last_db_poll >= db_interval:
+            dirty = self._load_db() or dirty
+        if dirty and self._compile():
+            print(f"🔄 [RiskEngine] Risk rules reloaded (v{self.version})")
+            return True
+        return False
@@ -164,3 +164,16 @@ SELECT
 FROM account_config
 WHERE is_active = true
 GROUP BY group_name;
+
+-- Risk shard partition: the challenges rows one RiskEngine shard owns (login % shard_count = shard_index).
+-- p_since NULL = all active rows (full reconcile), otherwise every row updated since (delta refresh).
+CREATE OR REPLACE FUNCTION risk_shard_challenges(p_shard_index INTEGER, p_shard_count INTEGER, p_since TIMESTAMPTZ DEFAULT NULL)
+RETURNS SETOF challenges
+LANGUAGE sql STABLE
+AS $$
+    SELECT *
+    FROM challenges
+    WHERE login IS NOT NULL
+      AND login % p_shard_count = p_shard_index
+      AND (CASE WHEN p_since IS NULL THEN status = 'active' ELSE updated_at >= p_since END);
+$$;
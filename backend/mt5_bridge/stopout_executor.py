@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+import traceback
+
+from metrics import registry, record_stopout
+from mt5_executor import PRIORITY_STOPOUT
+
+# Stop-out jobs queued on the MT5 executor at once. They run min(STOPOUT_CONCURRENCY, MT5_EXECUTOR_THREADS)
+# at a time (each on its own MT5_POOL_SIZE session); the rest wait at the head of the executor queue,
+# so a freed executor thread picks up the next stop-out before any lower-priority job.
+STOPOUT_CONCURRENCY = int(os.environ.get("STOPOUT_CONCURRENCY", "16"))
+
+class StopOutExecutor:
+    """
+    Runs the stop-out actions for a batch of already-evaluated breaches.
+
+    1. Breaches are ordered deepest first (largest shortfall vs. the limit, relative to the limit).
+    2. Disable pass: every breached account is disabled before any positions are closed, so no
+       account can keep opening trades while the others are being flattened.
+    3. Close pass: positions + pending orders, one MT5 job per account.
+    Both passes run on the MT5 executor at PRIORITY_STOPOUT with at most `concurrency` accounts
+    queued; real parallelism is `parallelism` (bounded by the executor's threads). Each account's
+    latency (detection -> its own actions done) is recorded for stopout_history.
+
+    disable_fn(breach) -> bool, close_fn(breach) -> (positions_closed, orders_closed); both blocking.
+    breach["success"] tells the caller whether the stop-out took effect (or needs another attempt).
+    """
+    def __init__(self, executor, disable_fn, close_fn, concurrency=STOPOUT_CONCURRENCY):
+        self.executor = executor
+        self.disable_fn = disable_fn
+        self.close_fn = close_fn
+        self.concurrency = max(1, concurrency)
+        self.parallelism = min(self.concurrency, getattr(executor, "threads", self.concurrency))
+        print(f"🛡️ Stop-out executor: {self.parallelism} accounts in parallel ({self.concurrency} queued max)")
+
+    @staticmethod
+    def severity(breach):
+        limit = breach["limit"]
+        return (limit - breach["equity"]) / limit if limit > 0 else 0.0
+
+    async def execute(self, breaches, on_done=None):
+        """
+        breach: {login, equity, balance, limit, detected_at, disable, close, ...}. Fills in the outcome fields.
+        on_done(breach) is called as soon as each account is finished (e.g. to queue its webhook).
+        """
+        if not breaches: return breaches
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        ordered = sorted(breaches, key=self.severity, reverse=True)
+        for b in ordered:
+            b.setdefault("disabled", False)
+            b.setdefault("positions_closed", 0)
+            b.setdefault("orders_closed", 0)
+
+        async def run(fn, b):
+            async with semaphore:
+                try:
+                    return await self.executor.run(PRIORITY_STOPOUT, fn, b)
+                except Exception as e:
+                    print(f"❌ Stop-out action failed for {b['login']}: {e}")
+                    traceback.print_exc()
+                    return None
+
+        async def disable(b):
+            b["disabled"] = bool(await run(self.disable_fn, b))
+
+        async def close(b):
+            if b["close"]:
+                counts = await run(self.close_fn, b)
+                if counts:
+                    b["positions_closed"], b["orders_closed"] = counts
+                else:
+                    b["positions_left_open"] = None # Close job failed: unknown, so not done
+            self._finish(b)
+            if on_done:
+                try:
+                    on_done(b)
+                except Exception as e:
+                    print(f"⚠️ Stop-out completion hook failed for {b['login']}: {e}")
+
+        await asyncio.gather(*(disable(b) for b in ordered if b["disable"]))
+        await asyncio.gather(*(close(b) for b in ordered))
+
+        registry.observe("stopout_batch_duration_ms", (time.perf_counter() - started) * 1000.0)
+        print(f"✅ Stop-out batch: {len(ordered)} accounts in {time.perf_counter() - started:.2f}s ({self.parallelism} in parallel)")
+        return breaches
+
+    def _finish(self, b):
+        b["latency_ms"] = (time.time() - b["detected_at"]) * 1000.0
+        # Done = disabled (if asked) and nothing known to be left open (close_fn may set positions_left_open)
+        b["success"] = (b["disabled"] or not b["disable"]) and not (b["close"] and b.get("positions_left_open", 0) != 0)
+        record_stopout(b["login"], b["equity"], b["latency_ms"],
+                       success=b["success"],
+                       positions_closed=b["positions_closed"], account_disabled=b["disabled"])
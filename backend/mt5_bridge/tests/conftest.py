@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Bridge modules import each other by plain name (run from backend/mt5_bridge)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# SQLite stores opened with their default paths (poller watermarks, failed registry) stay out of the repo
+_db_dir = tempfile.mkdtemp(prefix="mt5_bridge_tests_")
+os.environ.setdefault("DEAL_CURSOR_DB", os.path.join(_db_dir, "deal_cursors.db"))
+os.environ.setdefault("FAILED_ACCOUNTS_DB", os.path.join(_db_dir, "failed_accounts.db"))
@@ -0,0 +1,43 @@
+import time
+import asyncio
+import threading
+
+import main
+
+def collect(data):
+    async def run():
+        return [item async for item in main.iter_bulk_trades(data)]
+    return asyncio.run(run())
+
+def fake_fetch(durations, active, peak, commits):
+    lock = threading.Lock()
+    def fetch(login, incremental, to_time):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(durations.get(login, 0.02))
+        with lock:
+            active[0] -= 1
+        return [{"login": login, "ticket": login}], lambda: commits.append(login)
+    return fetch
+
+def test_in_flight_logins_capped_by_executor_threads(monkeypatch):
+    active, peak, commits = [0], [0], []
+    monkeypatch.setattr(main, "fetch_login_trades", fake_fetch({}, active, peak, commits))
+    results = collect(main.FetchBulkRequest(logins=list(range(1, 11)), workers=8))
+    assert [r[0] for r in results] == list(range(1, 11))
+    assert all(r[2] is None for r in results)
+    assert peak[0] <= main.mt5_executor.threads
+
+def test_timed_out_fetch_is_tracked_until_its_thread_is_free(monkeypatch):
+    active, peak, commits = [0], [0], []
+    monkeypatch.setattr(main, "fetch_login_trades", fake_fetch({1: 0.5}, active, peak, commits))
+    results = collect(main.FetchBulkRequest(logins=[1, 2], timeout=0.1))
+    assert results[0][2] == "timeout after 0.1s" and results[0][3] is None
+    assert results[1][2] is None
+    assert len(main.bulk_overruns) == 1
+    deadline = time.time() + 2
+    while main.bulk_overruns and time.time() < deadline:
+        time.sleep(0.05)
+    assert not main.bulk_overruns
+    assert commits == [] # Only the consumer commits, and never a timed-out login
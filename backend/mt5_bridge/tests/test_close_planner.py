@@ -0,0 +1,110 @@
+import time
+import types
+
+import close_planner
+from close_planner import ClosePlanner
+
+class Position:
+    def __init__(self, ticket, symbol, type_):
+        self.Position = ticket
+        self.Symbol = symbol
+        self.Type = type_
+        self.Volume = 100
+
+class Request:
+    class EnTradeActions:
+        TA_STOPOUT_POSITION = 1
+    class EnOrderType:
+        OP_BUY = 0
+        OP_SELL = 1
+    class EnOrderFilling:
+        ORDER_FILLING_FOK = 0
+
+class Confirm:
+    ResultRetcode = None
+
+def api(**extra):
+    return types.SimpleNamespace(MTRequest=Request, MTConfirm=Confirm, **extra)
+
+class FakeManager:
+    def __init__(self, positions, retcode=10009, delay=0.0):
+        self.positions = positions
+        self.retcode = retcode
+        self.delay = delay
+        self.price_lookups = []
+        self.sent = []
+        self.deleted = []
+
+    def PositionRequest(self, login):
+        return self.positions
+
+    def SymbolInfoGet(self, symbol):
+        self.price_lookups.append(symbol)
+        return types.SimpleNamespace(Bid=1.0, Ask=1.1)
+
+    def DealerSend(self, req, res):
+        self.sent.append((req.Position, req.Price))
+        time.sleep(self.delay)
+        res.ResultRetcode = self.retcode(req) if callable(self.retcode) else self.retcode
+        return True
+
+    def PositionDeleteByTicket(self, ticket):
+        self.deleted.append(ticket)
+
+def positions(n):
+    return [Position(i + 1, ("EURUSD", "XAUUSD")[i % 2], i % 2) for i in range(n)]
+
+def test_one_price_per_symbol_and_side_prices(tmp_path):
+    manager = FakeManager(positions(10))
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"))
+    assert planner.close_all(1) == 10
+    assert sorted(manager.price_lookups) == ["EURUSD", "XAUUSD"]
+    prices = dict(manager.sent)
+    assert prices[1] == 1.0 and prices[2] == 1.1 # Buy closes at Bid, Sell at Ask
+    assert planner.left_open == 0 and manager.deleted == []
+
+def test_rejected_closes_fall_back_to_delete(tmp_path):
+    manager = FakeManager(positions(4), retcode=lambda req: 10006 if req.Position == 3 else 0)
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"))
+    assert planner.close_all(1) == 4
+    assert manager.deleted == [3]
+
+def test_missing_retcode_enum_uses_defaults(tmp_path):
+    manager = FakeManager(positions(3), retcode=10009)
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"))
+    assert not hasattr(planner.api, "EnMTAPIRetcode")
+    assert planner.close_all(1) == 3
+    assert manager.deleted == []
+
+def test_retcodes_from_the_binding(tmp_path):
+    codes = types.SimpleNamespace(MT_RET_OK=7, MT_RET_REQUEST_DONE=8)
+    manager = FakeManager(positions(2), retcode=7)
+    planner = ClosePlanner(manager, api(EnMTAPIRetcode=codes), engine_path=str(tmp_path / "missing.exe"))
+    assert planner.close_all(1) == 2 and manager.deleted == []
+
+def test_timeout_cancels_unsent_and_joins_in_flight_sends(tmp_path, monkeypatch):
+    monkeypatch.setattr(close_planner, "CLOSE_SEND_THREADS", 2)
+    manager = FakeManager(positions(6), delay=0.3)
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"), timeout=0.1)
+    closed = planner.close_all(1)
+    # The 2 sends in flight finished before close_all returned; the 4 never sent are deleted
+    sent = {ticket for ticket, _ in manager.sent}
+    assert len(sent) == 2
+    assert sorted(manager.deleted) == sorted(set(range(1, 7)) - sent)
+    assert closed == 6 and planner.left_open == 0
+    time.sleep(0.4)
+    assert len(manager.sent) == 2 # Nothing runs on the session after the lease is released
+
+def test_late_rejection_falls_back_to_delete(tmp_path, monkeypatch):
+    monkeypatch.setattr(close_planner, "CLOSE_SEND_THREADS", 1)
+    manager = FakeManager(positions(2), retcode=10006, delay=0.2)
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"), timeout=0.05)
+    assert planner.close_all(1) == 2
+    assert sorted(manager.deleted) == [1, 2] # 1 rejected after the timeout, 2 never sent
+
+def test_submit_error_falls_back_to_delete(tmp_path):
+    manager = FakeManager(positions(2))
+    planner = ClosePlanner(manager, api(), engine_path=str(tmp_path / "missing.exe"))
+    planner.submit = lambda login, plan: (_ for _ in ()).throw(RuntimeError("binding error"))
+    assert planner.close_all(1) == 2
+    assert sorted(manager.deleted) == [1, 2]
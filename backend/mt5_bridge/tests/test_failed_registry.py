@@ -0,0 +1,38 @@
+from failed_registry import FailedAccountRegistry
+
+def test_mark_once_and_persist(tmp_path):
+    path = str(tmp_path / "failed.db")
+    registry = FailedAccountRegistry(path)
+    assert registry.mark(1001, "check_bulk")
+    assert not registry.mark(1001, "check_bulk")
+    assert 1001 in registry and registry.is_failed("1001")
+    assert registry.marked_at(1001) is not None
+
+    # A restart sees the mark before any refresh
+    assert 1001 in FailedAccountRegistry(path)
+
+def test_clear(tmp_path):
+    path = str(tmp_path / "failed.db")
+    registry = FailedAccountRegistry(path)
+    registry.mark(1001)
+    assert registry.clear(1001)
+    assert not registry.clear(1001)
+    assert 1001 not in FailedAccountRegistry(path)
+
+def test_refresh_picks_up_other_processes(tmp_path):
+    path = str(tmp_path / "failed.db")
+    shard = FailedAccountRegistry(path)
+    bridge = FailedAccountRegistry(path)
+    bridge.mark(2002)
+    assert 2002 not in shard
+    shard.refresh()
+    assert 2002 in shard
+    bridge.clear(2002)
+    shard.refresh()
+    assert 2002 not in shard
+
+def test_memory_only_when_db_unavailable(tmp_path):
+    registry = FailedAccountRegistry(str(tmp_path / "missing" / "failed.db"))
+    assert registry.db is None
+    assert registry.mark(3003)
+    assert 3003 in registry
@@ -0,0 +1,44 @@
+import random
+
+from metrics import LatencyHistogram, MetricsRegistry
+
+def test_percentiles_within_bucket_error():
+    hist = LatencyHistogram()
+    values = [random.uniform(0.1, 2000.0) for _ in range(20000)]
+    for v in values:
+        hist.record(v)
+    values.sort()
+    for q in (50, 90, 99):
+        exact = values[int(len(values) * q / 100.0) - 1]
+        assert abs(hist.percentile(q) - exact) / exact < 0.05, q
+    assert hist.count == len(values)
+    assert hist.percentile(100) == max(values)
+
+def test_empty_and_edge_values():
+    hist = LatencyHistogram()
+    assert hist.percentile(99) == 0.0
+    hist.record(-5) # Clamped to 0
+    hist.record(0.001) # Below resolution: first bucket
+    assert hist.min == 0.0 and hist.count == 2
+    assert hist.percentile(50) <= LatencyHistogram.UNIT_MS * 2
+
+def test_cumulative_buckets_are_monotonic():
+    hist = LatencyHistogram()
+    for v in (1, 5, 50, 500, 5000):
+        hist.record(v)
+    counts, total, _ = hist.cumulative((2, 10, 100, 1000, 10000))
+    assert counts == sorted(counts)
+    assert counts[-1] == total == 5
+
+def test_registry_labels_and_prometheus_output():
+    registry = MetricsRegistry()
+    registry.observe("mt5_call_latency_ms", 12.0, call="get_deals")
+    registry.observe("mt5_call_latency_ms", 3.0, call="get_positions")
+    registry.inc("webhook_sent_total", 2)
+    registry.set_gauge("accounts_monitored", 42)
+    assert registry.histogram("mt5_call_latency_ms", call="get_deals").count == 1
+    assert registry.counter_value("webhook_sent_total") == 2
+    assert registry.gauge_value("accounts_monitored") == 42
+    text = registry.render_prometheus()
+    assert 'mt5_call_latency_ms_count{call="get_deals"} 1' in text
+    assert "accounts_monitored 42" in text
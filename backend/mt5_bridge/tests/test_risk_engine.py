@@ -0,0 +1,128 @@
+import types
+
+from risk_engine import RiskEngine
+
+class FakeWorker:
+    def __init__(self):
+        self.accounts = {} # login -> (equity, balance)
+
+    def get_users_snapshot(self, logins, groups=None):
+        snap = {"login": [], "group": [], "equity": [], "balance": [], "floating": []}
+        for login in logins:
+            if login not in self.accounts: continue
+            equity, balance = self.accounts[login]
+            snap["login"].append(login)
+            snap["group"].append("demo\\unlisted") # Default limits: 10% max, 5% daily
+            snap["equity"].append(equity)
+            snap["balance"].append(balance)
+            snap["floating"].append(equity - balance)
+        return snap
+
+    def get_login_group(self, login):
+        return "demo\\unlisted"
+
+def row(login, sod, updated_at="2026-01-01T00:00:01"):
+    return {"login": login, "initial_balance": 100000.0, "challenge_type": "phase_1", "status": "active",
+            "start_of_day_equity": sod, "current_equity": None, "updated_at": updated_at}
+
+def make(vectorized=True):
+    worker = FakeWorker()
+    engine = RiskEngine(worker) # No Supabase: metadata is filled by hand
+    engine.vectorized = vectorized
+    engine.push_mode = True
+    engine.account_metadata = {1: RiskEngine._meta_from_row(row(1, 100000.0))}
+    engine.metadata_cursor = "2026-01-01T00:00:00"
+    if vectorized:
+        engine._build_vectors()
+    engine.breaches = []
+    engine.trigger_breach = lambda login, risk_type, *args: engine.breaches.append((login, risk_type))
+    return worker, engine
+
+def test_unchanged_equity_is_not_re_evaluated():
+    worker, engine = make()
+    evaluated = []
+    check = engine._check_snapshot
+    engine._check_snapshot = lambda snap: (evaluated.append(list(snap["login"])), check(snap))
+    worker.accounts[1] = (96000.0, 100000.0)
+    engine.mark_dirty(1)
+    engine.check_dirty_accounts(timeout=0)
+    engine.mark_dirty(1)
+    engine.check_dirty_accounts(timeout=0)
+    assert evaluated == [[1]]
+
+def test_balance_move_with_same_equity_is_evaluated():
+    worker, engine = make()
+    evaluated = []
+    engine._check_snapshot = lambda snap: evaluated.append(list(snap["login"]))
+    worker.accounts[1] = (96000.0, 100000.0)
+    engine.mark_dirty(1)
+    engine.check_dirty_accounts(timeout=0)
+    worker.accounts[1] = (96000.0, 95000.0)
+    engine.mark_dirty(1)
+    engine.check_dirty_accounts(timeout=0)
+    assert evaluated == [[1], [1]]
+
+def test_metadata_change_re_evaluates_without_a_pump_event():
+    for vectorized in (True, False):
+        worker, engine = make(vectorized)
+        worker.accounts[1] = (96000.0, 96000.0)
+        engine.mark_dirty(1)
+        engine.check_dirty_accounts(timeout=0)
+        assert engine.breaches == []
+
+        # SOD reset: daily limit moves to 102000 * 0.95 = 96900 with equity unchanged
+        engine._select_challenges = lambda since=None: types.SimpleNamespace(data=[row(1, 102000.0)])
+        engine._delta_metadata_refresh()
+        engine.check_dirty_accounts(timeout=0)
+        assert engine.breaches == [(1, "Daily Drawdown")]
+
+class FakeWS:
+    def __init__(self):
+        self.sent = []
+
+    def has_listeners(self, login):
+        return True
+
+    def broadcast_threadsafe(self, login, payload):
+        self.sent.append(payload)
+
+def test_account_update_carries_the_snapshot_floating_pl():
+    for vectorized in (True, False):
+        worker, engine = make(vectorized)
+        engine.ws_manager = FakeWS()
+        # 5000 credit: equity - balance would report 5000 of floating profit
+        engine._check_snapshot({"login": [1], "group": ["demo\\unlisted"], "equity": [105000.0],
+                                "balance": [100000.0], "floating": [0.0]})
+        assert [p["floating_pl"] for p in engine.ws_manager.sent] == [0.0]
+
+def make_failed(tmp_path):
+    from failed_registry import FailedAccountRegistry
+    worker, engine = make()
+    engine.failed_accounts = FailedAccountRegistry(str(tmp_path / "failed.db"))
+    engine.account_metadata = {}
+    engine._build_vectors()
+    engine.failed_accounts.mark(1, "check_bulk")
+    return engine
+
+def delta(engine, *rows):
+    engine._select_challenges = lambda since=None: types.SimpleNamespace(data=list(rows))
+    engine._delta_metadata_refresh()
+
+def test_failed_mark_survives_routine_row_updates(tmp_path):
+    engine = make_failed(tmp_path)
+    delta(engine, dict(row(1, 95000.0), created_at="2020-01-01T00:00:00+00:00"))
+    assert 1 in engine.failed_accounts
+
+def test_failed_mark_cleared_when_the_challenge_is_active_again(tmp_path):
+    engine = make_failed(tmp_path)
+    delta(engine, dict(row(1, 95000.0), status="failed", created_at="2020-01-01T00:00:00+00:00"))
+    assert 1 in engine.failed_accounts and 1 not in engine.account_metadata
+    delta(engine, dict(row(1, 100000.0), created_at="2020-01-01T00:00:00+00:00"))
+    assert 1 not in engine.failed_accounts
+    assert 1 in engine.account_metadata
+
+def test_failed_mark_cleared_by_a_new_challenge_row(tmp_path):
+    engine = make_failed(tmp_path)
+    delta(engine, dict(row(1, 100000.0), created_at="2099-01-01T00:00:00Z"))
+    assert 1 not in engine.failed_accounts
+    assert 1 in engine.account_metadata
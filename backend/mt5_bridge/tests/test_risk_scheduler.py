@@ -0,0 +1,46 @@
+from risk_scheduler import BreachScheduler
+
+def make():
+    return BreachScheduler(min_interval=0.5, max_interval=5.0, near_percent=1.0, safety_factor=0.25)
+
+def test_new_logins_are_due_immediately_and_removed_ones_dropped():
+    scheduler = make()
+    scheduler.sync([1, 2], now=100)
+    assert sorted(scheduler.pop_due(now=100)) == [1, 2]
+    scheduler.sync([2], now=100)
+    assert 1 not in scheduler.due
+    scheduler.observe(1, 1000, 1000, 900, now=100) # Ignored: no longer monitored
+    assert 1 not in scheduler.due
+
+def test_near_limit_is_checked_every_tick():
+    scheduler = make()
+    assert scheduler.interval_for(905, 1000, 900, 0, 0) == 0.5
+    # Near the profit target counts too
+    assert scheduler.interval_for(1095, 1000, 900, 1100, 0) == 0.5
+
+def test_flat_account_backs_off_to_max():
+    assert make().interval_for(1000, 1000, 900, 0, 0) == 5.0
+
+def test_interval_scales_with_distance_over_velocity():
+    scheduler = make()
+    # 100 away at 20/s -> 5s to breach -> checked after 25% of it
+    assert scheduler.interval_for(1000, 990, 900, 0, 20.0) == 1.25
+    # Floating exposure alone sets a minimum rate
+    assert scheduler.interval_for(1000, 1500, 900, 0, 0.0) == 1.0
+
+def test_observe_reschedules_and_defer_waits_max():
+    scheduler = make()
+    scheduler.sync([1, 2], now=100)
+    scheduler.pop_due(now=100)
+    scheduler.observe(1, 1000, 1000, 900, now=100) # Flat
+    scheduler.defer(2, now=100)
+    assert scheduler.pop_due(now=104.9) == []
+    assert sorted(scheduler.pop_due(now=105)) == [1, 2]
+
+def test_velocity_is_tracked_between_readings():
+    scheduler = make()
+    scheduler.sync([1], now=100)
+    scheduler.observe(1, 1000, 1000, 900, now=100)
+    scheduler.observe(1, 980, 1000, 900, now=101) # -20 in 1s
+    assert scheduler.motion[1][2] > 0
+    assert scheduler.due[1] - 101 < 5.0
@@ -0,0 +1,55 @@
+import queue
+import multiprocessing as mp
+
+from risk_shards import ListenerFlags, QueueWSProxy, ShardedRiskEngine
+
+def make_proxy(slots=8):
+    flags = ListenerFlags(mp.get_context("spawn"), slots=slots)
+    events = queue.Queue()
+    return flags, events, QueueWSProxy(events, flags)
+
+def test_nobody_connected_means_no_listeners():
+    flags, _, proxy = make_proxy()
+    flags.publish(False, frozenset())
+    assert not proxy.has_listeners(1)
+
+def test_only_subscribed_logins_and_updates_picked_up():
+    flags, _, proxy = make_proxy()
+    flags.publish(False, frozenset({1, 2}))
+    assert proxy.has_listeners(1) and not proxy.has_listeners(3)
+    flags.publish(False, frozenset({3}))
+    assert proxy.has_listeners(3) and not proxy.has_listeners(1)
+
+def test_master_stream_or_overflow_listens_to_everyone():
+    flags, _, proxy = make_proxy(slots=2)
+    flags.publish(True, frozenset())
+    assert proxy.has_listeners(12345)
+    flags.publish(False, frozenset({1, 2, 3}))
+    assert proxy.has_listeners(12345)
+
+def test_coordinator_mirrors_the_connection_manager():
+    class Rooms:
+        def __init__(self): self.state = (False, frozenset({5}))
+        def listened_logins(self): return self.state
+    rooms = Rooms()
+    coordinator = ShardedRiskEngine(1, ws_manager=rooms)
+    proxy = QueueWSProxy(queue.Queue(), coordinator.listeners)
+    coordinator._publish_listeners()
+    assert proxy.has_listeners(5) and not proxy.has_listeners(6)
+    rooms.state = (False, frozenset())
+    coordinator._publish_listeners()
+    assert not proxy.has_listeners(5)
+
+def _child_reads(flags, results):
+    proxy = QueueWSProxy(None, flags)
+    results.put((proxy.has_listeners(1), proxy.has_listeners(2)))
+
+def test_shard_process_sees_the_coordinators_state():
+    ctx = mp.get_context("spawn")
+    flags = ListenerFlags(ctx, slots=8)
+    flags.publish(False, frozenset({1}))
+    results = ctx.Queue()
+    p = ctx.Process(target=_child_reads, args=(flags, results))
+    p.start()
+    assert results.get(timeout=30) == (True, False)
+    p.join(timeout=10)
@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+from rule_table import RuleTable, RULES_FILE, type_id
+
+with open(RULES_FILE) as f:
+    FILE_RULES = json.load(f)
+
+CHALLENGE_TYPES = ["", "phase_1", "Phase 1", "phase_2", "Phase 2", "funded", "Instant Funded", "evaluation", None]
+
+def legacy_limits(group, ctype):
+    """RiskEngine.check_user's inline rule lookup before the compiled table"""
+    rule = FILE_RULES.get(group)
+    if not rule or 'funded' in (ctype or '').lower():
+        return 10.0, 5.0, 0.0
+    max_dd = rule.get("max_drawdown_percent", 10.0)
+    daily_dd = rule.get("daily_drawdown_percent", 5.0)
+    target = rule.get("profit_target_percent", 0.0)
+    if target <= 0.0:
+        lowered = (ctype or '').lower()
+        if 'phase_2' in lowered or 'phase 2' in lowered:
+            target = rule.get("profit_target_phase2_percent", 0.0)
+        else:
+            target = rule.get("profit_target_phase1_percent", 0.0)
+    return max_dd, daily_dd, target
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return self
+
+    def select(self, *columns):
+        return self
+
+    def execute(self):
+        class Response: pass
+        response = Response()
+        response.data = self.rows
+        return response
+
+@pytest.fixture
+def rules_file(tmp_path):
+    path = tmp_path / "risk_rules.json"
+    path.write_text(json.dumps(FILE_RULES))
+    return str(path)
+
+@pytest.mark.parametrize("group", list(FILE_RULES) + ["unknown\\group", None])
+def test_matches_legacy_lookup(rules_file, group):
+    table = RuleTable(rules_file=rules_file)
+    table.load()
+    for ctype in CHALLENGE_TYPES:
+        assert tuple(table.resolve(group, ctype)) == legacy_limits(group, ctype), ctype
+
+def test_file_wins_over_account_groups(rules_file):
+    group = next(iter(FILE_RULES))
+    db = FakeSupabase([
+        {"group_name": group, "max_drawdown_percent": 99, "enabled": True},
+        {"group_name": "demo\\seeded", "max_drawdown_percent": 8, "enabled": True},
+        {"group_name": "demo\\off", "max_drawdown_percent": 1, "enabled": False},
+    ])
+    table = RuleTable(db, rules_file=rules_file)
+    table.load()
+    assert tuple(table.resolve(group, "phase_1")) == legacy_limits(group, "phase_1")
+    assert table.resolve("demo\\seeded", "phase_1")[0] == 8
+    assert table.resolve("demo\\off", "phase_1")[0] == 10.0
+    assert sorted(table.groups()) == sorted(FILE_RULES)
+
+def test_reload_keeps_ids_and_bumps_version(rules_file):
+    table = RuleTable(rules_file=rules_file)
+    table.load()
+    group = next(iter(FILE_RULES))
+    gid = table.group_id(group)
+    late = table.group_id("late\\group") # Interned before it has a rule
+    version = table.version
+
+    rules = dict(FILE_RULES)
+    rules[group] = dict(rules[group], max_drawdown_percent=1.5)
+    rules["late\\group"] = {"max_drawdown_percent": 3.0}
+    with open(rules_file, "w") as f:
+        json.dump(rules, f)
+    os.utime(rules_file, (table.file_mtime + 10, table.file_mtime + 10))
+
+    assert table.check()
+    assert table.version == version + 1
+    assert table.group_id(group) == gid
+    assert table.limits(gid, type_id("phase_1"))[0] == 1.5
+    assert table.limits(late, type_id("phase_1"))[0] == 3.0
+    assert not table.check()
+
+def test_every_published_id_has_a_row(rules_file):
+    table = RuleTable(rules_file=rules_file)
+    table.load()
+    for i in range(50):
+        table.group_id(f"g{i}")
+    table._compile()
+    assert len(table.table) == len(table.group_ids) + 1
+    assert max(table.group_ids.values()) < len(table.table)
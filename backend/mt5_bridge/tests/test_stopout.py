@@ -0,0 +1,80 @@
+import time
+import asyncio
+
+import main
+from stopout_executor import StopOutExecutor
+
+class InlineExecutor:
+    """Runs jobs inline in submission order (one thread, so the recorded order is the execution order)"""
+    threads = 1
+
+    async def run(self, priority, fn, *args):
+        return fn(*args)
+
+def breach(login, equity, limit=90000.0, **extra):
+    b = {"login": login, "equity": equity, "balance": 100000.0, "limit": limit, "detected_at": time.time(),
+         "disable": True, "close": True}
+    b.update(extra)
+    return b
+
+def test_deepest_first_and_every_disable_before_any_close(monkeypatch):
+    monkeypatch.setattr("stopout_executor.record_stopout", lambda *a, **k: None)
+    calls = []
+    executor = StopOutExecutor(InlineExecutor(),
+                               disable_fn=lambda b: calls.append(("disable", b["login"])) or True,
+                               close_fn=lambda b: calls.append(("close", b["login"])) or (2, 1))
+    breaches = [breach(1, 89000.0), breach(2, 80000.0), breach(3, 85000.0)]
+    asyncio.run(executor.execute(breaches))
+    assert calls == [("disable", 2), ("disable", 3), ("disable", 1), ("close", 2), ("close", 3), ("close", 1)]
+    assert all(b["success"] and b["positions_closed"] == 2 for b in breaches)
+
+def test_incomplete_stopouts_are_not_successful(monkeypatch):
+    monkeypatch.setattr("stopout_executor.record_stopout", lambda *a, **k: None)
+    def close(b):
+        b["positions_left_open"] = 1 if b["login"] == 2 else 0
+        return 3, 0
+    executor = StopOutExecutor(InlineExecutor(), disable_fn=lambda b: b["login"] != 1, close_fn=close)
+    breaches = [breach(1, 80000.0), breach(2, 80000.0), breach(3, 80000.0)]
+    asyncio.run(executor.execute(breaches))
+    assert [b["success"] for b in breaches] == [False, False, True]
+
+class FakeDispatcher:
+    def __init__(self):
+        self.sent = []
+
+    def submit(self, url, payload, headers=None, **kwargs):
+        self.sent.append(payload)
+        return True
+
+def test_breach_webhook_only_after_a_complete_stopout(monkeypatch, tmp_path):
+    from failed_registry import FailedAccountRegistry
+    dispatcher = FakeDispatcher()
+    monkeypatch.setattr(main, "get_dispatcher", lambda supabase=None: dispatcher)
+    monkeypatch.setattr(main, "failed_accounts", FailedAccountRegistry(str(tmp_path / "failed.db")))
+    monkeypatch.setattr(main, "STOPOUT_RETRY_DELAY", 0.0)
+    attempts = []
+    async def execute(breaches, on_done=None):
+        for b in breaches:
+            attempts.append(b["login"])
+            b.update(disabled=True, positions_closed=1, success=True) # The retry completes
+            on_done(b)
+    monkeypatch.setattr(main.stopout_executor, "execute", execute)
+
+    async def run():
+        b = breach(7, 80000.0, result={"actions": []}, disabled=True, positions_closed=0, success=False)
+        main._on_stopout_done(b)
+        assert dispatcher.sent == [] and 7 not in main.failed_accounts
+        await asyncio.sleep(0.05) # Retry runs
+    asyncio.run(run())
+
+    assert attempts == [7]
+    assert [p["login"] for p in dispatcher.sent] == [7]
+    assert 7 in main.failed_accounts and 7 not in main.stopouts_in_flight
+
+def test_retries_give_up(monkeypatch):
+    monkeypatch.setattr(main, "STOPOUT_RETRIES", 1)
+    async def run():
+        b = breach(8, 80000.0)
+        assert main._schedule_stopout_retry(b)
+        assert not main._schedule_stopout_retry(b)
+    asyncio.run(run())
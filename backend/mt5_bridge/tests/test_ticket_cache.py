@@ -0,0 +1,32 @@
+from ticket_cache import TicketDedupCache
+
+def test_seen_records_then_hits():
+    cache = TicketDedupCache(max_entries=10, ttl=100)
+    assert not cache.seen(1, 1000)
+    assert cache.seen(1, 1000)
+    assert 1 in cache
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_expires_by_deal_time():
+    cache = TicketDedupCache(max_entries=10, ttl=100)
+    cache.seen(1, 1000)
+    cache.seen(2, 1050)
+    cache.seen(3, 1101) # 1000 is now more than ttl behind the newest deal
+    assert 1 not in cache
+    assert 2 in cache and 3 in cache
+    assert cache.stats()["expirations"] == 1
+
+def test_evicts_oldest_past_max_entries():
+    cache = TicketDedupCache(max_entries=3, ttl=10000)
+    for ticket in range(1, 6):
+        cache.seen(ticket, 1000 + ticket)
+    assert len(cache) == 3
+    assert [t for t in range(1, 6) if t in cache] == [3, 4, 5]
+    assert cache.stats()["evictions"] == 2
+
+def test_missing_deal_time_uses_newest():
+    cache = TicketDedupCache(max_entries=10, ttl=100)
+    cache.seen(1, 5000)
+    cache.seen(2) # No time: kept as long as the newest deal
+    cache.seen(3, 5050)
+    assert 2 in cache
@@ -0,0 +1,133 @@
+from collections import namedtuple
+
+from trade_normalizer import normalize_trades
+
+def get_val(obj, *names, default=None):
+    for name in names:
+        if hasattr(obj, name): return getattr(obj, name)
+    return default
+
+def legacy_fetch_trades(login, deals, positions):
+    """The inline mapping /fetch-trades used before trade_normalizer (reference output)"""
+    results = []
+    position_deals = {}
+    for d in deals:
+        position_id = get_val(d, "PositionID", default=0)
+        if position_id == 0: continue
+        pair = position_deals.setdefault(position_id, {"in": None, "out": None})
+        entry = get_val(d, "Entry", default=0)
+        if entry == 0: pair["in"] = d
+        elif entry == 1: pair["out"] = d
+
+    for position_id, pair in position_deals.items():
+        in_deal, out_deal = pair["in"], pair["out"]
+        if not out_deal: continue
+        ticket = get_val(out_deal, "Deal", "Ticket", default=0)
+        if ticket == 0: continue
+        open_time = int(get_val(in_deal, "Time", default=0)) if in_deal else int(get_val(out_deal, "Time", default=0))
+        close_time = int(get_val(out_deal, "Time", default=open_time))
+        results.append({
+            "login": login,
+            "ticket": ticket,
+            "symbol": get_val(out_deal, "Symbol", "symbol", default=""),
+            "type": int(get_val(out_deal, "Action", "Type", "type", default=0)),
+            "entry": int(get_val(out_deal, "Entry", "entry", default=1)),
+            "volume": float(get_val(out_deal, "Volume", "volume", default=0)),
+            "price": float(get_val(in_deal, "Price", "price", default=0.0)) if in_deal else float(get_val(out_deal, "Price", "price", default=0.0)),
+            "close_price": float(get_val(out_deal, "Price", "price", default=0.0)),
+            "profit": float(get_val(out_deal, "Profit", "profit", default=0.0)),
+            "commission": float(get_val(out_deal, "Commission", "commission", default=0.0)),
+            "swap": float(get_val(out_deal, "Storage", "Swap", "swap", default=0.0)),
+            "time": open_time,
+            "close_time": close_time,
+            "duration": close_time - open_time if close_time > open_time else 0,
+            "is_closed": True
+        })
+
+    for d in positions:
+        ticket = get_val(d, "Position", "Ticket", "Deal", default=0)
+        if ticket == 0: continue
+        results.append({
+            "login": login,
+            "ticket": ticket,
+            "symbol": get_val(d, "Symbol", "symbol", default=""),
+            "type": int(get_val(d, "Action", "Type", "Cmd", "type", default=0)),
+            "entry": int(get_val(d, "Entry", "entry", default=0)),
+            "volume": float(get_val(d, "Volume", "volume", default=0)),
+            "price": float(get_val(d, "PriceOpen", "Price", "price_open", "price", default=0.0)),
+            "close_price": float(get_val(d, "PriceCurrent", "Price", "price_current", "price", default=0.0)),
+            "profit": float(get_val(d, "Profit", "profit", default=0.0)),
+            "commission": float(get_val(d, "Commission", "commission", default=0.0)),
+            "swap": float(get_val(d, "Storage", "Swap", "swap", default=0.0)),
+            "time": int(get_val(d, "TimeCreate", "Time", default=0)),
+            "close_time": None,
+            "duration": None,
+            "is_closed": False
+        })
+    return results
+
+class Deal:
+    def __init__(self, deal, position_id, entry, time, price, profit=0.0, symbol="EURUSD", action=0, volume=10000):
+        self.Deal = deal
+        self.PositionID = position_id
+        self.Entry = entry
+        self.Time = time
+        self.Price = price
+        self.Profit = profit
+        self.Symbol = symbol
+        self.Action = action
+        self.Volume = volume
+        self.Commission = -1.5
+        self.Storage = 0.25
+
+class Position:
+    def __init__(self, position, time, symbol="XAUUSD"):
+        self.Position = position
+        self.TimeCreate = time
+        self.Symbol = symbol
+        self.Action = 1
+        self.Volume = 500
+        self.PriceOpen = 2000.5
+        self.PriceCurrent = 2001.0
+        self.Profit = 12.0
+        self.Commission = 0.0
+        self.Storage = -0.5
+
+def sample_deals():
+    return [
+        Deal(101, 1, 0, 1700000000, 1.1000),
+        Deal(102, 1, 1, 1700000600, 1.1050, profit=50.0),
+        Deal(103, 2, 1, 1700001000, 1.2000, profit=-20.0, symbol="GBPUSD", action=1), # OUT without IN
+        Deal(104, 3, 0, 1700002000, 1.3000), # Still open: no OUT
+        Deal(105, 0, 2, 1700003000, 0.0), # Balance operation
+    ]
+
+def test_matches_legacy_mapping():
+    deals = sample_deals()
+    positions = [Position(3, 1700002000), Position(4, 1700004000, symbol="US30")]
+    batch = normalize_trades(7, deals, positions)
+    assert batch.trades == legacy_fetch_trades(7, deals, positions)
+    assert batch.tickets == {102, 103, 3, 4}
+
+def test_incremental_marks():
+    batch = normalize_trades(7, sample_deals(), [Position(3, 1700002000), Position(4, 1699990000)])
+    assert batch.last_deal_time == 1700003000
+    assert batch.last_deal_ticket == 105
+    assert batch.min_open_time == 1699990000
+
+def test_position_ticket_and_lots():
+    batch = normalize_trades(7, sample_deals(), [], closed_ticket="position", include_lots=True)
+    closed = {t["ticket"]: t for t in batch.trades}
+    assert set(closed) == {1, 2}
+    assert closed[1]["lots"] == 1.0
+
+def test_client_api_namedtuples_and_dicts():
+    ClientDeal = namedtuple("ClientDeal", "ticket position_id entry time symbol type volume price profit commission swap")
+    deals = [
+        ClientDeal(11, 5, 0, 100, "EURUSD", 0, 0.1, 1.1, 0.0, 0.0, 0.0),
+        ClientDeal(12, 5, 1, 160, "EURUSD", 1, 0.1, 1.2, 10.0, -0.7, 0.0),
+    ]
+    batch = normalize_trades(9, deals, [{"ticket": 20, "time": 50, "symbol": "XAUUSD", "type": 0, "volume": 0.5, "price_open": 1.0, "price_current": 2.0}])
+    closed, opened = batch.trades
+    assert (closed["ticket"], closed["time"], closed["close_time"], closed["duration"], closed["price"]) == (12, 100, 160, 60, 1.1)
+    assert (opened["ticket"], opened["price"], opened["close_price"], opened["is_closed"]) == (20, 1.0, 2.0, False)
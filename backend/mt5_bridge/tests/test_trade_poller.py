@@ -0,0 +1,176 @@
+import time
+
+from deal_cursor import PollWatermarkStore
+from trade_poller import DynamicTradePoller
+from webhook_dispatcher import WebhookDispatcher
+from test_webhook_dispatcher import FakeSession, drain
+
+GROUP_KEY = "group:demo"
+
+class FakeWorker:
+    """Manager API worker with one monitored group"""
+    _use_client_api = False
+
+    def __init__(self):
+        self._manager = object()
+        self.deals = []
+        self.fail = False
+
+    def get_deals_by_group(self, group, from_ts, to_ts, strict=False):
+        if self.fail: return None
+        return [d for d in self.deals if from_ts <= d["time"] <= to_ts]
+
+    def get_group_logins(self, group):
+        return {d["login"] for d in self.deals}
+
+    def get_login_group(self, login):
+        return "demo"
+
+def deal(ticket, login, deal_time):
+    return {"ticket": ticket, "login": login, "Login": login, "entry": 1, "symbol": "EURUSD", "time": deal_time}
+
+def make(tmp_path, statuses=(), max_queue=100, bulk=False):
+    worker = FakeWorker()
+    poller = DynamicTradePoller(worker, interval=10)
+    poller.monitored_groups = ["demo"]
+    poller.callback_url = "http://crm/trades"
+    poller.bulk_callback_url = "http://crm/trades-bulk" if bulk else None
+    poller.last_reload = time.time() # No config reload (no Supabase here)
+    poller.watermarks = PollWatermarkStore(str(tmp_path / "marks.db"))
+    poller.dispatcher = WebhookDispatcher(workers=1, backoff_base=0.0, max_retries=0, max_queue=max_queue)
+    poller.dispatcher.session = FakeSession(statuses)
+    return worker, poller
+
+def posted_tickets(poller):
+    return [[t["ticket"] for t in body["trades"]] for _, body, _ in poller.dispatcher.session.posts if "trades" in body]
+
+def test_mark_waits_for_delivery(tmp_path):
+    worker, poller = make(tmp_path, [200])
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 3)]
+
+    poller._poll_step()
+    assert poller.watermarks.get(GROUP_KEY) is None # Queued, not delivered yet
+
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert poller.watermarks.get(GROUP_KEY) == now - 3
+    assert posted_tickets(poller) == [[1]]
+
+def test_failed_delivery_holds_the_mark(tmp_path):
+    worker, poller = make(tmp_path, [400])
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 3)]
+
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert poller.watermarks.get(GROUP_KEY) is None
+
+def test_dropped_submit_holds_the_mark(tmp_path):
+    worker, poller = make(tmp_path, max_queue=1)
+    poller.dispatcher.submit("http://crm/other", {"login": 1}) # Fills the queue
+    worker.deals = [deal(1, 100, int(time.time()) - 3)]
+
+    poller._poll_step()
+    assert poller.dispatcher.stats["dropped"] == 1
+    poller._process_results()
+    assert poller.watermarks.get(GROUP_KEY) is None
+
+def test_later_cycle_waits_for_an_earlier_delivery(tmp_path):
+    worker, poller = make(tmp_path, [500])
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 3)]
+    poller._poll_step() # Cycle 1: delivery outstanding
+    poller._poll_step() # Cycle 2: same window, ticket already handed off
+    assert poller.watermarks.get(GROUP_KEY) is None
+
+    drain(poller.dispatcher) # Cycle 1 fails
+    poller._process_results()
+    assert poller.watermarks.get(GROUP_KEY) is None # Cycle 2 started before the failure: held too
+
+def test_empty_cycles_advance(tmp_path):
+    worker, poller = make(tmp_path)
+    poller._poll_step()
+    assert poller.watermarks.get(GROUP_KEY) is not None
+
+def test_restart_resumes_from_the_delivered_mark(tmp_path):
+    worker, poller = make(tmp_path, [200])
+    now = int(time.time())
+    poller.watermarks.advance(GROUP_KEY, now - 400)
+    worker.deals = [deal(1, 100, now - 300)]
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert poller.watermarks.get(GROUP_KEY) == now - 300
+
+    # Queued but never delivered before the restart
+    worker.deals.append(deal(2, 100, now - 200))
+    poller._poll_step()
+    assert poller.watermarks.get(GROUP_KEY) == now - 300
+
+    restarted_worker, restarted = make(tmp_path, [200])
+    restarted_worker.deals = worker.deals
+    restarted._poll_step()
+    drain(restarted.dispatcher)
+    restarted._process_results()
+    assert 2 in posted_tickets(restarted)[0] # Re-fetched from the persisted mark
+    assert restarted.watermarks.get(GROUP_KEY) == now - 200
+
+def test_bulk_batch_delivery_commits(tmp_path):
+    worker, poller = make(tmp_path, [200], bulk=True)
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 5), deal(2, 101, now - 4)]
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert posted_tickets(poller) == [[1, 2]]
+    assert poller.watermarks.get(GROUP_KEY) == now - 4
+
+def test_bulk_unsupported_falls_back_per_login_before_committing(tmp_path):
+    worker, poller = make(tmp_path, [404, 200, 200], bulk=True)
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 5), deal(2, 101, now - 4)]
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._process_results() # Batch refused: per-login webhooks queued, mark still held back
+    assert not poller.bulk_supported
+    assert poller.watermarks.get(GROUP_KEY) is None
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert sorted(posted_tickets(poller)[1:]) == [[1], [2]]
+    assert poller.watermarks.get(GROUP_KEY) == now - 4
+
+def test_failed_delivery_is_sent_again(tmp_path):
+    worker, poller = make(tmp_path, [400, 200])
+    now = int(time.time())
+    worker.deals = [deal(1, 100, now - 3)]
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._poll_step() # Failure handled first, then the window is fetched again
+    assert poller.dispatcher.queue.qsize() == 1
+    drain(poller.dispatcher)
+    poller._process_results()
+    assert posted_tickets(poller) == [[1], [1]]
+    assert poller.watermarks.get(GROUP_KEY) == now - 3
+
+def test_dropped_submit_is_sent_again(tmp_path):
+    worker, poller = make(tmp_path, [200, 200], max_queue=1)
+    poller.dispatcher.submit("http://crm/other", {"login": 1})
+    worker.deals = [deal(1, 100, int(time.time()) - 3)]
+    poller._poll_step()
+    assert 1 not in poller.last_tickets
+    drain(poller.dispatcher) # Frees the queue
+    poller._poll_step()
+    drain(poller.dispatcher)
+    assert posted_tickets(poller)[-1] == [1]
+
+def test_delivered_tickets_stay_deduplicated(tmp_path):
+    worker, poller = make(tmp_path, [200])
+    worker.deals = [deal(1, 100, int(time.time()) - 3)]
+    poller._poll_step()
+    drain(poller.dispatcher)
+    poller._poll_step()
+    drain(poller.dispatcher)
+    assert posted_tickets(poller) == [[1]]
+    assert 1 in poller.last_tickets
@@ -0,0 +1,117 @@
+import time
+
+from user_cache import UserRecordCache, UserAuditor
+
+class User:
+    def __init__(self, login, **fields):
+        self.Login = login
+        self.Enable = 1
+        self.Rights = 3
+        self.Comment = ""
+        self.__dict__.update(fields)
+
+    def clone(self):
+        return User(self.Login, **{k: v for k, v in vars(self).items() if k != "Login"})
+
+class FakeManager:
+    """Server side: UserRequest returns a new object per call, like the real API"""
+    def __init__(self, *users):
+        self.server = {u.Login: u for u in users}
+        self.requests = 0
+        self.updates = []
+        self.fail = False
+
+    def UserRequest(self, login):
+        self.requests += 1
+        user = self.server.get(login)
+        return user.clone() if user else None
+
+    def UserUpdate(self, user):
+        if self.fail: return False
+        self.updates.append(user.clone())
+        self.server[user.Login] = user.clone()
+        return True
+
+def test_callers_get_copies():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache()
+    user = cache.request(manager, 1)
+    user.Enable = 0
+    assert cache.request(manager, 1).Enable == 1
+    assert manager.requests == 1
+
+def test_update_writes_only_fields_onto_a_fresh_record():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache(write_max_age=0)
+    cache.request(manager, 1)
+    manager.server[1].Comment = "edited in the admin terminal"
+
+    assert cache.update(manager, 1, Enable=0, Rights=0) is True
+    written = manager.updates[-1]
+    assert (written.Enable, written.Rights, written.Comment) == (0, 0, "edited in the admin terminal")
+    assert cache.get(1).Enable == 0 # Write-through
+
+def test_failed_update_invalidates():
+    manager = FakeManager(User(1))
+    manager.fail = True
+    cache = UserRecordCache()
+    cache.request(manager, 1)
+    assert not cache.update(manager, 1, Enable=0)
+    assert cache.get(1) is None
+
+def test_own_write_echo_keeps_entry_external_change_drops_it():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache()
+    write_time = time.time()
+    cache.update(manager, 1, Enable=0)
+    cache.on_update(1, "user") # Pump echo of our write
+    assert cache.get(1) is not None
+    assert not cache.changed_since(1, write_time)
+
+    cache.on_update(1, "position") # Equity moves don't touch the record
+    assert cache.get(1) is not None
+
+    cache.on_update(1, "user") # Someone else edited it
+    assert cache.get(1) is None
+    assert cache.changed_since(1, write_time)
+
+def test_expires_after_ttl():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache(ttl=0)
+    cache.request(manager, 1)
+    cache.request(manager, 1)
+    assert manager.requests == 2
+
+def make_auditor(manager, cache):
+    alerts = []
+    auditor = UserAuditor(cache, fetch=manager.UserRequest,
+                          write=lambda login, fields: cache.update(manager, login, **fields),
+                          alert=lambda login, expected, actual: alerts.append((login, actual)), delay=0)
+    return auditor, alerts
+
+def test_audit_reapplies_a_write_that_did_not_stick():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache()
+    auditor, alerts = make_auditor(manager, cache)
+    written_at = time.time()
+    # Server still has Enable=1 although UserUpdate reported success
+    assert not auditor.audit(1, {"Enable": 0}, 0, written_at)
+    assert alerts == [(1, {"Enable": 1})]
+    assert manager.server[1].Enable == 0
+    assert auditor.queue.qsize() == 1 # Re-checked once more
+    assert auditor.audit(1, {"Enable": 0}, 1, written_at)
+
+def test_audit_respects_a_later_server_change():
+    manager = FakeManager(User(1))
+    cache = UserRecordCache()
+    auditor, alerts = make_auditor(manager, cache)
+    written_at = time.time() - 1
+    cache.on_update(1, "user") # Re-enabled from the admin terminal after our write
+    assert not auditor.audit(1, {"Enable": 0}, 0, written_at)
+    assert alerts and manager.updates == []
+    assert manager.server[1].Enable == 1
+
+def test_update_result_codes():
+    from user_cache import update_succeeded
+    assert update_succeeded(True) and update_succeeded(0)
+    assert not update_succeeded(False) and not update_succeeded(None) and not update_succeeded(3)
@@ -0,0 +1,62 @@
+import types
+
+from mt5_worker import MT5Worker
+
+class FakeManager:
+    def __init__(self, groups, accounts, broken=()):
+        self.groups = groups # group -> logins
+        self.accounts = accounts # login -> (equity, balance), missing = unknown login
+        self.broken = set(broken)
+        self.user_requests = []
+
+    def UserLogins(self, group):
+        return self.groups.get(group, [])
+
+    def UserAccountGet(self, login):
+        if login not in self.accounts: return None
+        equity, balance = self.accounts[login]
+        return types.SimpleNamespace(Login=login, Equity=equity, Balance=balance)
+
+    def UserRequest(self, login):
+        self.user_requests.append(login)
+        if login in self.broken: raise RuntimeError("MT_RET_ERR_NETWORK")
+        if login not in self.accounts: return None
+        equity, balance = self.accounts[login]
+        return types.SimpleNamespace(Login=login, Equity=equity, Balance=balance, Group="demo\\other")
+
+def make(manager):
+    worker = MT5Worker()
+    worker.connected = True
+    worker._manager = manager
+    return worker
+
+def test_group_logins_skip_user_request():
+    manager = FakeManager({"demo\\pro": [1, 2]}, {1: (100.0, 90.0), 2: (50.0, 50.0)})
+    snap = make(manager).get_users_snapshot([1, 2], groups=["demo\\pro"])
+    assert snap == {"login": [1, 2], "group": ["demo\\pro"] * 2, "equity": [100.0, 50.0], "balance": [90.0, 50.0], "floating": [10.0, 0.0]}
+    assert manager.user_requests == []
+
+def test_one_failing_user_request_skips_only_that_login():
+    manager = FakeManager({}, {1: (100.0, 100.0), 2: (200.0, 200.0), 3: (300.0, 300.0)}, broken=[2])
+    snap = make(manager).get_users_snapshot([1, 2, 3])
+    assert snap["login"] == [1, 3]
+    assert snap["equity"] == [100.0, 300.0]
+    assert manager.user_requests == [1, 2, 3]
+
+def test_unknown_logins_are_omitted_and_groups_remembered():
+    manager = FakeManager({}, {1: (100.0, 100.0)})
+    worker = make(manager)
+    snap = worker.get_users_snapshot([1, 9])
+    assert snap["login"] == [1]
+    assert worker.get_login_group(1) == "demo\\other"
+    worker.get_users_snapshot([1])
+    assert manager.user_requests == [1, 9] # Group known now: the fast path is enough
+
+def test_floating_pl_excludes_credit():
+    from mt5_worker import floating_pl
+    user = types.SimpleNamespace(Equity=105000.0, Balance=100000.0, Credit=4000.0) # IMTUser: no profit field
+    assert floating_pl(user, 105000.0, 100000.0) == 1000.0
+    account = types.SimpleNamespace(Equity=105000.0, Balance=100000.0, Credit=4000.0, Floating=1000.0)
+    assert floating_pl(account, 105000.0, 100000.0) == 1000.0
+    client = types.SimpleNamespace(equity=105000.0, balance=100000.0, credit=4000.0, profit=1000.0)
+    assert floating_pl(client, 105000.0, 100000.0) == 1000.0
@@ -0,0 +1,71 @@
+from webhook_dispatcher import WebhookDispatcher
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.posts = []
+
+    def post(self, url, json=None, data=None, headers=None, timeout=None):
+        self.posts.append((url, json, headers))
+        status = self.statuses.pop(0)
+        if isinstance(status, Exception): raise status
+        return FakeResponse(status)
+
+def make(statuses, **kwargs):
+    # Not started: tests drive delivery by hand through _next_job/_deliver
+    dispatcher = WebhookDispatcher(workers=1, backoff_base=0.0, **kwargs)
+    dispatcher.session = FakeSession(statuses)
+    return dispatcher
+
+def drain(dispatcher):
+    while True:
+        job = dispatcher._next_job()
+        if job is None: return
+        dispatcher._deliver(job)
+
+def test_duplicate_keys_are_dropped():
+    dispatcher = make([200])
+    assert dispatcher.submit("http://crm", {"event": "account_breached", "login": 1}, idempotency_key="k1")
+    assert not dispatcher.submit("http://crm", {"event": "account_breached", "login": 1}, idempotency_key="k1")
+    drain(dispatcher)
+    assert dispatcher.stats["duplicates"] == 1
+    assert len(dispatcher.session.posts) == 1
+    assert dispatcher.session.posts[0][2]["Idempotency-Key"] == "k1"
+    # Delivered keys stay known
+    assert not dispatcher.submit("http://crm", {"login": 1}, idempotency_key="k1")
+
+def test_retries_server_errors_until_delivered():
+    results = []
+    dispatcher = make([503, ConnectionError("reset"), 200])
+    dispatcher.submit("http://crm", {"login": 2}, idempotency_key="k2", on_result=lambda p, ok, status: results.append((ok, status)))
+    drain(dispatcher)
+    assert len(dispatcher.session.posts) == 3
+    assert dispatcher.stats["retried"] == 2 and dispatcher.stats["sent"] == 1
+    assert results == [(True, 200)]
+
+def test_client_error_fails_without_retry_and_frees_the_key():
+    results = []
+    dispatcher = make([400, 200])
+    dispatcher.submit("http://crm", {"login": 3}, idempotency_key="k3", on_result=lambda p, ok, status: results.append((ok, status)))
+    drain(dispatcher)
+    assert results == [(False, 400)]
+    assert dispatcher.stats["failed"] == 1 and dispatcher.stats["retried"] == 0
+    assert dispatcher.submit("http://crm", {"login": 3}, idempotency_key="k3")
+
+def test_gives_up_after_max_retries():
+    dispatcher = make([500, 500, 500], max_retries=2)
+    dispatcher.submit("http://crm", {"login": 4}, idempotency_key="k4")
+    drain(dispatcher)
+    assert len(dispatcher.session.posts) == 3
+    assert dispatcher.stats["failed"] == 1
+
+def test_full_queue_drops_and_forgets_the_key():
+    dispatcher = make([], max_queue=1)
+    assert dispatcher.submit("http://crm", {"login": 5}, idempotency_key="a")
+    assert not dispatcher.submit("http://crm", {"login": 6}, idempotency_key="b")
+    assert dispatcher.stats["dropped"] == 1
+    assert "b" not in dispatcher.seen_keys
@@ -0,0 +1,43 @@
+import asyncio
+
+import main
+
+class FakeSocket:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.fail: raise RuntimeError("connection reset")
+        self.sent.append(text)
+
+def test_disconnect_logs_once(capsys):
+    async def run():
+        manager = main.ConnectionManager()
+        dead, alive = FakeSocket(fail=True), FakeSocket()
+        await manager.connect(1, dead)
+        await manager.connect(1, alive)
+        manager.publish(1, {"event": "account_update", "login": 1})
+        await asyncio.sleep(0.01) # Writer fails and prunes the dead socket
+        manager.disconnect(1, dead) # Endpoint's own cleanup afterwards
+        assert list(manager.rooms[1]) == [alive]
+        assert len(alive.sent) == 1
+        manager.disconnect(1, alive)
+        manager.disconnect(1, alive)
+        assert manager.rooms == {}
+    asyncio.run(run())
+    lines = [l for l in capsys.readouterr().out.splitlines() if "disconnected" in l]
+    assert len(lines) == 2
+    assert "send failed: connection reset" in lines[0]
+
+def test_listened_logins():
+    async def run():
+        manager = main.ConnectionManager()
+        await manager.connect(5, FakeSocket())
+        assert manager.listened_logins() == (False, frozenset({5}))
+        await manager.connect(0, FakeSocket())
+        assert manager.listened_logins() == (True, frozenset({5}))
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+from metrics import registry
+
+class TicketDedupCache:
+    """
+    Bounded "already sent" set of deal tickets.
+
+    Entries are kept in insertion order (close to deal-time order) and expire once their deal time
+    falls more than `ttl` seconds behind the newest deal seen. Expiry is measured against deal times
+    only, so MT5 server-time offsets don't matter. `max_entries` caps memory during bursts; the
+    oldest entries go first, so there is never a full clear that makes the whole window look new.
+    Lookup and insert are O(1), eviction is amortized O(1).
+    """
+    def __init__(self, max_entries=100000, ttl=3600, name="poller"):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.entries = OrderedDict() # ticket -> deal time
+        self.newest = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0 # Dropped because of max_entries
+        self.expirations = 0 # Dropped because of ttl
+
+    def __contains__(self, ticket):
+        return ticket in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def seen(self, ticket, deal_time=0):
+        """True if the ticket was already recorded; otherwise records it and returns False"""
+        if ticket in self.entries:
+            self.hits += 1
+            registry.inc("ticket_dedup_hits_total", cache=self.name)
+            return True
+
+        self.misses += 1
+        registry.inc("ticket_dedup_misses_total", cache=self.name)
+        deal_time = int(deal_time or 0)
+        if deal_time > self.newest:
+            self.newest = deal_time
+        self.entries[ticket] = deal_time or self.newest
+        self._evict()
+        return False
+
+    def discard(self, ticket):
+        """Forgets a ticket (its webhook was never delivered), so the next poll picks it up again"""
+        self.entries.pop(ticket, None)
+
+    def _evict(self):
+        entries = self.entries
+        cutoff = self.newest - self.ttl
+        expired = 0
+        while entries:
+            ticket, deal_time = next(iter(entries.items()))
+            if deal_time >= cutoff: break
+            entries.popitem(last=False)
+            expired += 1
+
+        evicted = 0
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+            evicted += 1
+
+        if expired:
+            self.expirations += expired
+            registry.inc("ticket_dedup_expirations_total", expired, cache=self.name)
+        if evicted:
+            self.evictions += evicted
+            registry.inc("ticket_dedup_evictions_total", evicted, cache=self.name)
+        registry.set_gauge("ticket_dedup_size", len(entries), cache=self.name)
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -0,0 +1,219 @@
+from operator import attrgetter, itemgetter
+
+# Candidate attribute names per field, first match wins.
+# Manager API objects use CamelCase, Client API (MetaTrader5) namedtuples and dicts use snake_case.
+DEAL_FIELDS = (
+    ("position_id", ("PositionID", "position_id")),
+    ("entry", ("Entry", "entry")),
+    ("ticket", ("Deal", "Ticket", "ticket")),
+    ("time", ("Time", "time")),
+    ("symbol", ("Symbol", "symbol")),
+    ("type", ("Action", "Type", "type")),
+    ("volume", ("Volume", "volume")),
+    ("price", ("Price", "price")),
+    ("profit", ("Profit", "profit")),
+    ("commission", ("Commission", "commission")),
+    ("swap", ("Storage", "Swap", "swap")),
+)
+D_POSITION_ID, D_ENTRY, D_TICKET, D_TIME, D_SYMBOL, D_TYPE, D_VOLUME, D_PRICE, D_PROFIT, D_COMMISSION, D_SWAP = range(len(DEAL_FIELDS))
+
+POSITION_FIELDS = (
+    ("ticket", ("Position", "Ticket", "Deal", "ticket")),
+    ("time", ("TimeCreate", "Time", "time_setup", "time")),
+    ("symbol", ("Symbol", "symbol")),
+    ("type", ("Action", "Type", "Cmd", "type")),
+    ("entry", ("Entry", "entry")),
+    ("volume", ("Volume", "volume")),
+    ("price", ("PriceOpen", "Price", "price_open", "price")),
+    ("close_price", ("PriceCurrent", "Price", "price_current", "price")),
+    ("profit", ("Profit", "profit")),
+    ("commission", ("Commission", "commission")),
+    ("swap", ("Storage", "Swap", "swap")),
+)
+P_TICKET, P_TIME, P_SYMBOL, P_TYPE, P_ENTRY, P_VOLUME, P_PRICE, P_CLOSE_PRICE, P_PROFIT, P_COMMISSION, P_SWAP = range(len(POSITION_FIELDS))
+
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+
+class AccessorPlan:
+    """
+    Resolves which attribute (or dict key) backs each field once, from a sample object,
+    and compiles it into a single attrgetter/itemgetter call returning every field at once.
+    """
+    def __init__(self, fields, sample):
+        self.is_dict = isinstance(sample, dict)
+        has = (lambda n: n in sample) if self.is_dict else (lambda n: hasattr(sample, n))
+
+        present = []
+        self.slots = [] # field index -> index in getter result (None = missing)
+        for _, names in fields:
+            name = next((n for n in names if has(n)), None)
+            if name is None:
+                self.slots.append(None)
+            else:
+                self.slots.append(len(present))
+                present.append(name)
+
+        self.names = present
+        make = itemgetter if self.is_dict else attrgetter
+        if len(present) > 1:
+            self.getter = make(*present)
+        elif present:
+            single = make(present[0])
+            self.getter = lambda obj: (single(obj),)
+        else:
+            self.getter = lambda obj: ()
+
+    def extract(self, obj):
+        """Returns a tuple aligned to the field list, None for missing fields"""
+        values = self.getter(obj)
+        return tuple(None if slot is None else values[slot] for slot in self.slots)
+
+class _PlanCache:
+    """Per-type plans for attribute objects; dicts get a fresh plan per batch since their shape isn't type-bound"""
+    def __init__(self):
+        self.plans = {}
+
+    def plan_for(self, fields, obj, batch_plans):
+        cls = type(obj)
+        plan = batch_plans.get(cls)
+        if plan is None:
+            plan = None if cls is dict else self.plans.get((id(fields), cls))
+            if plan is None:
+                plan = AccessorPlan(fields, obj)
+                if cls is not dict:
+                    self.plans[(id(fields), cls)] = plan
+            batch_plans[cls] = plan
+        return plan
+
+_plans = _PlanCache()
+
+def _extract_all(fields, objs):
+    batch_plans = {}
+    for obj in objs:
+        if obj is None: continue
+        plan = _plans.plan_for(fields, obj, batch_plans)
+        try:
+            yield obj, plan.extract(obj)
+        except (AttributeError, KeyError):
+            # Object missing a field its type usually has: one-off plan for this object only
+            yield obj, AccessorPlan(fields, obj).extract(obj)
+
+def _num(value, cast, default):
+    return default if value is None else cast(value)
+
+class TradeBatch:
+    """Normalized trades for one login plus the marks needed for incremental syncs"""
+    __slots__ = ("trades", "tickets", "last_deal_time", "last_deal_ticket", "min_open_time")
+
+    def __init__(self):
+        self.trades = []
+        self.tickets = set()
+        self.last_deal_time = 0
+        self.last_deal_ticket = 0
+        self.min_open_time = 0 # Oldest open position (0 = none)
+
+def normalize_trades(login, deals, positions, closed_ticket="deal", include_lots=False):
+    """
+    Builds the CRM trade list for one login.
+    Closed trades come from IN/OUT deals paired by PositionID, open trades from positions.
+
+    closed_ticket: "deal" uses the OUT deal ticket, "position" uses the PositionID
+                   (matches the open position's ticket for upserts).
+    include_lots: Adds "lots" (Manager volume is in 1/10000 lots).
+    """
+    batch = TradeBatch()
+    trades = batch.trades
+    tickets = batch.tickets
+
+    # 1. Pair deals by position (single pass)
+    position_deals = {} # position_id -> [in_values, out_values]
+    for deal, v in _extract_all(DEAL_FIELDS, deals or []):
+        t = v[D_TIME]
+        if t and int(t) > batch.last_deal_time: batch.last_deal_time = int(t)
+        tk = v[D_TICKET]
+        if tk and int(tk) > batch.last_deal_ticket: batch.last_deal_ticket = int(tk)
+
+        position_id = v[D_POSITION_ID] or 0
+        if position_id == 0: continue
+        entry = v[D_ENTRY] if v[D_ENTRY] is not None else DEAL_ENTRY_IN
+        pair = position_deals.get(position_id)
+        if pair is None:
+            pair = position_deals[position_id] = [None, None]
+        if entry == DEAL_ENTRY_IN:
+            pair[0] = v
+        elif entry == DEAL_ENTRY_OUT:
+            pair[1] = v
+
+    # 2. Closed trades (only positions with an OUT deal)
+    for position_id, (in_v, out_v) in position_deals.items():
+        if out_v is None: continue
+        try:
+            deal_ticket = out_v[D_TICKET] or 0
+            if deal_ticket == 0: continue
+            ticket = position_id if closed_ticket == "position" else deal_ticket
+
+            open_time = _num((in_v or out_v)[D_TIME], int, 0)
+            close_time = _num(out_v[D_TIME], int, open_time)
+            volume = _num(out_v[D_VOLUME], float, 0.0)
+
+            t = {
+                "login": login,
+                "ticket": ticket,
+                "symbol": out_v[D_SYMBOL] or "",
+                "type": _num(out_v[D_TYPE], int, 0),
+                "entry": _num(out_v[D_ENTRY], int, DEAL_ENTRY_OUT),
+                "volume": volume,
+                "price": _num((in_v or out_v)[D_PRICE], float, 0.0),
+                "close_price": _num(out_v[D_PRICE], float, 0.0),
+                "profit": _num(out_v[D_PROFIT], float, 0.0),
+                "commission": _num(out_v[D_COMMISSION], float, 0.0),
+                "swap": _num(out_v[D_SWAP], float, 0.0),
+                "time": open_time,  # Open time from IN deal
+                "close_time": close_time,  # Close time from OUT deal
+                "duration": close_time - open_time if close_time > open_time else 0,
+                "is_closed": True
+            }
+            if include_lots:
+                t["lots"] = volume / 10000.0 if volume > 100 else volume
+            trades.append(t)
+            tickets.add(ticket)
+        except Exception as e:
+            print(f"⚠️ Error processing position {position_id}: {e}")
+
+    # 3. Open positions
+    for pos, v in _extract_all(POSITION_FIELDS, positions or []):
+        try:
+            ticket = v[P_TICKET] or 0
+            if ticket == 0: continue
+
+            open_time = _num(v[P_TIME], int, 0)
+            if open_time > 0 and (batch.min_open_time == 0 or open_time < batch.min_open_time):
+                batch.min_open_time = open_time
+            volume = _num(v[P_VOLUME], float, 0.0)
+
+            t = {
+                "login": login,
+                "ticket": ticket,
+                "symbol": v[P_SYMBOL] or "",
+                "type": _num(v[P_TYPE], int, 0),
+                "entry": _num(v[P_ENTRY], int, DEAL_ENTRY_IN),
+                "volume": volume,
+                "price": _num(v[P_PRICE], float, 0.0),
+                "close_price": _num(v[P_CLOSE_PRICE], float, 0.0),
+                "profit": _num(v[P_PROFIT], float, 0.0),
+                "commission": _num(v[P_COMMISSION], float, 0.0),
+                "swap": _num(v[P_SWAP], float, 0.0),
+                "time": open_time,
+                "close_time": None,  # No close time for open trades
+                "duration": None,  # No duration for open trades yet
+                "is_closed": False
+            }
+            if include_lots:
+                t["lots"] = volume / 10000.0 if volume > 100 else volume
+            trades.append(t)
+            tickets.add(ticket)
+        except Exception as e:
+            print(f"⚠️ Error processing open position: {e}")
+
+    return batch
@@ -2,9 +2,36 @@ import time
 import threading
 import os
 import json
-import requests
+import queue
+import hashlib
+from collections import deque
 from datetime import datetime
 from supabase import create_client
+from webhook_dispatcher import get_dispatcher
+from metrics import registry
+from ticket_cache import TicketDedupCache
+from deal_cursor import PollWatermarkStore
+from failed_registry import get_failed_registry
+
+# Group mode: one deal request per monitored group per cycle instead of one per active login
+# (active logins outside the monitored groups are still polled individually).
+# Set POLLER_GROUP_MODE=0 to scan active challenge logins individually.
+POLLER_GROUP_MODE = os.getenv("POLLER_GROUP_MODE", "1") == "1"
+# Sent-ticket dedup: size cap and deal-time TTL (seconds, must exceed the poll look-back window)
+POLLER_DEDUP_MAX = int(os.getenv("POLLER_DEDUP_MAX", "100000"))
+POLLER_DEDUP_TTL = int(os.getenv("POLLER_DEDUP_TTL", "3600"))
+# Re-query this many seconds before the persisted mark (deals sharing the mark's second, late inserts)
+POLLER_MARK_OVERLAP = int(os.getenv("POLLER_MARK_OVERLAP", "5"))
+# Bulk trade webhook: all logins' closed trades of a cycle in size-capped batches.
+# Used when a bulk URL is configured (CRM_TRADE_BULK_CALLBACK or mt5_server_config.bulk_callback_url),
+# otherwise (or if the receiver doesn't know the endpoint) one webhook per login.
+POLLER_BATCH_MAX_TRADES = int(os.getenv("POLLER_BATCH_MAX_TRADES", "500"))
+POLLER_BATCH_MAX_BYTES = int(os.getenv("POLLER_BATCH_MAX_BYTES", str(512 * 1024)))
+POLLER_BATCH_GZIP = os.getenv("POLLER_BATCH_GZIP", "0") == "1"
+# Bulk endpoint answers meaning "not supported here": switch to per-login webhooks
+BULK_UNSUPPORTED_STATUS = (404, 405, 410, 415, 501)
+# Stopped-out logins are still polled this long after the stop-out so its closing deals reach the CRM
+POLLER_FAILED_GRACE = int(os.getenv("POLLER_FAILED_GRACE", "900"))
 
 class DynamicTradePoller:
     def __init__(self, worker, interval=10, reload_interval=300, ws_manager=None):
@@ -18,11 +45,24 @@ class DynamicTradePoller:
         # Config (Defaults)
         self.monitored_groups = ["demo\\Pro-Platinum"]
         self.callback_url = os.getenv("CRM_TRADE_CALLBACK")
-        self.last_tickets = set() # Cache of recently processed tickets
+        self.bulk_callback_url = os.getenv("CRM_TRADE_BULK_CALLBACK")
+        self.bulk_supported = True
+        self.pending_trades = [] # (login, trades) collected during a cycle, flushed as batches
+        self.last_tickets = TicketDedupCache(POLLER_DEDUP_MAX, POLLER_DEDUP_TTL) # Recently processed tickets
+        self.active_logins = set() # Group mode filter (empty = every login in the monitored groups)
+        self.group_logins = set() # Logins the monitored groups' queries cover (refreshed with the config)
+        self.watermarks = PollWatermarkStore() # Last processed deal time per group/login (survives restarts)
+        # Marks are committed only once a cycle's webhooks are delivered, oldest cycle first
+        self.cycles = deque() # Cycles with deliveries outstanding, in poll order
+        self.cycle_seq = 0
+        self.held = {} # key -> last cycle seq whose marks for key must not be committed (a delivery failed)
+        self.results = queue.Queue() # Dispatcher outcomes, handled on the poller thread
+        self.failed_accounts = get_failed_registry() # Shared with check-bulk / RiskEngine
         
         # Supabase for Config Reload
         self.supabase = None
         self._init_supabase()
+        self.dispatcher = get_dispatcher(self.supabase)
 
     def _init_supabase(self):
         url = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
@@ -46,6 +86,9 @@ class DynamicTradePoller:
                 # Update Callback
                 if res.get('callback_url'):
                     self.callback_url = res.get('callback_url')
+                if res.get('bulk_callback_url') and res.get('bulk_callback_url') != self.bulk_callback_url:
+                    self.bulk_callback_url = res.get('bulk_callback_url')
+                    self.bulk_supported = True
                 
                 # Update Groups
                 raw_groups = res.get('monitored_groups')
@@ -107,15 +150,133 @@ class DynamicTradePoller:
         return all_trades
 
     def _poll_step(self):
-        if not self.callback_url: return
+        self._process_results()
+        if not self.callback_url and not self.bulk_callback_url: return
 
         # Reload config periodically
         if time.time() - self.last_reload > self.reload_interval:
             self._reload_config()
+            self._reload_active_logins()
             self.last_reload = time.time()
 
-        # FETCH TRADES LOGIC
-        # 1. Get logins to check
+        now_ts = int(time.time())
+        cycle = self._begin_cycle()
+        try:
+            if self._group_mode():
+                self._poll_groups(now_ts, cycle)
+                # Active accounts outside the monitored groups still sync, one request each
+                outside = self._logins_outside_groups()
+                if outside:
+                    self._poll_logins(now_ts, cycle, outside)
+            else:
+                self._poll_logins(now_ts, cycle)
+        finally:
+            cycle["sealed"] = True
+            self._commit_marks()
+
+    # --- Delivery tracking ---
+    def _begin_cycle(self):
+        """
+        cycle = { seq, marks: key -> deal time, keys: login -> poll key, pending: webhooks not resolved yet, sealed }
+        The cycle's marks are written once it is sealed and every webhook it submitted was delivered.
+        """
+        self.cycle_seq += 1
+        cycle = {"seq": self.cycle_seq, "marks": {}, "keys": {}, "pending": 0, "sealed": False}
+        self.cycles.append(cycle)
+        return cycle
+
+    def _submit(self, cycle, trades, url, payload, idempotency_key, **kwargs):
+        """Queues one trade webhook; its final outcome comes back through self.results"""
+        cycle["pending"] += 1
+        def on_result(payload, success, status):
+            self.results.put((cycle, trades, payload, success, status))
+        if self.dispatcher.submit(url, payload, idempotency_key=idempotency_key, on_result=on_result, **kwargs):
+            return
+        if self.dispatcher.known(idempotency_key):
+            self._resolve(cycle, trades, True) # Same trades already delivered or in flight
+        else:
+            print(f"⚠️ Poller: webhook for {len(trades)} trades not queued, holding their watermark")
+            self._resolve(cycle, trades, False)
+
+    def _process_results(self):
+        while True:
+            try:
+                cycle, trades, payload, success, status = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if not success and "logins" in payload and status in BULK_UNSUPPORTED_STATUS:
+                self._fallback_per_login(cycle, payload, status)
+                success = True # Replaced by the per-login webhooks, each resolved on its own
+            self._resolve(cycle, trades, success)
+        self._commit_marks()
+
+    def _resolve(self, cycle, trades, success):
+        cycle["pending"] -= 1
+        if not success:
+            self._hold(cycle, trades)
+
+    def _hold(self, cycle, trades):
+        """
+        Undelivered trades: their tickets leave the dedup cache and their poll keys keep the current mark
+        in this cycle and in every cycle already started, so the first cycle started afterwards fetches
+        and sends them again.
+        """
+        for t in trades:
+            self.last_tickets.discard(t["ticket"])
+        for login in {t["login"] for t in trades}:
+            key = cycle["keys"].get(login)
+            if key:
+                self.held[key] = self.cycle_seq
+
+    def _commit_marks(self):
+        """Advances the marks of finished cycles, strictly in poll order"""
+        while self.cycles and self.cycles[0]["sealed"] and self.cycles[0]["pending"] <= 0:
+            cycle = self.cycles.popleft()
+            for key, deal_time in cycle["marks"].items():
+                if self.held.get(key, 0) >= cycle["seq"]: continue
+                self.watermarks.advance(key, deal_time)
+        oldest = self.cycles[0]["seq"] if self.cycles else self.cycle_seq + 1
+        self.held = {key: seq for key, seq in self.held.items() if seq >= oldest}
+
+    def _window(self, key, now_ts):
+        """
+        Deal window for one group/login: from its persisted mark (minus a small overlap that the
+        ticket dedup absorbs) to now. Without a mark (first run) look back one interval + buffer.
+        """
+        mark = self.watermarks.get(key)
+        if mark is None:
+            from_ts = now_ts - self.interval - 15
+        else:
+            from_ts = mark - POLLER_MARK_OVERLAP
+        to_ts = max(now_ts, mark or 0) + 5 # Future buffer for clock skew
+        return from_ts, to_ts
+
+    @staticmethod
+    def _max_deal_time(deals):
+        return max((int(d.get('time', d.get('Time', 0)) or 0) for d in deals), default=0)
+
+    def _group_mode(self):
+        # Group queries need Manager API deals (they carry Login); Client API only sees one account
+        return POLLER_GROUP_MODE and bool(self.monitored_groups) and getattr(self.worker, '_manager', None) is not None
+
+    def _reload_active_logins(self):
+        """Active challenge logins, used to filter group deals (refreshed with the config, not every cycle)"""
+        self.failed_accounts.refresh() # Marks cleared by the risk shards (reinstated accounts)
+        if not self.supabase: return
+        try:
+            r = self.supabase.table('challenges').select('mt5_login').eq('status', 'active').execute()
+            self.active_logins = {int(x['mt5_login']) for x in r.data if x.get('mt5_login')}
+        except Exception as e:
+            print(f"⚠️ Poller DB Error: {e}")
+
+        if self._group_mode() and hasattr(self.worker, 'get_group_logins'):
+            members = set()
+            for group in self.monitored_groups:
+                members.update(self.worker.get_group_logins(group) or [])
+            self.group_logins = members
+
+    def _fetch_active_logins(self):
+        """Legacy mode: active logins straight from Supabase, every cycle"""
         logins = []
         if self.supabase:
             try:
@@ -124,109 +285,222 @@ class DynamicTradePoller:
                 logins = [x['mt5_login'] for x in r.data if x.get('mt5_login')]
             except Exception as e:
                 print(f"⚠️ Poller DB Error: {e}")
+        return logins
+
+    def _logins_outside_groups(self):
+        """Active logins not covered by a group query (MT5 group not monitored, or not known yet)"""
+        get_group = getattr(self.worker, 'get_login_group', None)
+        monitored = set(self.monitored_groups)
+        return [l for l in self.active_logins
+                if l not in self.group_logins and (get_group is None or get_group(l) not in monitored)]
+
+    def _is_dead(self, login, now_ts):
+        """Stopped out long enough ago that its closing deals have already been synced"""
+        marked = self.failed_accounts.marked_at(login)
+        return marked is not None and now_ts - marked > POLLER_FAILED_GRACE
+
+    def _poll_groups(self, now_ts, cycle):
+        """One deal request per monitored group, fanned out by login locally"""
+        by_login = {}
+        marks = {} # group key -> newest deal time fetched
+        for group in self.monitored_groups:
+            key = f"group:{group}"
+            from_ts, to_ts = self._window(key, now_ts)
+            deals = self.worker.get_deals_by_group(group, from_ts, to_ts, strict=True)
+            if deals is None: continue # Fetch failed: mark stays, the window is fetched again
+            deals = [self._deal_dict(deal) for deal in deals]
+            # No deals: the whole window is done, so the mark moves to its end (first run seeds it)
+            marks[key] = self._max_deal_time(deals) or now_ts
+            for d in deals:
+                login = d.get('Login', d.get('login'))
+                if not login: continue
+                login = int(login)
+                if self.active_logins and login not in self.active_logins: continue
+                if self._is_dead(login, now_ts): continue
+                by_login.setdefault(login, []).append(d)
+                cycle["keys"][login] = key
+
+        failed = False
+        for login, deals in by_login.items():
+            closed_trades = []
+            try:
+                closed_trades = self._closed_trades(login, deals)
+                self._publish(cycle, login, closed_trades)
+            except Exception as e:
+                failed = True
+                self._hold(cycle, closed_trades)
+                print(f"⚠️ Poll Loop Error ({login}): {e}")
+
+        self._flush_batches(cycle)
+
+        # Committed once every login's trades are delivered, otherwise the same window is fetched again
+        if not failed:
+            cycle["marks"].update(marks)
+
+    def _poll_logins(self, now_ts, cycle, logins=None):
+        """Legacy mode: active logins from Supabase (or the given ones), one deal request per login"""
+        # FETCH TRADES LOGIC
+        # 1. Get logins to check
+        if logins is None:
+            logins = self._fetch_active_logins()
         
+        logins = [l for l in logins if not self._is_dead(l, now_ts)]
         if not logins: return
 
         # 2. Check each login
-        # Calculate time window: [Now - Interval - Buffer] to [Now]
-        now_ts = int(time.time())
-        # We need to cover the gap since last check. 
-        # But to avoid complications, we look back 'interval + 10s' 
-        # and rely on 'ticket' deduplication in CRM.
-        from_ts = now_ts - self.interval - 15 
-        to_ts = now_ts + 5 # Future buffer for clock skew
-
+        marks = {}
         for login in logins:
             try:
+                key = f"login:{login}"
+                from_ts, to_ts = self._window(key, now_ts)
                 # Fetch deals
-                deals = self.worker.get_deals(login, from_ts, to_ts)
-                
-                if not deals: continue
-
-                closed_trades = []
-                for deal in deals:
-                    # Convert to dict if object
-                    d = deal if isinstance(deal, dict) else deal._asdict() if hasattr(deal, '_asdict') else deal.__dict__
-                    
-                    # Check Entry Type (1 = OUT = Deal Close)
-                    # Note: Mock might not have 'entry'. Client API has 'entry'.
-                    # MT5 Constant: DEAL_ENTRY_OUT = 1
-                    entry = d.get('entry', d.get('Entry', -1))
-                    
-                    # if entry == 1 (OUT) OR Mock mode (always accept if mock)
-                    is_mock_mode = not self.worker._use_client_api and self.worker._manager.__class__.__name__ == 'ManagerAPI'
-                    if entry == 1 or is_mock_mode:
-                        ticket = d.get('ticket', d.get('Ticket', 0))
-                        
-                        # Dedup check (Memory cache)
-                        if ticket in self.last_tickets: continue
-                        self.last_tickets.add(ticket)
-                        if len(self.last_tickets) > 10000: self.last_tickets.clear() # Primitive GC
-
-                        closed_trades.append({
-                            "login": login,
-                            "ticket": ticket,
-                            "symbol": d.get('symbol', d.get('Symbol')),
-                            "type": d.get('type', d.get('Type')),
-                            "volume": d.get('volume', d.get('Volume', 0)),
-                            "price": d.get('price', d.get('Price', 0.0)), # Price of deal (Close price)
-                            "close_price": d.get('price', d.get('Price', 0.0)), # For OUT deal, price IS close price
-                            "profit": d.get('profit', d.get('Profit', 0.0)),
-                            "commission": d.get('commission', d.get('Commission', 0.0)),
-                            "swap": d.get('swap', d.get('Swap', 0.0)),
-                            "time": d.get('time', d.get('Time', 0)),
-                            "close_time": d.get('time', d.get('Time', 0)),
-                            "is_closed": True
-                        })
-
-                if closed_trades:
-                    print(f"Update: Sending {len(closed_trades)} trades for {login} to CRM")
-                    
-                    # WebSocket Broadcast
-                    if self.ws_manager:
-                        import asyncio
-                        try:
-                            # Note: DynamicTradePoller might run in a thread without a loop?
-                            # Usually main.py (FastAPI) has a loop. 
-                            # If this is a background thread, we need to handle loop safely.
-                            payload = {
-                                "event": "account_update",
-                                "login": login,
-                                "equity": 0.0, # Will be refreshed by risk engine in 500ms
-                                "floating_pl": 0.0, 
-                                "trades_closed": True,
-                                "closed_count": len(closed_trades),
-                                "trades": closed_trades,
-                                "timestamp": datetime.now().isoformat()
-                            }
-                            # Simple way to run async from sync if loop exists
-                            try:
-                                if getattr(self.ws_manager, 'main_loop', None):
-                                    import asyncio
-                                    asyncio.run_coroutine_threadsafe(
-                                        self.ws_manager.broadcast(login, payload), 
-                                        self.ws_manager.main_loop
-                                    )
-                            except Exception as ws_err:
-                                pass
-                        except Exception as e:
-                            print(f"⚠️ WS Broadcast Error (Trades): {e}")
-
-                    payload = {
-                        "login": login,
-                        "group": "dynamic", # We might need to fetch group, but CRM finds by login
-                        "timestamp": datetime.now().isoformat(),
-                        "trades": closed_trades
-                    }
-                    try:
-                        requests.post(self.callback_url, json=payload, timeout=5)
-                    except Exception as req_err:
-                        print(f"⚠️ Webhook Failed ({req_err}) hitting: {self.callback_url}")
+                deals = self.worker.get_deals(login, from_ts, to_ts, strict=True)
+                if deals is None: continue # Fetch failed: mark stays, the window is fetched again
+                if not deals:
+                    marks[key] = now_ts # Empty window: move the mark to its end (first run seeds it)
+                    continue
+
+                deals = [self._deal_dict(deal) for deal in deals]
+                cycle["keys"][login] = key
+                closed_trades = self._closed_trades(login, deals)
+                try:
+                    self._publish(cycle, login, closed_trades)
+                except Exception:
+                    self._hold(cycle, closed_trades)
+                    raise
+                marks[key] = self._max_deal_time(deals)
 
             except Exception as e:
                 # print(f"⚠️ Poll Loop Error ({login}): {e}")
                 pass
 
+        self._flush_batches(cycle)
+        cycle["marks"].update(marks)
+
+    @staticmethod
+    def _deal_dict(deal):
+        # Convert to dict if object
+        return deal if isinstance(deal, dict) else deal._asdict() if hasattr(deal, '_asdict') else deal.__dict__
+
+    def _closed_trades(self, login, deals):
+        """OUT deals of one login not seen before, in CRM trade format"""
+        closed_trades = []
+        # if entry == 1 (OUT) OR Mock mode (always accept if mock)
+        is_mock_mode = not self.worker._use_client_api and self.worker._manager.__class__.__name__ == 'ManagerAPI'
+        for d in deals:
+            # Check Entry Type (1 = OUT = Deal Close)
+            # Note: Mock might not have 'entry'. Client API has 'entry'.
+            # MT5 Constant: DEAL_ENTRY_OUT = 1
+            entry = d.get('entry', d.get('Entry', -1))
+            
+            if entry == 1 or is_mock_mode:
+                ticket = d.get('ticket', d.get('Ticket', d.get('Deal', 0)))
+                
+                # Dedup check (bounded memory cache)
+                if self.last_tickets.seen(ticket, d.get('time', d.get('Time', 0))): continue
+
+                closed_trades.append({
+                    "login": login,
+                    "ticket": ticket,
+                    "symbol": d.get('symbol', d.get('Symbol')),
+                    "type": d.get('type', d.get('Type', d.get('Action'))),
+                    "volume": d.get('volume', d.get('Volume', 0)),
+                    "price": d.get('price', d.get('Price', 0.0)), # Price of deal (Close price)
+                    "close_price": d.get('price', d.get('Price', 0.0)), # For OUT deal, price IS close price
+                    "profit": d.get('profit', d.get('Profit', 0.0)),
+                    "commission": d.get('commission', d.get('Commission', 0.0)),
+                    "swap": d.get('swap', d.get('Swap', d.get('Storage', 0.0))),
+                    "time": d.get('time', d.get('Time', 0)),
+                    "close_time": d.get('time', d.get('Time', 0)),
+                    "is_closed": True
+                })
+        return closed_trades
+
+    def _publish(self, cycle, login, closed_trades):
+        """WS broadcast + CRM webhook for one login's newly closed trades"""
+        if not closed_trades: return
+        print(f"Update: Sending {len(closed_trades)} trades for {login} to CRM")
+        
+        # WebSocket Broadcast
+        if self.ws_manager:
+            try:
+                payload = {
+                    "event": "account_update",
+                    "login": login,
+                    "equity": 0.0, # Will be refreshed by risk engine in 500ms
+                    "floating_pl": 0.0, 
+                    "trades_closed": True,
+                    "closed_count": len(closed_trades),
+                    "trades": closed_trades,
+                    "timestamp": datetime.now().isoformat()
+                }
+                self.ws_manager.broadcast_threadsafe(login, payload)
+            except Exception as e:
+                print(f"⚠️ WS Broadcast Error (Trades): {e}")
+
+        registry.inc("deals_synced_total", len(closed_trades))
+        if self.bulk_callback_url and self.bulk_supported:
+            self.pending_trades.append((login, closed_trades))
+        else:
+            self._send_login(cycle, login, closed_trades)
+
+    def _send_login(self, cycle, login, closed_trades):
+        """Per-login webhook (receivers without the bulk endpoint)"""
+        if not self.callback_url:
+            self._hold(cycle, closed_trades)
+            return
+        payload = {
+            "login": login,
+            "group": "dynamic", # We might need to fetch group, but CRM finds by login
+            "timestamp": datetime.now().isoformat(),
+            "trades": closed_trades
+        }
+        tickets = ",".join(str(t["ticket"]) for t in closed_trades)
+        key = f"trades:{login}:{hashlib.sha1(tickets.encode()).hexdigest()}"
+        self._submit(cycle, closed_trades, self.callback_url, payload, key, sync_login=login, deals_count=len(closed_trades))
+
+    def _flush_batches(self, cycle):
+        """Sends this cycle's trades as batches capped at POLLER_BATCH_MAX_TRADES trades / POLLER_BATCH_MAX_BYTES"""
+        pending, self.pending_trades = self.pending_trades, []
+        if not pending: return
+
+        batch, counts, size = [], {}, 0
+        for login, trades in pending:
+            for t in trades:
+                t_size = len(json.dumps(t, separators=(",", ":"))) + 1
+                if batch and (len(batch) >= POLLER_BATCH_MAX_TRADES or size + t_size > POLLER_BATCH_MAX_BYTES):
+                    self._send_batch(cycle, batch, counts)
+                    batch, counts, size = [], {}, 0
+                batch.append(t)
+                counts[login] = counts.get(login, 0) + 1
+                size += t_size
+        if batch:
+            self._send_batch(cycle, batch, counts)
+
+    def _send_batch(self, cycle, trades, counts):
+        payload = {
+            "group": "dynamic",
+            "timestamp": datetime.now().isoformat(),
+            "logins": len(counts),
+            "count": len(trades),
+            "trades": trades
+        }
+        tickets = ",".join(str(t["ticket"]) for t in trades)
+        key = f"trades-bulk:{hashlib.sha1(tickets.encode()).hexdigest()}"
+        print(f"Update: Sending batch of {len(trades)} trades for {len(counts)} logins to CRM")
+        self._submit(cycle, trades, self.bulk_callback_url, payload, key, sync_counts=counts, compress=POLLER_BATCH_GZIP)
+
+    def _fallback_per_login(self, cycle, payload, status):
+        """An old receiver without the bulk endpoint gets the batch re-sent per login"""
+        if self.bulk_supported:
+            self.bulk_supported = False
+            print(f"⚠️ Bulk trade endpoint unsupported (HTTP {status}), falling back to per-login webhooks")
+        by_login = {}
+        for t in payload["trades"]:
+            by_login.setdefault(t["login"], []).append(t)
+        for login, trades in by_login.items():
+            self._send_login(cycle, login, trades)
+
 def start_dynamic_polling(worker, interval=10, reload_interval=300, ws_manager=None):
     poller = DynamicTradePoller(worker, interval, reload_interval, ws_manager)
     poller.running = True
@@ -0,0 +1,181 @@
+import os
+import copy
+import time
+import queue
+import threading
+
+from metrics import registry
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+# Writes start from a record at most this old, so fields edited elsewhere aren't written back stale
+USER_WRITE_MAX_AGE = float(os.environ.get("USER_WRITE_MAX_AGE", "2"))
+# The pump echoes our own UserUpdate back; one user notification within this window is that echo
+USER_ECHO_WINDOW = float(os.environ.get("USER_ECHO_WINDOW", "2"))
+# Delay before a write is read back from the server and checked
+USER_AUDIT_DELAY = float(os.environ.get("USER_AUDIT_DELAY", "2"))
+USER_AUDIT_RETRIES = int(os.environ.get("USER_AUDIT_RETRIES", "1"))
+
+def update_succeeded(result):
+    """UserUpdate returns True or MT_RET_OK (0) on success; False must not pass as 0"""
+    return result is True or (type(result) is int and result == 0)
+
+def _copy(user):
+    try:
+        return copy.copy(user)
+    except Exception:
+        return None # Not copyable (native binding object): callers treat it as a miss
+
+class UserRecordCache:
+    """
+    login -> last known MT5 user record.
+
+    Callers always get their own copy, never the cached object. update(login, **fields) applies
+    only the given fields onto a fresh record (cached within USER_WRITE_MAX_AGE, otherwise
+    re-requested) and caches the written result, so a following request() is served locally.
+    Entries expire after `ttl` and are dropped on pump user notifications (the record changed on the
+    server, e.g. edited from the admin terminal) - except the echo of our own write.
+    """
+    def __init__(self, ttl=USER_CACHE_TTL, write_max_age=USER_WRITE_MAX_AGE, echo_window=USER_ECHO_WINDOW):
+        self.ttl = ttl
+        self.write_max_age = write_max_age
+        self.echo_window = echo_window
+        self.records = {} # login -> (user, cached_at)
+        self.own_writes = {} # login -> time of our last successful UserUpdate (echo pending)
+        self.changed_at = {} # login -> time of the last external change notification
+        self.lock = threading.Lock()
+
+    def get(self, login, max_age=None):
+        entry = self.records.get(int(login))
+        max_age = self.ttl if max_age is None else max_age
+        if entry and time.time() - entry[1] < max_age:
+            user = _copy(entry[0])
+            if user is not None:
+                registry.inc("user_cache_hits_total")
+                return user
+        registry.inc("user_cache_misses_total")
+        return None
+
+    def put(self, user):
+        if user is None: return
+        user = _copy(user)
+        if user is None: return
+        with self.lock:
+            self.records[int(user.Login)] = (user, time.time())
+
+    def invalidate(self, login):
+        with self.lock:
+            self.records.pop(int(login), None)
+
+    def request(self, manager, login, max_age=None):
+        """Cached record (no older than max_age, default ttl), or UserRequest on a miss"""
+        user = self.get(login, max_age)
+        if user is None:
+            user = manager.UserRequest(login)
+            self.put(user)
+        return user
+
+    def update(self, manager, login, **fields):
+        """
+        Writes `fields` (e.g. Enable=0) onto a fresh copy of the record with write-through.
+        Returns the manager's result unchanged (None if the login doesn't exist).
+        """
+        user = self.request(manager, login, max_age=self.write_max_age)
+        if user is None: return None
+        for k, v in fields.items():
+            setattr(user, k, v)
+        result = manager.UserUpdate(user)
+        if update_succeeded(result):
+            with self.lock:
+                self.own_writes[int(login)] = time.time()
+            self.put(user)
+        else:
+            self.invalidate(login)
+        return result
+
+    def changed_since(self, login, ts):
+        """True if the server reported a change to the record (other than our own write) after ts"""
+        changed = self.changed_at.get(int(login))
+        return changed is not None and changed > ts
+
+    def on_update(self, login, kind=None):
+        """Pump callback"""
+        if kind not in (None, "user"): return
+        login = int(login)
+        now = time.time()
+        with self.lock:
+            written = self.own_writes.pop(login, None)
+            if written is not None and now - written < self.echo_window:
+                return # Echo of our own UserUpdate: the cached record is what we wrote
+            self.changed_at[login] = now
+            self.records.pop(login, None)
+
+class UserAuditor:
+    """
+    Deferred read-back of user writes, off the breach path.
+
+    expect(login, Enable=0, ...) queues a check; after `delay` the record is fetched from the server
+    and compared. A mismatch refreshes the cache with the server's record, calls
+    `alert(login, expected, actual)` and re-applies the expected fields through `write(login, fields)`
+    (up to `retries` times) - unless the record was changed on the server after our write (e.g. an
+    admin re-enabled the account), which is respected. fetch and write are blocking and run on the
+    auditor thread.
+    """
+    def __init__(self, cache, fetch, write=None, alert=None, delay=USER_AUDIT_DELAY, retries=USER_AUDIT_RETRIES):
+        self.cache = cache
+        self.fetch = fetch
+        self.write = write
+        self.alert = alert
+        self.delay = delay
+        self.retries = retries
+        self.queue = queue.Queue() # (due, login, expected, attempt); same delay for all -> FIFO is due order
+        self.running = False
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def expect(self, login, attempt=0, **fields):
+        now = time.time()
+        self.queue.put((now + self.delay, int(login), fields, attempt, now))
+
+    def _loop(self):
+        while self.running:
+            try:
+                due, login, expected, attempt, written_at = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.audit(login, expected, attempt, written_at)
+            except Exception as e:
+                print(f"⚠️ User audit failed for {login}: {e}")
+
+    def audit(self, login, expected, attempt=0, written_at=None):
+        user = self.fetch(login)
+        if user is None:
+            print(f"⚠️ User audit: {login} not found")
+            return False
+
+        actual = {k: getattr(user, k, None) for k in expected}
+        if actual == expected:
+            registry.inc("user_audit_ok_total")
+            self.cache.put(user)
+            return True
+
+        registry.inc("user_audit_mismatch_total")
+        print(f"❌ User audit mismatch for {login}: expected {expected}, server has {actual}")
+        self.cache.put(user) # Server is the source of truth
+        if self.alert:
+            self.alert(login, expected, actual)
+
+        if written_at is not None and self.cache.changed_since(login, written_at):
+            print(f"ℹ️ {login} was changed on the server after our write, not re-applying")
+            return False
+        if self.write and attempt < self.retries:
+            print(f"🔄 Re-applying {expected} to {login}")
+            self.write(login, expected)
+            self.expect(login, attempt=attempt + 1, **expected)
+        return False
@@ -0,0 +1,237 @@
+import os
+import json
+import gzip
+import time
+import heapq
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import registry
+
+BRIDGE_ID = int(os.getenv("BRIDGE_ID", "1"))
+
+class WebhookDispatcher:
+    """
+    Shared, non-blocking webhook sender for breach/pass/trade callbacks.
+
+    submit() only enqueues, so the risk sweep and the poller never wait on HTTP.
+    Worker threads drain a bounded queue over a keep-alive connection pool and retry failures
+    with exponential backoff. Each event carries an Idempotency-Key header and duplicate keys
+    (already delivered or still in flight) are dropped.
+    """
+    def __init__(self, workers=4, max_queue=10000, max_retries=5, backoff_base=1.0, backoff_max=60.0, timeout=5, supabase_client=None):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.supabase = supabase_client # For trade_sync_log outcomes
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.retry_heap = [] # (due_time, seq, job)
+        self.retry_lock = threading.Lock()
+        self.seq = 0
+
+        # Recently seen idempotency keys (bounded)
+        self.seen_keys = OrderedDict()
+        self.seen_lock = threading.Lock()
+        self.MAX_SEEN_KEYS = 50000
+
+        self.stats = {"submitted": 0, "sent": 0, "failed": 0, "retried": 0, "dropped": 0, "duplicates": 0}
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"webhook-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+        print(f"🚀 Webhook Dispatcher: {self.workers} workers started")
+
+    def stop(self):
+        self.running = False
+        for t in self.threads:
+            t.join(timeout=1)
+        self.threads = []
+
+    def submit(self, url, payload, headers=None, idempotency_key=None, sync_login=None, deals_count=0, detected_at=None,
+               sync_counts=None, compress=False, on_result=None):
+        """
+        Queue a webhook. Never blocks.
+        sync_login: If set, the final outcome is written to trade_sync_log for this login.
+        sync_counts: Same for a batch, { login: deals_count } (one trade_sync_log row per login).
+        detected_at: Epoch seconds the event was detected; delivery latency is measured from it.
+        compress: gzip the JSON body (Content-Encoding: gzip).
+        on_result: Called as on_result(payload, success, status_code) with the final outcome.
+        Returns False if the event was a duplicate or the queue is full.
+        """
+        if not url: return False
+
+        if idempotency_key:
+            with self.seen_lock:
+                if idempotency_key in self.seen_keys:
+                    self.stats["duplicates"] += 1
+                    return False
+                self.seen_keys[idempotency_key] = True
+                if len(self.seen_keys) > self.MAX_SEEN_KEYS:
+                    self.seen_keys.popitem(last=False)
+
+        job = {
+            "url": url,
+            "payload": payload,
+            "headers": dict(headers or {}),
+            "key": idempotency_key,
+            "sync_login": sync_login,
+            "deals_count": deals_count,
+            "detected_at": detected_at or time.time(),
+            "sync_counts": sync_counts,
+            "on_result": on_result,
+            "body": None,
+            "attempt": 0
+        }
+        if compress:
+            # Encoded once, reused across retries
+            job["body"] = gzip.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+            job["headers"]["Content-Type"] = "application/json"
+            job["headers"]["Content-Encoding"] = "gzip"
+        if idempotency_key:
+            job["headers"]["Idempotency-Key"] = idempotency_key
+
+        try:
+            self.queue.put_nowait(job)
+            self.stats["submitted"] += 1
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            self._forget(idempotency_key)
+            print(f"❌ Webhook Queue Full: dropped {payload.get('event', 'trades')} for {payload.get('login', 'batch')}")
+            return False
+
+    def known(self, key):
+        """True if the key was delivered or is still queued / retrying (a refused submit was a duplicate)"""
+        if not key: return False
+        with self.seen_lock:
+            return key in self.seen_keys
+
+    def _forget(self, key):
+        """Allows a key to be submitted again (after a permanent failure)"""
+        if not key: return
+        with self.seen_lock:
+            self.seen_keys.pop(key, None)
+
+    def _next_job(self):
+        # Due retries first, then fresh events
+        with self.retry_lock:
+            if self.retry_heap and self.retry_heap[0][0] <= time.time():
+                return heapq.heappop(self.retry_heap)[2]
+        try:
+            return self.queue.get(timeout=0.2)
+        except queue.Empty:
+            return None
+
+    def _worker_loop(self):
+        while self.running:
+            job = self._next_job()
+            if job:
+                try:
+                    self._deliver(job)
+                except Exception as e:
+                    print(f"⚠️ Webhook Worker Error: {e}")
+
+    def _deliver(self, job):
+        job["attempt"] += 1
+        payload = job["payload"]
+        error = None
+        status = None
+        try:
+            if job["body"] is not None:
+                res = self.session.post(job["url"], data=job["body"], headers=job["headers"], timeout=self.timeout)
+            else:
+                res = self.session.post(job["url"], json=payload, headers=job["headers"], timeout=self.timeout)
+            status = res.status_code
+            if res.status_code < 400:
+                self.stats["sent"] += 1
+                registry.inc("webhook_sent_total")
+                registry.observe("webhook_delivery_latency_ms", (time.time() - job["detected_at"]) * 1000.0,
+                                 event=payload.get("event", "trades"))
+                self._record(job, True)
+                self._notify(job, True, status)
+                return
+            error = f"HTTP {res.status_code}"
+            retryable = res.status_code >= 500 or res.status_code == 429
+        except Exception as e:
+            error = str(e)
+            retryable = True
+
+        if retryable and job["attempt"] <= self.max_retries:
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (job["attempt"] - 1)))
+            with self.retry_lock:
+                self.seq += 1
+                heapq.heappush(self.retry_heap, (time.time() + delay, self.seq, job))
+            self.stats["retried"] += 1
+            print(f"⚠️ Webhook Failed ({error}) for {payload.get('login', 'batch')}, retry {job['attempt']} in {delay:.1f}s")
+            return
+
+        self.stats["failed"] += 1
+        registry.inc("webhook_failed_total")
+        self._forget(job["key"])
+        self._record(job, False)
+        self._notify(job, False, status)
+        print(f"❌ Webhook Failed for {payload.get('login', 'batch')} after {job['attempt']} attempts: {error}")
+
+    def _notify(self, job, success, status):
+        if not job["on_result"]: return
+        try:
+            job["on_result"](job["payload"], success, status)
+        except Exception as e:
+            print(f"⚠️ Webhook result callback failed: {e}")
+
+    def _record(self, job, success):
+        """Writes the final outcome to trade_sync_log (trade callbacks only)"""
+        counts = job["sync_counts"] or {}
+        if job["sync_login"] is not None:
+            counts = dict(counts)
+            counts[job["sync_login"]] = job["deals_count"]
+        if not self.supabase or not counts: return
+        now = datetime.utcnow().isoformat()
+        try:
+            self.supabase.table("trade_sync_log").insert([{
+                "bridge_id": BRIDGE_ID,
+                "login": int(login),
+                "new_deals_count": int(count),
+                "webhook_success": success,
+                "created_at": now
+            } for login, count in counts.items()]).execute()
+        except Exception as e:
+            print(f"⚠️ trade_sync_log insert failed: {e}")
+
+# --- SHARED INSTANCE ---
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher(supabase_client=None):
+    """Returns the process-wide dispatcher, starting it on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = WebhookDispatcher(
+                workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+                max_queue=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+                max_retries=int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+            )
+            _dispatcher.start()
+        if supabase_client and not _dispatcher.supabase:
+            _dispatcher.supabase = supabase_client
+    return _dispatcher